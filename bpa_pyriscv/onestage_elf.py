@@ -12,6 +12,7 @@ Professor Marchiori
 from alu import ALU, AluFunVal
 from branch_cond_gen import BranchCondGen
 from branch_targ_gen import BranchTargGen
+from collections import namedtuple
 from control_signals import ControlSignals
 from counters import Counters
 from datamem import DataMem
@@ -70,6 +71,20 @@ else:
 # the PC register
 PC = Register()
 
+# one executed control flow instruction, as yielded by run():
+# mnemonic_class is the instruction count category of the
+# instruction ("branch", "jump" or "jump_reg"), actual_pc is
+# the pc of the instruction executed after it, and is_taken
+# is always True for jumps
+BranchEvent = namedtuple(
+   "BranchEvent",
+   ["pc", "ir", "target_pc", "actual_pc", "is_taken", "mnemonic_class"]
+)
+
+# exit code requested by the program through a syscall, or
+# None while the program is still running
+exit_code = None
+
 def display():
    if instr == None:
        return "PC: xxxxxxxx, IR: xxxxxxxx"
@@ -185,6 +200,7 @@ data_mem = None
 sym_table = None
 # handle syscall
 def _handle_syscall():
+    global exit_code
     if ControlSignals.get_mem_rw() == 0: return False
     if "tohost" not in sym_table: return False
     # val = imem[sym_table["tohost"]]
@@ -207,7 +223,8 @@ def _handle_syscall():
                print("Final register values")
                RegFile.display()
            if PRINT_COUNTERS_ON: print(Counters.__str__())
-           sys.exit(val>>1)
+           exit_code = val>>1
+           return True
        else:
           try:
               DataMem.read(val, byte_count = 8, signed = True)
@@ -225,13 +242,15 @@ def _handle_syscall():
           DataMem._mem.mem[sym_table['fromhost']] = 1
 
 def _handle_linux_syscall():
+   global exit_code
    if RegFile.reg_vals[17] != 93: return False
    ret_code = RegFile.reg_vals[10]
    if ret_code == None: return False
    if ret_code & 0x1 != 0:
        if PRINT_LINUX_SYSCALL_ON: print(f"TEST #0x{ret_code>>1:x} FAIL")
        if PRINT_COUNTERS_ON: print(Counters.__str__())
-       sys.exit()
+       exit_code = 0
+       return True
  
 def _print_func_header(addr, reset=False):
     # if reset: name = "reset"
@@ -302,11 +321,8 @@ def _inst_stats_update():
         if instr.get_mnemonic()[1] == "W": amount = 4
         Counters.increment("mem_" + category_rw_sel + "_bytes", amount=amount)  
 
-data_paths = []
-if len(sys.argv) < 2: data_paths.append('riscv_isa/programs/return')
-else: 
-    for i in range(len(sys.argv)-1):
-        data_paths.append(sys.argv[i+1])
+    return counter
+
 # init other vars for processor loop
 global startup
 global instr
@@ -317,18 +333,24 @@ instr = None
 t = None
 maXkcycles = 0
 
-i = -1
-while i < len(data_paths)-1:
-   i = i+1
-   #print('DATA PATH IS', data_paths, i, len(data_paths))
-   data_path = data_paths[i]
-   
-   if data_path[0] == "-":
-       if data_path[1] == "x":
-           i = i+1
-           maXkcycles = int(data_paths[i])
-       continue
-
+def run(data_path, max_cycles=0):
+   """
+   Runs the program in the elf file at data_path and yields a
+   BranchEvent for every branch, jal and jalr instruction it
+   executes, in execution order, so that branch predictors can
+   consume the program's control flow in the same process while
+   it runs, without printing and parsing a text trace.
+
+   max_cycles stops the program after that many cycles (0 means
+   no limit). If the program exits through a syscall, exit_code is
+   set to the exit code it requested.
+
+   The processor state is global to this module, so only one
+   program can run at a time.
+   """
+   global startup, instr, t, pc_val, alu_out
+   global sym_table, imem, data_mem, exit_code
+   exit_code = None
    elf_load_data = load_elf(data_path, quiet = not PRINT_DEBUG_ON)
    elf_imem = elf_load_data[0]
    sym_table = elf_load_data[1]
@@ -351,7 +373,7 @@ while i < len(data_paths)-1:
    for t in itertools.count():
       Counters.increment("mcycle")
       # if t % 10000 == 0: print("cycle #: " + str(t))
-      if maXkcycles != 0 and t >= maXkcycles:
+      if max_cycles != 0 and t >= max_cycles:
           break
       # RESET the PC register
       if startup:
@@ -387,7 +409,7 @@ while i < len(data_paths)-1:
       
       instr = Instruction(imem[pc_val], pc_val)
       Counters.increment("inst_fetch_bytes", amount=4)
-      _inst_stats_update()
+      mnemonic_class = _inst_stats_update()
 
 
  
@@ -472,6 +494,8 @@ while i < len(data_paths)-1:
             if is_forward: Counters.increment("branch", "forward_taken")
             else: Counters.increment("branch", "backward_taken")
 
+            yield BranchEvent(curr_pc, instr.val, branch_pc, branch_pc,
+                              True, mnemonic_class)
             continue
          else: 
             ControlSignals.set_pc_sel(0)
@@ -479,6 +503,9 @@ while i < len(data_paths)-1:
             # update counter (if not taken)
             if is_forward: Counters.increment("branch", "forward_not_taken")
             else: Counters.increment("branch", "backward_not_taken")
+
+            yield BranchEvent(curr_pc, instr.val, branch_pc, curr_pc + 4,
+                              False, mnemonic_class)
       elif instr._type == instrTypes.UJ:
           ControlSignals.set_pc_sel(3)
       elif instr._get_instr_name_equivalence(["JALR"]):
@@ -489,6 +516,11 @@ while i < len(data_paths)-1:
 
       # after IType calculated
       JumpRegTargGen.set_jalr(RegFile.get_rs1(), IType.get_imm())
+
+      if ControlSignals.get_pc_sel() in (1, 3):
+         jump_pc = as_twos_comp(pc_sel_mux(ControlSignals.get_pc_sel()))
+         yield BranchEvent(pc_val, instr.val, jump_pc, jump_pc,
+                           True, mnemonic_class)
       
       # select op1 and op2
       op1=op1sel_mux(ControlSignals.get_op1sel())
@@ -524,10 +556,10 @@ while i < len(data_paths)-1:
                                 # stopping, i.e. halt or exit, break out of loop
 
       # then handle SYSCALL   
-      if _handle_syscall(): break # break for exit if specified by syscall
+      if _handle_syscall(): return # return for exit if specified by syscall
 
       # then handle Linux SYSCALL
-      if instr.get_mnemonic() == 'ecall' and _handle_linux_syscall(): break
+      if instr.get_mnemonic() == 'ecall' and _handle_linux_syscall(): return
 
    if PRINT_FINAL_REG_ON:
       print("Final register values")
@@ -535,3 +567,25 @@ while i < len(data_paths)-1:
    
    if PRINT_LINUX_SYSCALL_ON: print("TEST PASS")
    if PRINT_COUNTERS_ON: print(Counters.__str__())
+
+if __name__ == "__main__":
+   data_paths = []
+   if len(sys.argv) < 2: data_paths.append('riscv_isa/programs/return')
+   else: 
+       for i in range(len(sys.argv)-1):
+           data_paths.append(sys.argv[i+1])
+
+   i = -1
+   while i < len(data_paths)-1:
+      i = i+1
+      #print('DATA PATH IS', data_paths, i, len(data_paths))
+      data_path = data_paths[i]
+      
+      if data_path[0] == "-":
+          if data_path[1] == "x":
+              i = i+1
+              maXkcycles = int(data_paths[i])
+          continue
+
+      for branch_event in run(data_path, maXkcycles): pass
+      if exit_code != None: sys.exit(exit_code)
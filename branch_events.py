@@ -0,0 +1,433 @@
+'''
+Compact array-backed branch events
+
+BranchEvents replaces the list of branch event dictionaries
+(BranchPredictorInfo.grouped_branch_seqs) with a struct of arrays:
+
+    static branch table   one row per unique (pc, target pc, IR) branch instruction:
+                          static_pc, static_target_pc, static_ir (uint32 each)
+    dynamic events        one entry per executed branch: branch_id (uint32 row
+                          of the static branch table) and the taken flag, bit
+                          packed eight events to a byte (taken_bits)
+
+The pc that was actually taken is the target pc of a taken branch and the
+next sequential pc of a not-taken one, so it is not stored per event; the
+rare events that disagree (e.g. at the seam of two concatenated traces) are
+kept in a small exception table. A dynamic event therefore costs a little
+over 4 bytes instead of several hundred bytes of dictionaries and strings,
+and predictors can iterate over branch_id and look up per-static-branch
+values in plain arrays.
+
+Unconditional jumps (jal and jalr: calls, returns, indirect jumps) are kept
+apart in a JumpEvents (BranchEvents.jumps), so that everything that counts
+or predicts conditional branches sees the same events as before. A jump
+records its static jump, the pc it actually jumped to (a jalr's target is
+not fixed by its pc) and the number of branch events executed before it,
+which places it in the branch event stream.
+'''
+
+from array import array
+
+import numpy as np
+
+INSTR_BYTES = 4
+
+## (name, dtype) of the per-event columns that parsers produce and that
+## BranchEvents.from_columns interns
+EVENT_COLUMNS = (
+    ("pc", np.dtype(np.uint32)),
+    ("target_pc", np.dtype(np.uint32)),
+    ("ir", np.dtype(np.uint32)),
+    ("actual_pc", np.dtype(np.uint32)),
+    ("is_taken", np.dtype(np.uint8)),
+)
+
+## (name, dtype) of the per-jump columns that parsers produce next to
+## EVENT_COLUMNS; jump_branch_index is the number of branch events
+## executed before the jump
+JUMP_COLUMNS = (
+    ("jump_pc", np.dtype(np.uint32)),
+    ("jump_ir", np.dtype(np.uint32)),
+    ("jump_actual_pc", np.dtype(np.uint32)),
+    ("jump_branch_index", np.dtype(np.uint64)),
+)
+
+def events_to_columns(branch_events):
+    '''
+    Packs an iterable of branch event dictionaries (as yielded by
+    iter_branch_events) into a dictionary of per-event columns (see
+    EVENT_COLUMNS). The events are consumed one at a time, so a generator
+    can be passed in without the events ever being held in memory as
+    dictionaries.
+    '''
+    pc = array("I")
+    target_pc = array("I")
+    ir = array("I")
+    actual_pc = array("I")
+    is_taken = array("B")
+    for branch_event in branch_events:
+        pc.append(int(branch_event["instr"]["pc"], 16))
+        target_pc.append(int(branch_event["target_pc"], 16))
+        ir.append(int(branch_event["instr"]["ir"], 16))
+        actual_pc.append(int(branch_event["actual_pc"], 16))
+        is_taken.append(branch_event["is_taken"])
+    return {"pc": np.frombuffer(pc, dtype=np.uint32),
+            "target_pc": np.frombuffer(target_pc, dtype=np.uint32),
+            "ir": np.frombuffer(ir, dtype=np.uint32),
+            "actual_pc": np.frombuffer(actual_pc, dtype=np.uint32),
+            "is_taken": np.frombuffer(is_taken, dtype=np.uint8)
+    }
+
+def empty_columns():
+    return {name: np.zeros(0, dtype=dtype) for name, dtype in EVENT_COLUMNS + JUMP_COLUMNS}
+
+def concatenate_columns(columns_list):
+    '''
+    Concatenates a list of per-event column dictionaries, in order. The
+    jump_branch_index of each dictionary's jumps is offset by the number of
+    branch events in the dictionaries before it; dictionaries without jump
+    columns (see events_to_columns) have no jumps.
+    '''
+    if len(columns_list) == 0: return empty_columns()
+    concatenated = {name: np.concatenate([columns[name] for columns in columns_list]).astype(dtype, copy=False)
+                    for name, dtype in EVENT_COLUMNS}
+    empty = empty_columns()
+    for name, dtype in JUMP_COLUMNS:
+        concatenated[name] = np.concatenate([columns.get(name, empty[name]) for columns in columns_list]).astype(dtype, copy=False)
+    offsets = np.cumsum([0] + [len(columns["pc"]) for columns in columns_list[:-1]], dtype=np.uint64)
+    num_jumps = [len(columns.get("jump_pc", empty["jump_pc"])) for columns in columns_list]
+    concatenated["jump_branch_index"] += np.repeat(offsets, num_jumps)
+    return concatenated
+
+class JumpEvents:
+    '''
+    Struct of arrays of the jal and jalr events of a trace: a static jump
+    table (static_pc, static_ir) and, per executed jump, its static jump
+    (jump_id), the pc it jumped to (actual_pc) and the number of branch
+    events executed before it (branch_index, non-decreasing)
+    '''
+
+    def __init__(self, static_pc, static_ir, jump_id, actual_pc, branch_index):
+        self.static_pc = static_pc
+        self.static_ir = static_ir
+        self.jump_id = jump_id
+        self.actual_pc = actual_pc
+        self.branch_index = branch_index
+
+    @classmethod
+    def from_columns(cls, columns):
+        '''
+        Interns the per-jump columns (see JUMP_COLUMNS) of a dictionary of
+        columns into a static jump table; no columns means no jumps
+        '''
+        if "jump_pc" not in columns: columns = empty_columns()
+        keys = np.empty(len(columns["jump_pc"]), dtype=[("pc", np.uint32), ("ir", np.uint32)])
+        keys["pc"] = columns["jump_pc"]
+        keys["ir"] = columns["jump_ir"]
+        static_keys, jump_id = np.unique(keys, return_inverse=True)
+        return cls(np.ascontiguousarray(static_keys["pc"]),
+                   np.ascontiguousarray(static_keys["ir"]),
+                   jump_id.reshape(-1).astype(np.uint32),
+                   np.asarray(columns["jump_actual_pc"], dtype=np.uint32),
+                   np.asarray(columns["jump_branch_index"], dtype=np.uint64))
+
+    @property
+    def num_static(self):
+        return len(self.static_pc)
+
+    @property
+    def pc(self):
+        return self.static_pc[self.jump_id]
+
+    @property
+    def ir(self):
+        return self.static_ir[self.jump_id]
+
+    def get_block(self, start, stop, last = False):
+        '''
+        return: JumpEvents of the jumps executed before branch events
+        [start, stop), or also after them if last, sharing the static jump
+        table, with branch_index counted from start
+        '''
+        lo = int(np.searchsorted(self.branch_index, start))
+        hi = len(self.jump_id) if last else int(np.searchsorted(self.branch_index, stop))
+        return JumpEvents(self.static_pc, self.static_ir, self.jump_id[lo:hi],
+                          self.actual_pc[lo:hi], self.branch_index[lo:hi] - np.uint64(start))
+
+    def to_columns(self):
+        return {"jump_pc": self.pc,
+                "jump_ir": self.ir,
+                "jump_actual_pc": self.actual_pc,
+                "jump_branch_index": self.branch_index
+        }
+
+    def get_arrays(self):
+        return {"jump_static_pc": self.static_pc,
+                "jump_static_ir": self.static_ir,
+                "jump_id": self.jump_id,
+                "jump_actual_pc": self.actual_pc,
+                "jump_branch_index": self.branch_index
+        }
+
+    def __len__(self):
+        return len(self.jump_id)
+
+    def __repr__(self) -> str:
+        return f"JumpEvents(num_jumps={len(self)}, num_static={self.num_static})"
+
+class BranchEvents:
+
+    def __init__(self, static_pc, static_target_pc, static_ir, branch_id, taken_bits,
+                 num_events = None, exception_index = None, exception_actual_pc = None,
+                 jumps = None):
+        '''
+        static_pc, static_target_pc, static_ir: static branch table columns
+        branch_id: static branch table row of each event
+        taken_bits: np.packbits of the taken flag of each event
+        num_events: number of events (defaults to len(branch_id))
+        exception_index, exception_actual_pc: events whose actual pc is not
+        the one implied by their taken flag, and their actual pcs
+        jumps: JumpEvents of the trace's jal and jalr instructions (defaults to none)
+        '''
+        self.static_pc = static_pc
+        self.static_target_pc = static_target_pc
+        self.static_ir = static_ir
+        self.branch_id = branch_id
+        self.taken_bits = taken_bits
+        self.num_events = len(branch_id) if num_events is None else num_events
+        if exception_index is None: exception_index = np.zeros(0, dtype=np.uint64)
+        if exception_actual_pc is None: exception_actual_pc = np.zeros(0, dtype=np.uint32)
+        self.exception_index = exception_index
+        self.exception_actual_pc = exception_actual_pc
+        if jumps is None: jumps = JumpEvents.from_columns({})
+        self.jumps = jumps
+
+    @classmethod
+    def from_columns(cls, columns):
+        '''
+        Interns a dictionary of per-event columns (see EVENT_COLUMNS, and
+        JUMP_COLUMNS if it has jumps) into a static branch table and compact
+        dynamic events
+        '''
+        pc = np.asarray(columns["pc"], dtype=np.uint32)
+        target_pc = np.asarray(columns["target_pc"], dtype=np.uint32)
+        ir = np.asarray(columns["ir"], dtype=np.uint32)
+        is_taken = np.asarray(columns["is_taken"]).astype(bool)
+
+        # one row per unique (pc, target pc, IR); a branch's target and
+        # IR are fixed by its pc, so this is one row per branch in the code
+        keys = np.empty(len(pc), dtype=[("pc", np.uint32), ("target_pc", np.uint32), ("ir", np.uint32)])
+        keys["pc"] = pc
+        keys["target_pc"] = target_pc
+        keys["ir"] = ir
+        static_keys, branch_id = np.unique(keys, return_inverse=True)
+
+        implied_actual_pc = np.where(is_taken, target_pc, pc + INSTR_BYTES)
+        exception_index = np.flatnonzero(implied_actual_pc != columns["actual_pc"]).astype(np.uint64)
+        return cls(np.ascontiguousarray(static_keys["pc"]),
+                   np.ascontiguousarray(static_keys["target_pc"]),
+                   np.ascontiguousarray(static_keys["ir"]),
+                   branch_id.reshape(-1).astype(np.uint32),
+                   np.packbits(is_taken),
+                   len(pc),
+                   exception_index,
+                   np.asarray(columns["actual_pc"], dtype=np.uint32)[exception_index],
+                   JumpEvents.from_columns(columns))
+
+    @property
+    def num_static(self):
+        return len(self.static_pc)
+
+    @property
+    def taken(self):
+        '''
+        return: bool array of the taken flag of each event
+        '''
+        return np.unpackbits(self.taken_bits, count=self.num_events).astype(bool)
+
+    @property
+    def pc(self):
+        return self.static_pc[self.branch_id]
+
+    @property
+    def target_pc(self):
+        return self.static_target_pc[self.branch_id]
+
+    @property
+    def ir(self):
+        return self.static_ir[self.branch_id]
+
+    @property
+    def actual_pc(self):
+        actual_pc = np.where(self.taken, self.target_pc, self.pc + INSTR_BYTES).astype(np.uint32)
+        actual_pc[self.exception_index] = self.exception_actual_pc
+        return actual_pc
+
+    @property
+    def is_taken(self):
+        return self.taken.astype(np.uint8)
+
+    def get_block(self, start, stop):
+        '''
+        return: BranchEvents of the events [start, stop), sharing the static
+        branch table and viewing (not copying) the dynamic arrays;
+        start must be a multiple of 8 so the taken bits stay byte aligned
+        '''
+        if start % 8 != 0:
+            raise ValueError(f"block start {start} is not a multiple of 8")
+        stop = min(stop, self.num_events)
+        in_block = (self.exception_index >= start) & (self.exception_index < stop)
+        return BranchEvents(self.static_pc, self.static_target_pc, self.static_ir,
+                            self.branch_id[start:stop],
+                            self.taken_bits[start // 8:(stop + 7) // 8],
+                            stop - start,
+                            self.exception_index[in_block] - start,
+                            self.exception_actual_pc[in_block],
+                            self.jumps.get_block(start, stop, stop >= self.num_events))
+
+    def iter_blocks(self, block_size):
+        '''
+        Yields consecutive get_block views of block_size events (rounded up
+        to a multiple of 8) covering every event, and at least one block
+        so that the jumps of a trace without branches are covered too
+        '''
+        block_size = (block_size + 7) // 8 * 8
+        for start in range(0, max(self.num_events, 1), block_size):
+            yield self.get_block(start, start + block_size)
+
+    def to_columns(self):
+        '''
+        return: the per-event columns (see EVENT_COLUMNS) and per-jump
+        columns (see JUMP_COLUMNS) as a dictionary
+        '''
+        columns = {name: getattr(self, name) for name, _ in EVENT_COLUMNS}
+        columns.update(self.jumps.to_columns())
+        return columns
+
+    def get_arrays(self):
+        '''
+        return: every array the events are stored in, by name
+        '''
+        return {"static_pc": self.static_pc,
+                "static_target_pc": self.static_target_pc,
+                "static_ir": self.static_ir,
+                "branch_id": self.branch_id,
+                "taken_bits": self.taken_bits,
+                "exception_index": self.exception_index,
+                "exception_actual_pc": self.exception_actual_pc,
+                **self.jumps.get_arrays()
+        }
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.get_arrays().values())
+
+    def __len__(self):
+        return self.num_events
+
+    def __reduce__(self):
+        arrays = {name: np.asarray(array) for name, array in self.get_arrays().items()}
+        return (self.__class__, (arrays["static_pc"], arrays["static_target_pc"],
+                                 arrays["static_ir"], arrays["branch_id"],
+                                 arrays["taken_bits"], self.num_events,
+                                 arrays["exception_index"], arrays["exception_actual_pc"],
+                                 JumpEvents(arrays["jump_static_pc"], arrays["jump_static_ir"],
+                                            arrays["jump_id"], arrays["jump_actual_pc"],
+                                            arrays["jump_branch_index"])))
+
+    def __repr__(self) -> str:
+        return f"BranchEvents(num_events={self.num_events}, num_static={self.num_static})"
+
+class EventBlock:
+    '''
+    Python-list view of a run of branch events, decoded once and shared by
+    every predictor that is run over it (see TournamentPred.run_block and
+    sweep). Plain lists are much faster than arrays to index one element
+    at a time in a predictor loop.
+    '''
+
+    def __init__(self, branch_events, static_cache = None):
+        '''
+        branch_events: BranchEvents to decode
+        static_cache: dictionary of per-static-branch lists to share
+        between blocks of the same trace (see get_pc_index)
+        '''
+        self.events = branch_events
+        self.branch_ids = branch_events.branch_id.tolist()
+        self.taken = branch_events.taken.tolist()
+        self._actual_pcs = None
+        self._jumps = None
+        self.static_cache = {} if static_cache is None else static_cache
+
+    def __len__(self):
+        return len(self.branch_ids)
+
+    @property
+    def actual_pcs(self):
+        # only the target predictors need the actual pcs, so they are
+        # decoded on first use
+        if self._actual_pcs is None:
+            self._actual_pcs = self.events.actual_pc.tolist()
+        return self._actual_pcs
+
+    @property
+    def static_pcs(self):
+        if "pc" not in self.static_cache:
+            self.static_cache["pc"] = self.events.static_pc.tolist()
+        return self.static_cache["pc"]
+
+    def get_jumps(self):
+        '''
+        return: (jump_ids, actual_pcs, branch_indices) lists of the block's
+        jumps (see JumpEvents), decoded on first use, since only the jump
+        predictors need them
+        '''
+        if self._jumps is None:
+            jumps = self.events.jumps
+            self._jumps = (jumps.jump_id.tolist(), jumps.actual_pc.tolist(),
+                           jumps.branch_index.tolist())
+        return self._jumps
+
+    @property
+    def static_jump_pcs(self):
+        if "jump_pc" not in self.static_cache:
+            self.static_cache["jump_pc"] = self.events.jumps.static_pc.tolist()
+        return self.static_cache["jump_pc"]
+
+    @property
+    def static_jump_irs(self):
+        if "jump_ir" not in self.static_cache:
+            self.static_cache["jump_ir"] = self.events.jumps.static_ir.tolist()
+        return self.static_cache["jump_ir"]
+
+    def get_pc_index(self, shift, bits):
+        '''
+        return: list of (pc >> shift) & (2^bits - 1) for every static
+        branch, computed once per (shift, bits)
+        '''
+        key = ("pc_index", shift, bits)
+        if key not in self.static_cache:
+            static_pc = self.events.static_pc.astype(np.uint64)
+            self.static_cache[key] = ((static_pc >> shift) & (2**bits - 1)).tolist()
+        return self.static_cache[key]
+
+"""
+Unit Tests for BranchEvents
+"""
+if __name__ == "__main__":
+    # a loop branch at 0x80000010 taken twice, then falling through
+    events = BranchEvents.from_columns({
+        "pc": np.array([0x80000010] * 3, dtype=np.uint32),
+        "target_pc": np.array([0x80000000] * 3, dtype=np.uint32),
+        "ir": np.array([0xfe0098e3] * 3, dtype=np.uint32),
+        "actual_pc": np.array([0x80000000, 0x80000000, 0x80000014], dtype=np.uint32),
+        "is_taken": np.array([1, 1, 0], dtype=np.uint8)
+    })
+    print("Should be BranchEvents(num_events=3, num_static=1), got: " + repr(events))
+    print("Should be [0, 0, 0], got: " + str(events.branch_id.tolist()))
+    print("Should be [True, True, False], got: " + str(events.taken.tolist()))
+    print("Should be 80000014, got: " + f"{int(events.actual_pc[2]):08x}")
+    block = EventBlock(events.get_block(0, 2))
+    print("Should be [True, True], got: " + str(block.taken))
+    print("Should be [1], got: " + str(block.get_pc_index(4, 2)))
+    print("Should be JumpEvents(num_jumps=0, num_static=0), got: " + repr(events.jumps))
@@ -6,9 +6,167 @@ Professor Alan Marchiori
 Final Project: Branch Predictor Info
 """
 
+import bz2
+import gzip
+import io
+import lzma
+import os
 import re
 import sys
 
+from branch_events import BranchEvents, events_to_columns
+from riscv_decode import get_branch_target, is_branch
+
+## version of the parsing rules below; bump it whenever a change to them
+## would parse the same trace into different branch events, so that
+## parsed traces cached by trace_cache are not reused
+PARSER_VERSION = 3
+
+## one precompiled pattern matches a whole instruction line, e.g.
+##     1: PC: 80000000, IR: 00000093, li ra,0x0
+## groups: instruction number, PC, IR, and the instruction string,
+## which is optional, since instructions are classified by their IR
+INSTR_LINE_REGEX = re.compile(
+	r'^\s*(\d+): PC: ([a-fA-F0-9]{8}), IR: ([a-fA-F0-9]{8})(?:, (.+?))?\s*$'
+)
+
+## number of instructions per chunk yielded by iter_instr_chunks
+INSTR_CHUNK_SIZE = 2**16
+
+## magic bytes at the start of a compressed trace, and the stdlib
+## module that decodes it
+COMPRESSION_MAGICS = (
+	(b"\x1f\x8b", gzip),
+	(b"\xfd7zXZ\x00", lzma),
+	(b"BZh", bz2),
+)
+## file extension of a compressed trace to write, and the stdlib
+## module that encodes it
+COMPRESSION_EXTS = {
+	".gz": gzip,
+	".xz": lzma,
+	".bz2": bz2,
+}
+
+def get_compression(instr_filepath: str, mode: str = "r"):
+	"""
+	return: the stdlib module (gzip, lzma or bz2) that decodes or
+	encodes instr_filepath, or None if it is not compressed. Files
+	opened for reading are recognized by their magic bytes, files
+	opened for writing by their extension.
+	"""
+	if "r" in mode:
+		with open(instr_filepath, "rb") as instr_file:
+			head = instr_file.read(max(len(magic) for magic, _ in COMPRESSION_MAGICS))
+		for magic, codec in COMPRESSION_MAGICS:
+			if head.startswith(magic): return codec
+		return None
+	return COMPRESSION_EXTS.get(os.path.splitext(instr_filepath)[1].lower())
+
+def open_instr_file(instr_filepath: str, mode: str = "r"):
+	"""
+	Opens a text instruction trace for reading ("r") or writing ("w"),
+	compressed with gzip, xz or bz2 or not compressed at all. Compressed
+	traces are decoded and encoded as a stream, so they are never fully
+	inflated in memory.
+	"""
+	codec = get_compression(instr_filepath, mode)
+	if codec == None: return open(instr_filepath, mode)
+	return codec.open(instr_filepath, mode + "t")
+
+def open_instr_fileobj(fileobj):
+	"""
+	Wraps an open binary file object holding a text instruction
+	trace, compressed or not, so that it can be read as text lines
+	"""
+	if not hasattr(fileobj, "peek"): fileobj = io.BufferedReader(fileobj)
+	head = fileobj.peek(max(len(magic) for magic, _ in COMPRESSION_MAGICS))
+	for magic, codec in COMPRESSION_MAGICS:
+		if head.startswith(magic):
+			return io.TextIOWrapper(codec.open(fileobj, "rb"))
+	return io.TextIOWrapper(fileobj)
+
+def iter_instrs(instr_file):
+	"""
+	Lazily yields one dictionary per instruction line
+	of instr_file (any iterable of lines), in the same
+	format as BranchPredictorInfo.instr_dict_list:
+
+	{"num": 1, "pc": "80000000", "ir": "00000093", "str": "li ra,0x0"}
+
+	Lines that are not instructions (headers, syscall
+	output, etc.) are skipped.
+	"""
+	for line in instr_file:
+		match = INSTR_LINE_REGEX.match(line)
+		if match is None: continue
+		yield {"num": int(match.group(1)),
+			   "pc": match.group(2),
+			   "ir": match.group(3),
+			   "str": match.group(4)
+		}
+
+def iter_instr_chunks(instr_file, chunk_size: int = INSTR_CHUNK_SIZE):
+	"""
+	Lazily yields the instructions of instr_file (any iterable of
+	lines) in chunks of up to chunk_size instructions, as a pair of
+	lists of the 8-digit hex pc and IR strings of the instructions.
+	Only one chunk is held in memory at a time; the chunks can be
+	decoded and classified as whole arrays (see riscv_decode).
+	"""
+	pcs = []
+	irs = []
+	for line in instr_file:
+		match = INSTR_LINE_REGEX.match(line)
+		if match is None: continue
+		pcs.append(match.group(2))
+		irs.append(match.group(3))
+		if len(pcs) == chunk_size:
+			yield pcs, irs
+			pcs = []
+			irs = []
+	if len(pcs) > 0: yield pcs, irs
+
+def iter_branch_events(instr_file):
+	"""
+	Lazily yields one branch sequence or branch event, so to
+	speak, per branch instruction of instr_file (any iterable of
+	lines), in the same format as
+	BranchPredictorInfo.grouped_branch_seqs.
+
+	Branches are the instructions whose IR has the conditional
+	branch opcode, and the target pc is computed from the IR's
+	B-type immediate, so the instruction string is not needed.
+
+	The file is read a line at a time and each line is matched
+	once, so memory use does not depend on the size of the
+	trace. A branch event can only be yielded once the next
+	instruction has been read, because the pc of that
+	instruction is the pc that was actually taken; a branch
+	that ends the trace has no next instruction and is dropped.
+	"""
+	pending = None # branch event waiting for the next instruction
+	for line in instr_file:
+		match = INSTR_LINE_REGEX.match(line)
+		if match is None: continue
+		pc = match.group(2)
+		if pending is not None:
+			pending["actual_pc"] = pc
+			pending["is_taken"] = pc == pending["target_pc"]
+			yield pending
+			pending = None
+		ir = int(match.group(3), 16)
+		if is_branch(ir):
+			target_pc = f"{get_branch_target(int(pc, 16), ir):08x}"
+			pending = {"instr": {"pc": pc,
+								 "ir": match.group(3),
+								 "str": match.group(4)
+					   },
+					   "actual_pc": None,
+					   "target_pc": target_pc,
+					   "is_taken": None
+					   }
+
 class BranchPredictorInfo:
 	"""
 	This is a static class. There is only one "instance" of the class.
@@ -27,6 +185,10 @@ class BranchPredictorInfo:
 	and the target pc specified in the branch instruction itself. Finally, specific types of branch predictors can
 	be run on the imported sequence of instructions and, consequently, the analyses of their performance can be 
 	outputted as well.
+
+	Because there is only one "instance", only one trace can be imported per process.
+	To hold several traces at once, or to pass traces to other processes, use the
+	instance-based Trace class in branch_trace.py instead.
 	"""
 
 	# Class Fields
@@ -39,127 +201,89 @@ class BranchPredictorInfo:
 	## list of dictionaries, where each dictionary
 	## encapsulates an instruction
 	instr_dict_list = None
+	## BranchEvents holding every branch sequence or branch
+	## event, so to speak, as compact arrays (see branch_events)
+	branch_events = None
 	## list of dictionaries, where each dictionary
 	## encapsulates a branch sequence or branch event, so to speak	  
 	grouped_branch_seqs = None
 
-	def init():
+	def init(instr_filepath: str = None):
 		"""
 		Initializes class fields above with the help of
 		helper initialization methods
+
+		instr_filepath defaults to the first command line argument
 		"""
 
-		BranchPredictorInfo.instr_filepath = sys.argv[1] # filepath is passed in as an argument
-		BranchPredictorInfo.instr_file = open(BranchPredictorInfo.instr_filepath)
-		
+		if instr_filepath == None:
+			instr_filepath = sys.argv[1] # filepath is passed in as an argument
+		BranchPredictorInfo.instr_filepath = instr_filepath
+		BranchPredictorInfo.instr_file = open_instr_file(BranchPredictorInfo.instr_filepath)
 
-		BranchPredictorInfo.instr_dict_list = []
-		BranchPredictorInfo._import_instrs()
-		BranchPredictorInfo.grouped_branch_seqs = []
-		BranchPredictorInfo._group_branch_seqs()
+		# MINOR: instr_dict_list and grouped_branch_seqs are only needed
+		# by get_str, so they are filled in lazily there instead of being
+		# held in memory here; branch_events holds the same branch events
+		BranchPredictorInfo.instr_dict_list = None
+		BranchPredictorInfo.grouped_branch_seqs = None
+		BranchPredictorInfo._import_branch_events()
 
 	def _import_instrs():
 		"""
 		Sets the BranchPredictorInfo's list of instructions
-		from the output file specified in the class fieldsd
+		from the output file specified in the class fields
 
-		For each line in the file containing the list of
-		instructions, identify the 8-digit hex values.
-		The first one is the PC, and the second one is the
-		instruction value, IR.
+		Each instruction line (for example:
+		1: PC: 80000000, IR: 00000093, li ra,0x0) is matched
+		by iter_instrs, and the instruction is stored at the
+		index of its instruction number, so the instruction
+		number is preserved through the list index.
+		"""
+		BranchPredictorInfo.instr_dict_list = []
+		with open_instr_file(BranchPredictorInfo.instr_filepath) as instr_file:
+			for instr in iter_instrs(instr_file):
+				instr_num = instr.pop("num")
 
-		For example: 1: PC: 80000000, IR: 00000093, li ra,0x0
-		
-		Then, provided we found at least two hex values (PC and IR),
-		we can continue interpreting this line as an instruction, rather
-		than a miscellaneous header or some other non-instruction line
-		that is unexpectedly present in the file.
-
-		Then, the method extracts the line number as the first number
-		that comes before a colon, as seen in the instruction example 
-		above.
-
-		Now, the program finds the instruction string. In the example shown
-		above, that would be li ra,0x0. We isolate all of the text that
-		comes after the second comma (#: PC: x, IR: x, instruction string).
-		Then, we just store it in the list of instructions, where each instruction
-		is encapsulated in a dictionary containing the pc, ir, and string.
+				# MINOR: this method grows the list as needed; rationale:
+				# we cannot assign a value to a particular list index without
+				# having initialized it
+				BranchPredictorInfo._grow_instr_dict_list(instr_num)
+
+				BranchPredictorInfo.instr_dict_list[instr_num] = instr
+
+	def _import_branch_events():
+		"""
+		Sets the BranchPredictorInfo's branch events from the
+		output file specified in the class fields. The branch
+		events are streamed through iter_branch_events (see
+		_group_branch_seqs) and packed into a BranchEvents as they
+		are read, so they are never all held as dictionaries.
 		"""
-		lines = BranchPredictorInfo.instr_file.readlines()
-		for line in lines:
-			regex = '([a-fA-F0-9]{8})'
-			hex_vals = re.findall(regex, line)
-			if hex_vals == None: continue
-			if len(hex_vals) < 2: continue
-			pc = hex_vals[0]
-			ir = hex_vals[1]
-
-			regex = '^(.+?):'
-			entity_pre_colon_list = re.findall(regex, line)
-			if entity_pre_colon_list  == None: continue
-			if len(entity_pre_colon_list) < 1: continue
-			instr_num = int(entity_pre_colon_list[0])
-
-			regex = '.*?, .*?, (.+)'
-			instr_str_list = re.findall(regex, line)
-			if instr_str_list == None: continue
-			if len(instr_str_list) < 1: continue
-			instr_str = instr_str_list[0]
-
-			instr_dict = {"pc": pc,
-						"ir": ir,
-						"str": instr_str
-			}
-
-			# MINOR: this method grows the list as needed; rationale:
-			# instruction number is preserved through the list index;
-			# we cannot assign a value to a particular list index without
-			# having initialized it
-			BranchPredictorInfo._grow_instr_dict_list(instr_num) 
-
-			BranchPredictorInfo.instr_dict_list[instr_num] = instr_dict
+		BranchPredictorInfo.branch_events = BranchEvents.from_columns(
+			events_to_columns(iter_branch_events(BranchPredictorInfo.instr_file))
+		)
+		BranchPredictorInfo.instr_file.close()
 
 	def _group_branch_seqs():
 		"""
 		Sets the BranchPredictorInfo's list of branch sequences
-	
-		If the instruction starts with a b, then we know that
-		it is a branch instruction per the RISC-V green sheet.
-		We use regular expressions and the re (regular expressions)
-		library in Python to search for any 8-digit hex values.
-		[a-fA-F0-9] is a hex digit and {8} means search for 8 of them
-		in a row. 
-		
-		The last found hex value in the instruction is the hex value of
-		the branch-to instruction. For example, bgeu a0,a1,0x800000c4,
-		where 0x800000c4 is the target pc. The pc that was actually taken
-		is the pc of the next instruction that was executed in the instruction
-		series present in the output file (in our example case, that is output.txt).
+
+		An instruction is a branch instruction if the opcode of its
+		IR (bits 6:0) is 0x63, the opcode shared by all conditional
+		branches per the RISC-V green sheet. The target pc, or branch-to
+		instruction, is the pc plus the B-type immediate encoded in the
+		IR. For example, bgeu a0,a1,0x800000c4 has the target pc 0x800000c4.
+		The pc that was actually taken is the pc of the next instruction that
+		was executed in the instruction series present in the output file (in
+		our example case, that is output.txt).
 		If the actual pc and the target pc are equal, then we know that the branch
 		was taken, and store that as a boolean in the dictionary representing the
-		branch sequence or branch event, so to speak. 
+		branch sequence or branch event, so to speak.
+
+		The file is streamed through iter_branch_events in a single pass.
 		"""
-		for i in range(len(BranchPredictorInfo.instr_dict_list)):
-			if BranchPredictorInfo.instr_dict_list[i] == None: continue
-			instr_str = BranchPredictorInfo.instr_dict_list[i]["str"]
-			if instr_str.split()[0][0] == "b":
-				regex = '([a-fA-F0-9]{8})'
-				hex_vals = re.findall(regex, instr_str)
-
-				# making sure that an 8-digit hex value was actually found
-				# so we don't get some NoneType error; it's fairly trivial
-				if hex_vals == None: continue
-				if len(hex_vals) < 1: continue
-
-				taken_pc = BranchPredictorInfo.instr_dict_list[i+1]["pc"]
-				target_pc = hex_vals[-1]		   
-				is_taken = taken_pc == target_pc
-				branch_seq_dict = {"instr": BranchPredictorInfo.instr_dict_list[i],
-								   "actual_pc": taken_pc,
-								   "target_pc": target_pc,
-								   "is_taken": is_taken
-								   }
-				BranchPredictorInfo.grouped_branch_seqs.append(branch_seq_dict)
+		with open_instr_file(BranchPredictorInfo.instr_filepath) as instr_file:
+			BranchPredictorInfo.grouped_branch_seqs = list(iter_branch_events(instr_file))
 
 	def _get_dict_list_str(dict_list: list):
 		"""
@@ -179,6 +303,10 @@ class BranchPredictorInfo:
 		Outputs a list of instructions in dictionaries and
 		a list of grouped branche sequences in dictionaries.
 		""" 
+		if BranchPredictorInfo.instr_dict_list == None:
+			BranchPredictorInfo._import_instrs()
+		if BranchPredictorInfo.grouped_branch_seqs == None:
+			BranchPredictorInfo._group_branch_seqs()
 		output = "Instructions:\n"
 		output += BranchPredictorInfo._get_dict_list_str(
 			BranchPredictorInfo.instr_dict_list
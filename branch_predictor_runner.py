@@ -1,95 +1,117 @@
 from branch_predictor_info import BranchPredictorInfo
+from branch_trace import Trace
 from btb import BTB
+from indirect_pred import ITTAGEPred
+from predictor import make_predictor
+from ras_pred import ReturnAddressStack
+from static_pred import get_baseline_counts
+from sweep import sweep
 from tournament_pred import TournamentPred
 import numpy as np
+import sys
 
-def print_pct_taken():
-	num_taken = 0
-	for branch_event in BranchPredictorInfo.grouped_branch_seqs:
-		if branch_event["is_taken"]:
-			num_taken += 1
+def print_pct_taken(trace):
+	num_taken = int(np.count_nonzero(trace.is_taken))
 	pct_taken = \
-	num_taken / len(BranchPredictorInfo.grouped_branch_seqs)
+	num_taken / len(trace)
 	print(round(pct_taken * 100, 2))
 
-def print_std_pc(): # in bytes
-	pc_list = []
-	for branch_event in BranchPredictorInfo.grouped_branch_seqs:
-		pc_list.append(int(branch_event["instr"]["pc"], 16))
-	print(round(np.std(pc_list), 2))
+def print_std_pc(trace): # in bytes
+	print(round(np.std(trace.pc), 2))
 
-def print_num_branches():
-	print(len(BranchPredictorInfo.grouped_branch_seqs))
+def print_num_branches(trace):
+	print(len(trace))
 
-def simulate_tp(width: int):
+def simulate_tp(trace, width: int):
 	tp = TournamentPred(width = width)
-	correct_preds = 0
-	for branch_event in BranchPredictorInfo.grouped_branch_seqs:
-		pc_sel = int( \
-		(int(branch_event["instr"]["pc"], 16) / (2**width)) \
-		% (2**width)
-		)
-		is_taken_pred = \
-		tp.get_prediction(pc_sel)
-		if is_taken_pred == branch_event["is_taken"]:
-			correct_preds += 1
-		else:
-			tp.update_predictor(
-				branch_event["is_taken"],
-				pc_sel
-			)
+	_, counts = tp.run(trace.events)
 	pct_correct = \
-	correct_preds / len(BranchPredictorInfo.grouped_branch_seqs)
+	counts["num_correct"] / len(trace)
 	# print(f"TABLE_WIDTH: {width}; pct_correct: {pct_correct * 100}")	
 	print(round(pct_correct * 100, 2))
 
-def simulate_btb(width: int):
+def simulate_btb(trace, width: int):
 	btb = BTB()
-	correct_preds = 0
-	total_taken_pred = 0
 	tp = TournamentPred(width = width)
-	for branch_event in BranchPredictorInfo.grouped_branch_seqs:
-		pc_lookup = int(branch_event["instr"]["pc"], 16)
-		pc_pred = btb.get_prediction(pc_lookup)
-		pc_sel = int( \
-		(int(branch_event["instr"]["pc"], 16) / (2**width)) \
-		% (2**width)
-		)
-		is_taken_pred = tp.get_prediction(pc_sel) 
-		if is_taken_pred != branch_event["is_taken"]:
-			tp.update_predictor(
-				branch_event["is_taken"],
-				pc_sel
-			)
-		if is_taken_pred and branch_event["is_taken"]:
-			total_taken_pred += 1
-			if branch_event["actual_pc"] == pc_pred:
-				correct_preds += 1
-		if branch_event["is_taken"]:
-			btb.update_predictor(
-				pc_lookup, 
-				pc_targ = branch_event["actual_pc"]
-			)
+	# the BTB is trained on every taken branch whatever the tournament
+	# predictor says, so the two can be run separately and combined
+	is_taken_preds, _ = tp.run(trace.events)
+	pc_preds, _ = btb.run(trace.events)
+	print_btb_accuracy(trace, is_taken_preds, pc_preds)
+
+def print_btb_accuracy(trace, is_taken_preds, pc_preds):
+	'''
+	Prints the % of correctly predicted targets among the taken
+	branches that were predicted taken
+	'''
+	taken_preds = is_taken_preds & trace.events.taken
+	total_taken_pred = int(np.count_nonzero(taken_preds))
+	correct_preds = int(np.count_nonzero(taken_preds & (pc_preds == trace.actual_pc)))
 	pct_correct = \
 	correct_preds / total_taken_pred
 	# print(f"TABLE_WIDTH: {width}; pct_correct: {pct_correct * 100}")	
 	print(round(pct_correct * 100, 2))
 
+def print_jump_accuracy(counts, jump_name):
+	'''
+	Prints the % of correctly predicted targets among the jumps a jump
+	predictor was scored on (e.g. returns or indirect jumps)
+	'''
+	if counts["num_branches"] == 0:
+		print("no " + jump_name)
+		return
+	pct_correct = \
+	counts["num_correct"] / counts["num_branches"]
+	print(round(pct_correct * 100, 2))
+
+def print_static_baselines(trace):
+	'''
+	Prints the % accuracy of each static prediction heuristic (see static_pred)
+	'''
+	for heuristic, counts in get_baseline_counts(trace.events).items():
+		print(heuristic + ": " + str(round(counts["num_correct"] / max(counts["num_branches"], 1) * 100, 2)))
+
+def print_spec_accuracies(trace, predictor_specs):
+	'''
+	Prints the % accuracy of each predictor spec (see predictor.make_predictor)
+	'''
+	predictors = [make_predictor(spec) for spec in predictor_specs]
+	for predictor, (_, counts) in zip(predictors, sweep(trace.events, predictors)):
+		if "num_correct" in counts:
+			print(predictor.get_spec() + ": " + str(round(counts["num_correct"] / max(counts["num_branches"], 1) * 100, 2)))
+		else:
+			print(predictor.get_spec() + ": " + str(counts))
+
 """
-Analyzes the user-specified RISCV instruction file
+Analyzes the user-specified RISCV instruction file or binary branch trace,
+optionally with the user-specified predictor specs
 """
 if __name__ == "__main__":
-	BranchPredictorInfo.init()
+	trace = Trace.from_path(sys.argv[1])
 	# print(BranchPredictorInfo.get_str())
 	print("% taken")
-	print_pct_taken()
+	print_pct_taken(trace)
 	print("std pc of branch instrs in bytes")
-	print_std_pc()
+	print_std_pc(trace)
 	print("num branches")
-	print_num_branches()
-	for width in range(1, 9):
+	print_num_branches(trace)
+	if len(sys.argv) > 2:
+		print_spec_accuracies(trace, sys.argv[2:])
+		sys.exit(0)
+	# every width in one pass over the trace (see sweep); the BTB and the
+	# jump predictors do not depend on the width, so one of each is
+	# shared by all of them
+	widths = range(1, 9)
+	results = sweep(trace.events, [TournamentPred(width = width) for width in widths]
+					+ [BTB(), ReturnAddressStack(), ITTAGEPred()])
+	pc_preds, _ = results[-3]
+	for width, (is_taken_preds, _) in zip(widths, results):
 		# print(str(width) + ":")
-		# print("% accuracy for tp:")
-		# simulate_tp(width)
 		# print("% accuracy for BTB w/ tp:")
-		simulate_btb(width)
+		print_btb_accuracy(trace, is_taken_preds, pc_preds)
+	print("% return targets correct (return address stack)")
+	print_jump_accuracy(results[-2][1], "returns")
+	print("% indirect jump targets correct (ittage)")
+	print_jump_accuracy(results[-1][1], "indirect jumps")
+	print("% correct (static baselines)")
+	print_static_baselines(trace)
@@ -0,0 +1,237 @@
+'''
+Branch Trace Class
+
+A Trace holds the branch events of one instruction trace as a compact
+BranchEvents (see branch_events). Unlike the static BranchPredictorInfo,
+any number of traces can exist side by side in one process, and a trace can
+be built from a file path, an open file object or an in-memory buffer.
+
+Traces are cheap to hand to worker processes: a trace whose arrays are
+memory-mapped from a binary branch trace (which includes every trace loaded
+through the trace cache) pickles as just its file path, and the worker maps
+the same file again instead of receiving a copy of the arrays.
+
+A trace can also be recorded straight from the instruction set simulator
+(Trace.from_elf), which skips printing and parsing a text trace entirely.
+'''
+
+import contextlib
+import io
+import os
+import sys
+from array import array
+
+import numpy as np
+
+import trace_cache
+import trace_format
+from branch_events import BranchEvents, events_to_columns
+from branch_predictor_info import iter_branch_events, open_instr_fileobj
+from parallel_parse import parse_trace
+
+ELF_MAGIC = b"\x7fELF"
+
+## directory of the instruction set simulator, whose modules import
+## each other as top-level modules
+ISS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bpa_pyriscv")
+
+class Trace:
+
+    def __init__(self, events, name = None, trace_filepath = None):
+        '''
+        events: BranchEvents of the trace
+        name: name of the trace used in reports, e.g. the file it was read from
+        trace_filepath: binary branch trace the events are memory-mapped from, if any
+        '''
+        self.events = events
+        self.name = name
+        self.trace_filepath = trace_filepath
+
+    ## per-event columns, gathered from the static branch table on access
+    @property
+    def pc(self):
+        return self.events.pc
+
+    @property
+    def target_pc(self):
+        return self.events.target_pc
+
+    @property
+    def ir(self):
+        return self.events.ir
+
+    @property
+    def actual_pc(self):
+        return self.events.actual_pc
+
+    @property
+    def is_taken(self):
+        return self.events.is_taken
+
+    @property
+    def jumps(self):
+        '''
+        JumpEvents of the trace's jal and jalr instructions
+        '''
+        return self.events.jumps
+
+    @classmethod
+    def from_path(cls, filepath, use_cache = True, workers = 1):
+        '''
+        Loads a binary branch trace or a text instruction trace; text
+        traces go through the trace cache unless use_cache is False, and
+        are parsed by workers processes (see parallel_parse.parse_trace)
+        '''
+        if trace_format.is_trace_file(filepath):
+            return cls(trace_format.load_trace(filepath), name = filepath,
+                       trace_filepath = filepath)
+        if is_elf_file(filepath):
+            return cls.from_elf(filepath)
+        if use_cache:
+            events = trace_cache.load_cached_trace(filepath, workers = workers)
+        else:
+            events = BranchEvents.from_columns(parse_trace(filepath, workers))
+        return cls(events, name = filepath,
+                   trace_filepath = trace_format.get_mapped_filepath(events))
+
+    @classmethod
+    def from_file(cls, file, name = None):
+        '''
+        Reads a trace from an open file object. Text files (and binary
+        files holding a text trace, compressed or not) are parsed as they
+        are read; binary files holding a binary branch trace are read into
+        memory.
+        '''
+        if name is None: name = getattr(file, "name", None)
+        if isinstance(file, io.TextIOBase):
+            return cls.from_events(iter_branch_events(file), name = name)
+        if isinstance(file, io.BufferedIOBase) or isinstance(file, io.RawIOBase):
+            if not hasattr(file, "peek"): file = io.BufferedReader(file)
+            if trace_format.is_trace_buffer(file.peek(len(trace_format.MAGIC))):
+                return cls.from_buffer(file.read(), name = name)
+            return cls.from_events(iter_branch_events(open_instr_fileobj(file)), name = name)
+        # any other iterable of lines
+        return cls.from_events(iter_branch_events(file), name = name)
+
+    @classmethod
+    def from_buffer(cls, buffer, name = None):
+        '''
+        Builds a trace from a binary branch trace or a text instruction
+        trace (compressed or not) held in memory (bytes, bytearray,
+        memoryview, mmap, str). Binary branch traces are viewed without
+        being copied.
+        '''
+        if isinstance(buffer, str):
+            return cls.from_events(iter_branch_events(io.StringIO(buffer)), name = name)
+        if trace_format.is_trace_buffer(buffer):
+            return cls(trace_format.load_trace_buffer(buffer), name = name)
+        instr_file = open_instr_fileobj(io.BytesIO(buffer))
+        return cls.from_events(iter_branch_events(instr_file), name = name)
+
+    @classmethod
+    def from_elf(cls, elf_filepath, max_cycles = 0, quiet = True):
+        '''
+        Runs the program in elf_filepath on the instruction set simulator
+        and records its branches and jumps as they execute (see
+        onestage_elf.run). quiet silences the simulator's own output while
+        it runs.
+        '''
+        onestage_elf = _import_onestage_elf()
+        pc = array("I")
+        target_pc = array("I")
+        ir = array("I")
+        actual_pc = array("I")
+        is_taken = array("B")
+        jump_pc = array("I")
+        jump_ir = array("I")
+        jump_actual_pc = array("I")
+        jump_branch_index = array("Q")
+        with open(os.devnull, "w") as devnull, \
+             contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+            for branch_event in onestage_elf.run(elf_filepath, max_cycles):
+                if branch_event.mnemonic_class != "branch":
+                    jump_pc.append(branch_event.pc)
+                    jump_ir.append(branch_event.ir)
+                    jump_actual_pc.append(branch_event.actual_pc & 0xffffffff)
+                    jump_branch_index.append(len(pc))
+                    continue
+                pc.append(branch_event.pc)
+                target_pc.append(branch_event.target_pc)
+                ir.append(branch_event.ir)
+                actual_pc.append(branch_event.actual_pc)
+                is_taken.append(branch_event.is_taken)
+        return cls(BranchEvents.from_columns({
+                    "pc": np.frombuffer(pc, dtype=np.uint32),
+                    "target_pc": np.frombuffer(target_pc, dtype=np.uint32),
+                    "ir": np.frombuffer(ir, dtype=np.uint32),
+                    "actual_pc": np.frombuffer(actual_pc, dtype=np.uint32),
+                    "is_taken": np.frombuffer(is_taken, dtype=np.uint8),
+                    "jump_pc": np.frombuffer(jump_pc, dtype=np.uint32),
+                    "jump_ir": np.frombuffer(jump_ir, dtype=np.uint32),
+                    "jump_actual_pc": np.frombuffer(jump_actual_pc, dtype=np.uint32),
+                    "jump_branch_index": np.frombuffer(jump_branch_index, dtype=np.uint64)
+                    }), name = elf_filepath)
+
+    @classmethod
+    def from_events(cls, branch_events, name = None):
+        '''
+        Builds a trace from an iterable of branch event dictionaries,
+        e.g. BranchPredictorInfo.grouped_branch_seqs or iter_branch_events;
+        the dictionaries only describe conditional branches, so the trace
+        has no jumps
+        '''
+        return cls(BranchEvents.from_columns(events_to_columns(branch_events)), name = name)
+
+    def to_arrays(self):
+        '''
+        return: the per-event branch and per-jump columns as a dictionary, see
+        branch_events.EVENT_COLUMNS and JUMP_COLUMNS
+        '''
+        return self.events.to_columns()
+
+    def save(self, trace_filepath):
+        '''
+        Writes the trace to trace_filepath as a binary branch trace
+        '''
+        trace_format.write_trace(trace_filepath, self.events)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __reduce__(self):
+        # pickle memory-mapped traces by path so that handing a trace
+        # to a worker process does not copy its arrays
+        if self.trace_filepath is not None:
+            return (_load_mapped_trace, (self.trace_filepath, self.name))
+        return (self.__class__, (self.events, self.name))
+
+    def __repr__(self) -> str:
+        return f"Trace(name={self.name!r}, num_branches={len(self)})"
+
+def is_elf_file(filepath):
+    '''
+    return: True if filepath is an elf executable
+    '''
+    with open(filepath, "rb") as elf_file:
+        return elf_file.read(len(ELF_MAGIC)) == ELF_MAGIC
+
+def _import_onestage_elf():
+    if ISS_DIR not in sys.path: sys.path.append(ISS_DIR)
+    import onestage_elf
+    return onestage_elf
+
+def _load_mapped_trace(trace_filepath, name):
+    return Trace(trace_format.load_trace(trace_filepath), name = name,
+                 trace_filepath = trace_filepath)
+
+"""
+Unit Tests for Trace
+"""
+if __name__ == "__main__":
+    import pickle
+    import sys
+    traces = [Trace.from_path(filepath) for filepath in sys.argv[1:]]
+    for trace in traces:
+        print(trace)
+        print("Pickled size should be small for cached traces, got: "
+              + str(len(pickle.dumps(trace))) + " bytes")
@@ -2,8 +2,15 @@ from history_table import HistoryTable
 from saturating_counter import SaturatingCounter
 from global_branch_history import GlobalBranchHistory
 from bpa_pyriscv.mux import make_mux
+from predictor import PC_ALIGN_BITS, TARGET, Predictor, register
+import numpy as np
+import random
+from collections import OrderedDict
 
-class BTB:
+@register("btb")
+class BTB(Predictor):
+
+	kind = TARGET
 
 	def __init__(self):
 		self.lookup_table = {}
@@ -15,6 +22,421 @@ class BTB:
 	def update_predictor(self, pc_lookup: int, pc_targ: int):
 		self.lookup_table[pc_lookup] = pc_targ
 
+	def predict(self, pc):
+		return self.get_prediction(pc)
+
+	def update(self, pc, is_taken, actual_pc):
+		if is_taken:
+			self.update_predictor(pc, actual_pc)
+
+	def reset(self):
+		self.lookup_table.clear()
+
+	def snapshot(self):
+		return dict(self.lookup_table)
+
+	def restore(self, snapshot):
+		self.lookup_table = dict(snapshot)
+
+	def storage_bits(self):
+		# a pc tag and a target pc per entry
+		return len(self.lookup_table) * 64
+
+	def run_block(self, block):
+		'''
+		Simulates the BTB over an EventBlock, continuing from the state
+		the previous block left it in (see Predictor.run and sweep), with
+		the same result as calling get_prediction(pc) for every branch and
+		update_predictor(pc, actual pc) for every taken branch
+
+		return: (predictions, counts), where predictions is an int64 array
+		with the predicted target of each branch (-1 where the BTB had no
+		entry), and counts is a dictionary with the number of branches and
+		BTB hits
+		'''
+		lookup_table = self.lookup_table
+		static_pcs = block.static_pcs
+		predictions = [-1] * len(block)
+		num_hits = 0
+		for i, (branch_id, actual_pc, is_taken) in enumerate(zip(block.branch_ids,
+																 block.actual_pcs,
+																 block.taken)):
+			pc_lookup = static_pcs[branch_id]
+			pc_pred = lookup_table.get(pc_lookup)
+			if pc_pred is not None:
+				predictions[i] = pc_pred
+				num_hits += 1
+			if is_taken:
+				lookup_table[pc_lookup] = actual_pc
+		counts = {"num_branches": len(block),
+				  "num_hits": num_hits
+		}
+		return np.array(predictions, dtype=np.int64), counts
+
+	def __repr__(self) -> str:
+		return f"BTB(entries={len(self.lookup_table)})"
+
+## replacement policies of SetAssocBTB
+REPLACEMENT_POLICIES = ("lru", "plru", "fifo", "random")
+
+@register("setassoc_btb")
+class SetAssocBTB(Predictor):
+	'''
+	A finite BTB of sets x ways entries, each holding a valid bit, a
+	(possibly partial) tag and a target pc, in fixed-size NumPy arrays.
+	The set is selected by the low bits of (pc >> 2) and the tag is the
+	pc bits above them, truncated to tag_bits. Every branch looks the BTB
+	up; a hit refreshes the entry's recency, and a taken branch writes its
+	target, allocating an entry (and evicting a victim) on a miss.
+
+	Each entry also records the full pc that allocated it. It is not part
+	of the modelled hardware (nor of storage_bits); it only tells a real
+	hit from a false hit, where a different branch with the same partial
+	tag supplies its target.
+
+	Evictions are classified against a shadow fully associative LRU BTB
+	with the same number of entries, which sees the same lookups and
+	allocations (also outside the modelled hardware): an eviction is a
+	capacity eviction if the shadow BTB had to evict too, i.e. missed
+	while full, and a conflict eviction if a BTB of the same size without
+	sets would have hit or had room. eviction_counts accumulates both
+	over update and run_block alike.
+	'''
+
+	kind = TARGET
+	params = ("sets", "ways", "tag_bits", "policy", "seed")
+
+	def __init__(self, sets = 256, ways = 4, tag_bits = None, policy = "lru", seed = 0):
+		'''
+		sets: number of sets, a power of 2
+		ways: number of entries per set (a power of 2 for plru)
+		tag_bits: width of the partial tag; None keeps every pc bit above the set index
+		policy: replacement policy, one of REPLACEMENT_POLICIES
+		seed: seed of the random replacement policy
+		'''
+		if ways < 1:
+			raise ValueError(f"the number of ways must be at least 1, got {ways}")
+		if sets <= 0 or sets & (sets - 1) != 0:
+			raise ValueError(f"the number of sets must be a power of 2, got {sets}")
+		if policy not in REPLACEMENT_POLICIES:
+			raise ValueError(f"unknown replacement policy {policy!r}, expected one of: {', '.join(REPLACEMENT_POLICIES)}")
+		if policy == "plru" and ways & (ways - 1) != 0:
+			raise ValueError(f"plru needs a power of 2 ways, got {ways}")
+		self.sets = sets
+		self.ways = ways
+		self.set_bits = sets.bit_length() - 1
+		full_tag_bits = 32 - PC_ALIGN_BITS - self.set_bits
+		self.tag_bits = full_tag_bits if tag_bits is None else min(tag_bits, full_tag_bits)
+		self.policy = policy
+		self.seed = seed
+		self.rng = random.Random(seed)
+		# -1 marks an invalid entry
+		self.tags = np.full(sets * ways, -1, dtype=np.int64)
+		self.targets = np.zeros(sets * ways, dtype=np.int64)
+		self.owner_pcs = np.zeros(sets * ways, dtype=np.int64)
+		# lru: time of last use, fifo: time of allocation
+		self.stamps = np.zeros(sets * ways, dtype=np.int64)
+		# plru: ways - 1 tree bits per set; bit n points to the half of node n to evict
+		self.plru_bits = np.zeros(sets, dtype=np.int64)
+		self.clock = 0
+		# (set, tag) keys of the shadow fully associative LRU BTB, least recently used first
+		self.shadow = OrderedDict()
+		self.eviction_counts = {"num_conflict_evictions": 0, "num_capacity_evictions": 0}
+
+	def get_set(self, pc):
+		return (pc >> PC_ALIGN_BITS) & (self.sets - 1)
+
+	def get_tag(self, pc):
+		return (pc >> (PC_ALIGN_BITS + self.set_bits)) & (2**self.tag_bits - 1)
+
+	def _shadow_access(self, key, is_taken):
+		'''
+		Looks key up in the shadow fully associative LRU BTB, allocating it
+		for a taken branch on a miss
+
+		return: True if the shadow BTB evicted an entry
+		'''
+		shadow = self.shadow
+		if key in shadow:
+			shadow.move_to_end(key)
+			return False
+		if not is_taken: return False
+		shadow[key] = None
+		if len(shadow) <= self.sets * self.ways: return False
+		shadow.popitem(last=False)
+		return True
+
+	def find_way(self, set_idx, tag):
+		'''
+		return: the flat index of the entry of set set_idx holding tag, or None
+		'''
+		base = set_idx * self.ways
+		for entry in range(base, base + self.ways):
+			if self.tags[entry] == tag: return entry
+		return None
+
+	def _touch(self, set_idx, entry):
+		'''
+		Records a use of entry (flat index) of set set_idx
+		'''
+		if self.policy == "lru":
+			self.clock += 1
+			self.stamps[entry] = self.clock
+		elif self.policy == "plru":
+			# walk from the root to the leaf of the way, pointing every
+			# node on the way at the other half
+			way = entry - set_idx * self.ways
+			bits = int(self.plru_bits[set_idx])
+			node = 0
+			half = self.ways >> 1
+			while half > 0:
+				if way & half:
+					bits &= ~(1 << node)
+					node = 2 * node + 2
+				else:
+					bits |= 1 << node
+					node = 2 * node + 1
+				half >>= 1
+			self.plru_bits[set_idx] = bits
+
+	def choose_victim(self, set_idx):
+		'''
+		return: the flat index of the entry of set set_idx to allocate:
+		the first invalid entry, else the policy's victim
+		'''
+		base = set_idx * self.ways
+		for entry in range(base, base + self.ways):
+			if self.tags[entry] == -1: return entry
+		if self.policy == "random":
+			return base + self.rng.randrange(self.ways)
+		if self.policy == "plru":
+			bits = int(self.plru_bits[set_idx])
+			node = 0
+			way = 0
+			half = self.ways >> 1
+			while half > 0:
+				if bits >> node & 1:
+					way |= half
+					node = 2 * node + 2
+				else:
+					node = 2 * node + 1
+				half >>= 1
+			return base + way
+		# lru and fifo evict the oldest stamp
+		return base + int(np.argmin(self.stamps[base:base + self.ways]))
+
+	def predict(self, pc):
+		entry = self.find_way(self.get_set(pc), self.get_tag(pc))
+		if entry is None: return None
+		return int(self.targets[entry])
+
+	def update(self, pc, is_taken, actual_pc):
+		set_idx = self.get_set(pc)
+		tag = self.get_tag(pc)
+		entry = self.find_way(set_idx, tag)
+		shadow_evicted = self._shadow_access((set_idx << self.tag_bits) | tag, is_taken)
+		if entry is not None:
+			self._touch(set_idx, entry)
+			if is_taken:
+				self.targets[entry] = actual_pc
+				self.owner_pcs[entry] = pc
+		elif is_taken:
+			entry = self.choose_victim(set_idx)
+			if self.tags[entry] != -1:
+				if shadow_evicted:
+					self.eviction_counts["num_capacity_evictions"] += 1
+				else:
+					self.eviction_counts["num_conflict_evictions"] += 1
+			self.tags[entry] = tag
+			self.targets[entry] = actual_pc
+			self.owner_pcs[entry] = pc
+			if self.policy == "fifo":
+				self.clock += 1
+				self.stamps[entry] = self.clock
+			else:
+				self._touch(set_idx, entry)
+
+	def reset(self):
+		self.tags.fill(-1)
+		self.targets.fill(0)
+		self.owner_pcs.fill(0)
+		self.stamps.fill(0)
+		self.plru_bits.fill(0)
+		self.clock = 0
+		self.shadow.clear()
+		self.eviction_counts = dict.fromkeys(self.eviction_counts, 0)
+		self.rng.seed(self.seed)
+
+	def snapshot(self):
+		return {"tags": self.tags.copy(),
+				"targets": self.targets.copy(),
+				"owner_pcs": self.owner_pcs.copy(),
+				"stamps": self.stamps.copy(),
+				"plru_bits": self.plru_bits.copy(),
+				"clock": self.clock,
+				"shadow": self.shadow.copy(),
+				"eviction_counts": self.eviction_counts.copy(),
+				"rng": self.rng.getstate()
+		}
+
+	def restore(self, snapshot):
+		self.tags[:] = snapshot["tags"]
+		self.targets[:] = snapshot["targets"]
+		self.owner_pcs[:] = snapshot["owner_pcs"]
+		self.stamps[:] = snapshot["stamps"]
+		self.plru_bits[:] = snapshot["plru_bits"]
+		self.clock = snapshot["clock"]
+		self.shadow = snapshot["shadow"].copy()
+		self.eviction_counts = snapshot["eviction_counts"].copy()
+		self.rng.setstate(snapshot["rng"])
+
+	def storage_bits(self):
+		way_bits = (self.ways - 1).bit_length()
+		policy_bits = {"lru": self.ways * way_bits,
+					   "plru": self.ways - 1,
+					   "fifo": way_bits,
+					   "random": 0}[self.policy]
+		# a valid bit, a tag and a target pc per entry
+		return self.sets * (self.ways * (1 + self.tag_bits + 32) + policy_bits)
+
+	def run_block(self, block):
+		'''
+		Simulates the BTB over an EventBlock with the same result as
+		calling predict and update for every branch. Lookups and target
+		writes are inlined on memoryviews of the arrays; allocations and
+		plru updates go through choose_victim and _touch.
+
+		return: (predictions, counts), where predictions is an int64 array
+		with the predicted target of each branch (-1 where the BTB missed),
+		and counts is a dictionary with the number of branches, hits,
+		misses, evictions of a valid entry, split into conflict and
+		capacity evictions (see the class docstring), and false hits (hits on an entry allocated by a different branch with the
+		same partial tag)
+		'''
+		set_idxs = block.get_pc_index(PC_ALIGN_BITS, self.set_bits)
+		tag_values = block.get_pc_index(PC_ALIGN_BITS + self.set_bits, self.tag_bits)
+		static_pcs = block.static_pcs
+		ways = self.ways
+		policy = self.policy
+		lru = policy == "lru"
+		plru = policy == "plru"
+		tags = memoryview(self.tags)
+		targets = memoryview(self.targets)
+		owner_pcs = memoryview(self.owner_pcs)
+		stamps = memoryview(self.stamps)
+		predictions = [-1] * len(block)
+		num_hits = 0
+		num_conflict_evictions = 0
+		num_capacity_evictions = 0
+		num_false_hits = 0
+		shadow = self.shadow
+		shadow_move_to_end = shadow.move_to_end
+		shadow_popitem = shadow.popitem
+		num_entries = self.sets * ways
+		shadow_keys = [(set_idx << self.tag_bits) | tag for set_idx, tag in zip(set_idxs, tag_values)]
+
+		for i, (branch_id, actual_pc, is_taken) in enumerate(zip(block.branch_ids,
+																 block.actual_pcs,
+																 block.taken)):
+			set_idx = set_idxs[branch_id]
+			tag = tag_values[branch_id]
+			base = set_idx * ways
+			entry = None
+			for way_entry in range(base, base + ways):
+				if tags[way_entry] == tag:
+					entry = way_entry
+					break
+			key = shadow_keys[branch_id]
+			shadow_evicted = False
+			if key in shadow:
+				shadow_move_to_end(key)
+			elif is_taken:
+				shadow[key] = None
+				if len(shadow) > num_entries:
+					shadow_popitem(last=False)
+					shadow_evicted = True
+
+			if entry is not None:
+				predictions[i] = targets[entry]
+				num_hits += 1
+				pc = static_pcs[branch_id]
+				if owner_pcs[entry] != pc: num_false_hits += 1
+				if lru:
+					self.clock += 1
+					stamps[entry] = self.clock
+				elif plru:
+					self._touch(set_idx, entry)
+				if is_taken:
+					targets[entry] = actual_pc
+					owner_pcs[entry] = pc
+			elif is_taken:
+				entry = self.choose_victim(set_idx)
+				if tags[entry] != -1:
+					if shadow_evicted:
+						num_capacity_evictions += 1
+					else:
+						num_conflict_evictions += 1
+				tags[entry] = tag
+				targets[entry] = actual_pc
+				owner_pcs[entry] = static_pcs[branch_id]
+				if lru or policy == "fifo":
+					self.clock += 1
+					stamps[entry] = self.clock
+				elif plru:
+					self._touch(set_idx, entry)
+
+		self.eviction_counts["num_conflict_evictions"] += num_conflict_evictions
+		self.eviction_counts["num_capacity_evictions"] += num_capacity_evictions
+		counts = {"num_branches": len(block),
+				  "num_hits": num_hits,
+				  "num_misses": len(block) - num_hits,
+				  "num_evictions": num_conflict_evictions + num_capacity_evictions,
+				  "num_conflict_evictions": num_conflict_evictions,
+				  "num_capacity_evictions": num_capacity_evictions,
+				  "num_false_hits": num_false_hits
+		}
+		return np.array(predictions, dtype=np.int64), counts
+
 	def __repr__(self) -> str:
-		pass
+		return self.get_spec()
 
+"""
+Unit Tests for SetAssocBTB
+"""
+if __name__ == "__main__":
+	# three taken branches in the same set of a 2-way BTB
+	for policy, survivor in (("lru", 0x80000000), ("fifo", 0x80000100)):
+		btb = SetAssocBTB(sets = 16, ways = 2, policy = policy)
+		btb.update(0x80000000, True, 0x80000040)
+		btb.update(0x80000100, True, 0x80000140)
+		btb.update(0x80000000, True, 0x80000040) # a hit; refreshes its lru recency
+		btb.update(0x80000200, True, 0x80000240) # evicts a victim
+		print(policy + ": " + f"{survivor:08x}" + " should still hit, got: "
+			  + str(btb.predict(survivor) is not None))
+	btb = SetAssocBTB(sets = 16, ways = 2, tag_bits = 2)
+	btb.update(0x80000000, True, 0x80000040)
+	print("pcs 0x400 apart share a 2-bit tag, should be 80000040, got: " + f"{btb.predict(0x80000400):08x}")
+	print("Should be 16 * (2 * (1 + 2 + 32) + 2) = 1152 storage bits, got: " + str(btb.storage_bits()))
+	# in a 2 x 2 BTB, a third branch in a set evicts on a conflict while a
+	# 4-entry fully associative BTB has room. Once 5 branches have run, the
+	# next 3 evictions are capacity evictions (the fully associative BTB
+	# misses too), until 3 branches thrashing one set are all that is left,
+	# which only conflict
+	from branch_events import BranchEvents
+	block_pcs = [0x80000000, 0x80000008, 0x80000010, 0x80000004, 0x8000000c, 0x80000018] \
+		+ [0x80000008, 0x80000010, 0x80000018] * 2
+	events = BranchEvents.from_columns({
+		"pc": np.array(block_pcs, dtype=np.uint32),
+		"target_pc": np.array([0x80000100] * len(block_pcs), dtype=np.uint32),
+		"ir": np.zeros(len(block_pcs), dtype=np.uint32),
+		"actual_pc": np.array([0x80000100] * len(block_pcs), dtype=np.uint32),
+		"is_taken": np.ones(len(block_pcs), dtype=np.uint8),
+	})
+	btb = SetAssocBTB(sets = 2, ways = 2)
+	counts = btb.run(events)[1]
+	print("Should be 5 conflict and 3 capacity evictions, got: " + str(counts["num_conflict_evictions"])
+		  + " and " + str(counts["num_capacity_evictions"]))
+	btb = SetAssocBTB(sets = 2, ways = 2)
+	for pc in block_pcs:
+		btb.update(pc, True, 0x80000100)
+	print("update should count the same evictions, got: " + str(btb.eviction_counts))
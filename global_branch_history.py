@@ -1,33 +1,169 @@
+'''
+Global Branch History Class
+
+The history is a single integer shift register (self.history) of width
+bits. The most recent outcome is the MSB, so get_gbh returns the same
+value as reading the outcomes newest-first as a binary number, and
+shift_in is one shift, OR and mask no matter how long the history is.
+
+Long-history predictors index their tables with a few bits derived from
+many history bits. get_folded computes such a fold directly, and a
+FoldedHistory attached with add_folded keeps one up to date in O(1) per
+shift_in.
+'''
+
+import numpy as np
+
+def fold_history_array(outcomes, length, bits):
+    '''
+    Computes the FoldedHistory value before every branch of a run of
+    branches at once, for predictors whose history is updated with every
+    outcome (so it depends only on the trace)
+
+    outcomes: 0/1 array of branch outcomes, oldest first
+    return: int64 array of len(outcomes) + 1 values; entry n is the
+    FoldedHistory(length, bits) value after the first n outcomes (the
+    outcomes before the first one are taken to be 0)
+
+    A FoldedHistory holds, in bit r, the XOR of the outcomes whose age a
+    (0 is the newest) is below length and has a % bits == r. Each of those
+    is a strided run of outcomes, so it is the XOR of two entries of a
+    prefix XOR taken along that stride.
+    '''
+    outcomes = np.asarray(outcomes, dtype=np.uint8)
+    offset = length + bits # leading zeros, so no index below goes negative
+    padded = np.concatenate((np.zeros(offset, dtype=np.uint8), outcomes))
+    prefix = np.empty_like(padded)
+    for start in range(bits):
+        prefix[start::bits] = np.bitwise_xor.accumulate(padded[start::bits])
+
+    n = np.arange(len(outcomes) + 1)
+    folded = np.zeros(len(outcomes) + 1, dtype=np.int64)
+    for r in range(min(bits, length)):
+        count = (length - r + bits - 1) // bits # outcomes of age a % bits == r
+        newest = n - 1 - r + offset
+        parity = prefix[newest] ^ prefix[newest - bits * count]
+        folded |= parity.astype(np.int64) << r
+    return folded
+
+class FoldedHistory:
+    '''
+    The newest length bits of a global history compressed to bits bits
+    by XOR folding, updated incrementally on every shift (as the folded
+    indices of TAGE predictors are)
+    '''
+
+    def __init__(self, length, bits):
+        self.length = length
+        self.bits = bits
+        self.mask = 2**bits - 1
+        self.outpoint = length % bits # where the evicted bit lands after folding
+        self.value = 0
+
+    def update(self, new_bit, evicted_bit):
+        '''
+        new_bit: the outcome shifted into the history
+        evicted_bit: the outcome that just left the newest length bits
+        '''
+        value = (self.value << 1) | new_bit
+        value ^= evicted_bit << self.outpoint
+        value ^= value >> self.bits
+        self.value = value & self.mask
+
+    def recompute(self, global_branch_hist):
+        '''
+        Rebuilds the folded value from the current contents of global_branch_hist
+        '''
+        self.value = 0
+        for age in range(self.length - 1, -1, -1):
+            self.update(global_branch_hist.get_bit(age), 0)
+
+    def __repr__(self) -> str:
+        return format(self.value, f"0{self.bits}b")
+
 class GlobalBranchHistory:
     
     def __init__(self, width = 2):
         self.width = width # number of selecting bits
-        self.history = [0] * self.width # e.g. [0, 1]
+        self.mask = 2**width - 1
+        self.history = 0 # e.g. 0b01, newest outcome in the MSB
+        self.folded = [] # FoldedHistory views kept up to date by shift_in
 
     def shift_in(self, bit_val):
-        if self.width == 2:
-            self.history[self.width - 1] = self.history[0]
-            self.history[0] = bit_val
-        else:
-            temp_arr = self.history[:self.width-1]
-            self.history[0] = bit_val
-            self.history[1:] = temp_arr
+        for folded in self.folded:
+            folded.update(bit_val, self.get_bit(folded.length - 1))
+        self.history = (self.history >> 1) | (bit_val << (self.width - 1))
 
     def get_gbh(self):
-        out = ""
-        for char in self.history:
-            out += str(char)
-        return int(out, 2)
+        return self.history
+
+    def get_bit(self, age):
+        '''
+        return: the outcome shifted in age branches ago (0 is the newest)
+        '''
+        return (self.history >> (self.width - 1 - age)) & 1
+
+    def get_recent(self, length):
+        '''
+        return: the newest length outcomes, newest in the MSB
+        '''
+        return self.history >> (self.width - length)
+
+    def get_outcomes(self):
+        '''
+        return: uint8 array of the outcomes in the history, oldest first
+        '''
+        return np.array([self.get_bit(age) for age in range(self.width - 1, -1, -1)], dtype=np.uint8)
+
+    def set_outcomes(self, outcomes):
+        '''
+        Sets the history to the last width outcomes of a 0/1 array, oldest first
+        '''
+        self.history = 0
+        for outcome in np.asarray(outcomes)[-self.width:].tolist():
+            self.history = (self.history >> 1) | (outcome << (self.width - 1))
+        for folded in self.folded:
+            folded.recompute(self)
+
+    def get_folded(self, length, bits):
+        '''
+        return: the newest length outcomes XOR folded into bits bits
+        '''
+        recent = self.get_recent(length)
+        mask = 2**bits - 1
+        folded = 0
+        while recent:
+            folded ^= recent & mask
+            recent >>= bits
+        return folded
+
+    def add_folded(self, length, bits):
+        '''
+        return: a FoldedHistory of the newest length outcomes that
+        shift_in keeps up to date (length must not exceed width)
+        '''
+        if length > self.width:
+            raise ValueError(f"folded history of {length} bits is longer than the {self.width}-bit history")
+        folded = FoldedHistory(length, bits)
+        folded.recompute(self)
+        self.folded.append(folded)
+        return folded
 
     def __repr__(self) -> str:
-        out = ""
-        for char in self.history:
-            out += str(char)
-        return out
+        return format(self.history, f"0{self.width}b")
 
     def set_gbh(self, value_as_string):
+        '''
+        Sets the newest len(value_as_string) outcomes, newest first
+        '''
         for i in range(len(value_as_string)):
-            self.history[i] = int(value_as_string[i])
+            bit = 1 << (self.width - 1 - i)
+            if value_as_string[i] == "1":
+                self.history |= bit
+            else:
+                self.history &= ~bit
+        for folded in self.folded:
+            folded.recompute(self)
 
 
 """
@@ -35,21 +171,21 @@ Units Tests for GlobalBranchHistory
 """
 if __name__ == "__main__":
     my_gbh = GlobalBranchHistory()
-    print(my_gbh.history)
+    print(my_gbh)
     my_gbh.shift_in(1)
-    print(my_gbh.history)
+    print(my_gbh)
     print(my_gbh.get_gbh())
     my_gbh.shift_in(1)
-    print(my_gbh.history)
+    print(my_gbh)
     print(my_gbh.get_gbh())
     my_gbh.shift_in(1)
-    print(my_gbh.history)
+    print(my_gbh)
     print(my_gbh.get_gbh())
     my_gbh.shift_in(0)
-    print(my_gbh.history)
+    print(my_gbh)
     print(my_gbh.get_gbh())
     my_gbh.shift_in(0)
-    print(my_gbh.history)
+    print(my_gbh)
     print(my_gbh.get_gbh())
     print("----------------------------------")
     my_gbh = GlobalBranchHistory(7)
@@ -57,3 +193,11 @@ if __name__ == "__main__":
     print(my_gbh)
     my_gbh.shift_in(1)
     print(my_gbh)
+    print("----------------------------------")
+    my_gbh = GlobalBranchHistory(640)
+    folded = my_gbh.add_folded(640, 11)
+    for i in range(1000):
+        my_gbh.shift_in((i * 7 + i // 3) % 2)
+    check = FoldedHistory(640, 11)
+    check.recompute(my_gbh)
+    print("Incremental folded history should be " + str(check) + ", got: " + str(folded))
@@ -0,0 +1,188 @@
+'''
+Parallel experiment grid runner
+
+Evaluates every trace against every predictor and parameter combination
+(the cross product of the three is the grid, and each combination is a
+cell) on a process pool, and collects the results into one table that
+can be written as CSV or JSON.
+
+Traces are loaded once in the parent process, which parses each text
+trace into the trace cache. A cached trace pickles as just the path of
+its memory-mapped binary trace (see branch_trace.Trace), so handing a
+trace to a worker costs a file name instead of a copy of its events, and
+every worker shares the same pages of the file. Cells of the same trace
+and predictor are grouped into tasks and swept together (see sweep), so
+each task walks its trace once.
+'''
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from branch_trace import Trace
+from predictor import get_registry, make_predictor, parse_spec
+from sweep import sweep
+
+DEFAULT_TRACE_GLOB_DIR = "instr_txt_files"
+
+def expand_grid(param_grid):
+    '''
+    param_grid: dictionary of parameter name -> list of values
+    return: list of dictionaries, one per combination of values
+    '''
+    names = list(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(param_grid[name] for name in names))]
+
+def make_cells(trace_filepaths, predictor_specs, param_grid):
+    '''
+    predictor_specs: predictor spec strings (see predictor.make_predictor);
+    parameters set in a spec are not swept
+    return: list of (trace filepath, predictor spec, parameters) cells; each
+    predictor only gets the parameters it takes (Predictor.params), so a
+    predictor without parameters gets one cell per trace
+    '''
+    registry = get_registry()
+    cells = []
+    for trace_filepath in trace_filepaths:
+        for predictor_spec in predictor_specs:
+            name, spec_params = parse_spec(predictor_spec)
+            if name not in registry:
+                raise ValueError(f"unknown predictor {name!r}, expected one of: {', '.join(sorted(registry))}")
+            grid = {param: values for param, values in param_grid.items()
+                    if param in registry[name].params and param not in spec_params}
+            for params in expand_grid(grid):
+                cells.append((trace_filepath, predictor_spec, params))
+    return cells
+
+def run_task(trace, predictor_spec, params_list):
+    '''
+    Sweeps one trace with one predictor over a list of parameter combinations
+    return: list of result rows, one per combination
+    '''
+    predictors = [make_predictor(predictor_spec, **params) for params in params_list]
+    rows = []
+    for predictor, (_, counts) in zip(predictors, sweep(trace.events, predictors)):
+        row = {"trace": trace.name, "predictor": predictor.name}
+        row.update(predictor.get_params())
+        row["storage_bits"] = predictor.storage_bits()
+        row.update(counts)
+        if "num_correct" in counts and counts["num_branches"] > 0:
+            row["pct_correct"] = round(counts["num_correct"] / counts["num_branches"] * 100, 2)
+        rows.append(row)
+    return rows
+
+def _run_task_star(args):
+    return run_task(*args)
+
+def make_tasks(cells, traces, workers):
+    '''
+    Groups cells of the same trace and predictor into tasks of about
+    equal size, with enough tasks to keep every worker busy
+    return: list of (trace, predictor spec, parameter list) tasks and the
+    cell indices of each
+    '''
+    cells_per_task = max(1, math.ceil(len(cells) / (workers * 4)))
+    groups = {}
+    for index, (trace_filepath, predictor_spec, _) in enumerate(cells):
+        groups.setdefault((trace_filepath, predictor_spec), []).append(index)
+
+    tasks = []
+    task_cells = []
+    for (trace_filepath, predictor_spec), indices in groups.items():
+        for start in range(0, len(indices), cells_per_task):
+            chunk = indices[start:start + cells_per_task]
+            tasks.append((traces[trace_filepath], predictor_spec, [cells[i][2] for i in chunk]))
+            task_cells.append(chunk)
+    return tasks, task_cells
+
+def run_grid(trace_filepaths, predictor_specs, param_grid, workers = None, use_cache = True):
+    '''
+    Evaluates every cell of the grid
+    workers: number of worker processes, None uses every core
+    return: list of result rows (dictionaries), in cell order
+    '''
+    if workers is None: workers = os.cpu_count()
+    traces = {trace_filepath: Trace.from_path(trace_filepath, use_cache = use_cache)
+              for trace_filepath in trace_filepaths}
+    cells = make_cells(trace_filepaths, predictor_specs, param_grid)
+    tasks, task_cells = make_tasks(cells, traces, workers)
+
+    if workers <= 1:
+        task_rows = map(_run_task_star, tasks)
+    else:
+        executor = ProcessPoolExecutor(max_workers = workers)
+        task_rows = executor.map(_run_task_star, tasks)
+    rows = [None] * len(cells)
+    try:
+        for indices, task_result in zip(task_cells, task_rows):
+            for index, row in zip(indices, task_result):
+                rows[index] = row
+    finally:
+        if workers > 1: executor.shutdown()
+    return rows
+
+def write_csv(rows, file):
+    '''
+    Writes result rows as CSV, with a column for every key of any row
+    '''
+    fieldnames = []
+    for row in rows:
+        fieldnames.extend(name for name in row if name not in fieldnames)
+    writer = csv.DictWriter(file, fieldnames = fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
+
+def write_json(rows, file):
+    json.dump(rows, file, indent = 1)
+    file.write("\n")
+
+def parse_int_list(text):
+    '''
+    return: list of ints from "1,2,3" or "1-8" (or a mix, "1-4,10")
+    '''
+    values = []
+    for part in text.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            values.extend(range(int(first), int(last) + 1))
+        else:
+            values.append(int(part))
+    return values
+
+"""
+Evaluates the user-specified traces (every trace in instr_txt_files by default)
+against every predictor and parameter combination
+"""
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Run a grid of branch predictor experiments")
+    parser.add_argument("traces", nargs = "*", help = "instruction files, binary traces or elf files")
+    parser.add_argument("-p", "--predictor", action = "append", default = None,
+                        help = "predictor spec, e.g. tournament or tournament:counter_bits=3 (repeatable; "
+                        + "predictors: " + ", ".join(sorted(get_registry())) + ")")
+    parser.add_argument("-w", "--width", default = "1-8", help = "table widths, e.g. 1-8 or 4,8,12")
+    parser.add_argument("-c", "--counter-bits", default = "2", help = "saturating counter widths")
+    parser.add_argument("-j", "--workers", type = int, default = None, help = "worker processes (default: every core)")
+    parser.add_argument("-f", "--format", choices = ("csv", "json"), default = "csv")
+    parser.add_argument("-o", "--output", default = None, help = "output file (default: stdout)")
+    args = parser.parse_args()
+
+    trace_filepaths = args.traces
+    if len(trace_filepaths) == 0:
+        trace_filepaths = sorted(os.path.join(DEFAULT_TRACE_GLOB_DIR, name)
+                                 for name in os.listdir(DEFAULT_TRACE_GLOB_DIR) if name.endswith(".txt"))
+    param_grid = {"width": parse_int_list(args.width),
+                  "counter_bits": parse_int_list(args.counter_bits)}
+    predictor_specs = args.predictor if args.predictor is not None else ["tournament"]
+    rows = run_grid(trace_filepaths, predictor_specs, param_grid, args.workers)
+
+    write = write_csv if args.format == "csv" else write_json
+    if args.output is None:
+        write(rows, sys.stdout)
+    else:
+        with open(args.output, "w", newline = "") as output_file:
+            write(rows, output_file)
@@ -0,0 +1,206 @@
+'''
+gshare and gselect Predictors
+
+Both index a single table of saturating counters (a PHT) with bits of the
+branch's pc combined with the global branch history:
+
+    gshare    pc bits XOR history bits; a history longer than the table
+              index is XOR folded down to the index width (see FoldedHistory)
+    gselect   pc bits concatenated with history bits (pc bits above the
+              history bits)
+
+The history length is independent of the table size. Unlike the
+tournament predictor, both are trained on every branch by default.
+'''
+import numpy as np
+
+from global_branch_history import GlobalBranchHistory
+from history_table import HistoryTable
+from predictor import PC_ALIGN_BITS, Predictor, register
+
+class GlobalHistoryPred(Predictor):
+    '''
+    A table of counters indexed by (pc bits) XOR (history bits); subclasses
+    choose how the pc bits are placed (see get_pc_part)
+    '''
+
+    params = ("width", "history_bits", "counter_bits")
+
+    def __init__(self, width = 12, history_bits = None, counter_bits = 2, update_on_mispredict = False):
+        '''
+        width: number of bits indexing the table; the table has 2 ^ width counters
+        history_bits: number of global branch history bits used, width by default
+        counter_bits: width of each saturating counter
+        update_on_mispredict: only train the predictor when its prediction was wrong
+        '''
+        if history_bits is None: history_bits = width
+        if history_bits < 1:
+            raise ValueError(f"{self.name} needs at least 1 history bit, got {history_bits}")
+        self.width = width
+        self.history_bits = history_bits
+        self.counter_bits = counter_bits
+        self.update_on_mispredict = update_on_mispredict
+        self.PHT = HistoryTable("PHT", width, counter_bits)
+        self.global_branch_hist = GlobalBranchHistory(history_bits)
+        # a history longer than the index is folded down to the index width
+        self.folded_hist = None
+        if history_bits > width:
+            self.folded_hist = self.global_branch_hist.add_folded(history_bits, width)
+
+    def get_pc_part(self, pc):
+        '''
+        return: the pc's contribution to the table index
+        '''
+        raise NotImplementedError
+
+    def get_history_part(self):
+        '''
+        return: the global branch history's contribution to the table index
+        '''
+        if self.folded_hist is not None: return self.folded_hist.value
+        return self.global_branch_hist.get_gbh()
+
+    def get_index(self, pc):
+        return self.get_pc_part(pc) ^ self.get_history_part()
+
+    def predict(self, pc):
+        return self.PHT.get_prediction(self.get_index(pc))
+
+    def update(self, pc, is_taken, actual_pc):
+        idx = self.get_index(pc)
+        if is_taken:
+            self.PHT.increment(idx)
+        else:
+            self.PHT.decrement(idx)
+        self.global_branch_hist.shift_in(1 if is_taken else 0)
+
+    def reset(self):
+        self.PHT.reset()
+        self.global_branch_hist.set_gbh("0" * self.history_bits)
+
+    def snapshot(self):
+        return {"PHT": self.PHT.table.copy(),
+                "gbh": self.global_branch_hist.get_gbh()
+        }
+
+    def restore(self, snapshot):
+        self.PHT.table[:] = snapshot["PHT"]
+        self.global_branch_hist.set_gbh(format(snapshot["gbh"], f"0{self.history_bits}b"))
+
+    def storage_bits(self):
+        return self.PHT.height * self.counter_bits + self.history_bits
+
+    def get_static_pc_parts(self, block):
+        '''
+        return: list of get_pc_part of every static branch of block
+        '''
+        raise NotImplementedError
+
+    def run_block(self, block):
+        '''
+        Simulates the predictor over an EventBlock with the same result as
+        calling predict and update for every branch (update only on a wrong
+        prediction if update_on_mispredict), in one fused loop
+
+        return: (predictions, counts), where predictions is a bool array with
+        the prediction for each branch, and counts is a dictionary with the
+        number of branches, correct predictions and predictor updates
+        '''
+        num_branches = len(block)
+        predictions = bytearray(num_branches)
+        pc_parts = self.get_static_pc_parts(block)
+        update_on_mispredict = self.update_on_mispredict
+        pht = self.PHT.counters
+        pht_max, pht_thr = self.PHT.max_value, self.PHT.threshold
+        gbh = self.global_branch_hist.get_gbh()
+        gbh_top = 1 << (self.history_bits - 1)
+        fold = self.folded_hist is not None
+        if fold:
+            folded = self.folded_hist.value
+            fold_mask, fold_bits, fold_outpoint = self.folded_hist.mask, self.folded_hist.bits, self.folded_hist.outpoint
+        hist = folded if fold else gbh
+        correct_preds = 0
+        num_updates = 0
+
+        for i, (branch_id, outcome) in enumerate(zip(block.branch_ids, block.taken)):
+            idx = pc_parts[branch_id] ^ hist
+            value = pht[idx]
+            prediction = value >= pht_thr
+            predictions[i] = prediction
+            if prediction == outcome:
+                correct_preds += 1
+                if update_on_mispredict: continue
+
+            num_updates += 1
+            if outcome:
+                if value < pht_max: pht[idx] = value + 1
+                if fold:
+                    # the oldest history bit (bit 0) leaves the folded window
+                    folded = ((folded << 1) | 1) ^ ((gbh & 1) << fold_outpoint)
+                    folded = (folded ^ (folded >> fold_bits)) & fold_mask
+                gbh = (gbh >> 1) | gbh_top
+            else:
+                if value > 0: pht[idx] = value - 1
+                if fold:
+                    folded = (folded << 1) ^ ((gbh & 1) << fold_outpoint)
+                    folded = (folded ^ (folded >> fold_bits)) & fold_mask
+                gbh >>= 1
+            hist = folded if fold else gbh
+
+        self.global_branch_hist.history = gbh
+        if fold: self.folded_hist.value = folded
+        counts = {"num_branches": num_branches,
+                  "num_correct": correct_preds,
+                  "num_updates": num_updates
+        }
+        return np.frombuffer(predictions, dtype=bool), counts
+
+@register("gshare")
+class GSharePred(GlobalHistoryPred):
+    '''
+    Index: (pc >> 2) XOR history, both width bits
+    '''
+
+    def get_pc_part(self, pc):
+        return (pc >> PC_ALIGN_BITS) & (2**self.width - 1)
+
+    def get_static_pc_parts(self, block):
+        return block.get_pc_index(PC_ALIGN_BITS, self.width)
+
+@register("gselect")
+class GSelectPred(GlobalHistoryPred):
+    '''
+    Index: the low width - history_bits bits of (pc >> 2) followed by
+    history_bits history bits
+    '''
+
+    def __init__(self, width = 12, history_bits = None, counter_bits = 2, update_on_mispredict = False):
+        if history_bits is None: history_bits = max(width // 2, 1)
+        if history_bits > width:
+            raise ValueError(f"gselect history of {history_bits} bits does not fit a {width}-bit index")
+        super().__init__(width, history_bits, counter_bits, update_on_mispredict)
+
+    def get_pc_part(self, pc):
+        # the history fills the low bits, so XOR with it is concatenation
+        return ((pc >> PC_ALIGN_BITS) & (2**(self.width - self.history_bits) - 1)) << self.history_bits
+
+    def get_static_pc_parts(self, block):
+        return [pc_bits << self.history_bits
+                for pc_bits in block.get_pc_index(PC_ALIGN_BITS, self.width - self.history_bits)]
+
+"""
+Unit Tests for GSharePred and GSelectPred
+"""
+if __name__ == "__main__":
+    # an alternating branch is perfectly predictable from one bit of history
+    gshare = GSharePred(width = 4, history_bits = 2)
+    correct = 0
+    for i in range(40):
+        outcome = i % 2 == 0
+        if i >= 30: correct += gshare.predict(0x80000010) == outcome
+        gshare.update(0x80000010, outcome, 0)
+    print("gshare should predict 10 of the last 10 outcomes of an alternating branch, got: " + str(correct))
+    gselect = GSelectPred(width = 6, history_bits = 2)
+    print("gselect index of pc 0x8000001c with history 10 should be 0b11110, got: "
+          + bin(gselect.get_pc_part(0x8000001c) | 0b10))
+    print("Should be 2 * 2^6 + 2 = 130 storage bits, got: " + str(gselect.storage_bits()))
@@ -1,39 +1,63 @@
 '''
 History Table Class to represent the BHT, PHT, and Meta Predictors
+
+The table's saturating counters are held in a single uint8 NumPy array
+(self.table) rather than one SaturatingCounter object per entry, so that
+tables indexed by 16-20 bits take a few MiB instead of millions of Python
+objects. Single entries are read and written through a memoryview of the
+array, which returns plain ints and is much cheaper than indexing the
+array itself one element at a time.
 '''
 
-from saturating_counter import SaturatingCounter
+import numpy as np
 
 class HistoryTable:
     
-    def __init__(self, name = "BHT", width = 2):
-        self.name = name # name, e.g. BHT, PHT
-        self.height = 2 ** width # height of the table
-				 #  is 2 ^ num selection bits
-        self.table = [None] * self.height # initialize array based on height
-        for i in range(self.height):
-            self.table[i] = SaturatingCounter() # for each index in array, 
-						# make a saturating counter object
-						# with value 10
+    def __init__(self, name = "BHT", width = 2, counter_bits = 2):
+        '''
+        name: name, e.g. BHT, PHT
+        width: number of selection bits; the height of the table is 2 ^ width
+        counter_bits: width of each saturating counter (1 to 8)
+        '''
+        if not 1 <= counter_bits <= 8:
+            raise ValueError(f"{name} counter_bits must be between 1 and 8 (counters are uint8), got {counter_bits}")
+        self.name = name
+        self.height = 2 ** width
+        self.counter_bits = counter_bits
+        self.max_value = 2 ** counter_bits - 1
+        # a counter predicts taken when its MSB is 1
+        self.threshold = 2 ** (counter_bits - 1)
+        # every counter starts at 10 (weakly taken), as SaturatingCounter does
+        self.table = np.full(self.height, self.threshold, dtype=np.uint8)
+        self.counters = memoryview(self.table)
 
     def increment(self, idx):
-        self.table[idx].increment()
-        return
+        value = self.counters[idx]
+        if value < self.max_value:
+            self.counters[idx] = value + 1
 
     def decrement(self,idx):
-        self.table[idx].decrement()
+        value = self.counters[idx]
+        if value > 0:
+            self.counters[idx] = value - 1
 
     def get_prediction(self, idx):
-        return self.table[idx].get_prediction()
+        return self.counters[idx] >= self.threshold
 
     def get_value(self, idx):
-        return self.table[idx]
+        return self.counters[idx]
+
+    def reset(self):
+        self.table.fill(self.threshold)
+
+    def _format_counter(self, value):
+        return format(value, f"0{self.counter_bits}b")
 
     def __repr__(self) -> str:
-        return str(self.table)
+        return "[" + ", ".join(self._format_counter(value) for value in self.counters) + "]"
 
     def __str__(self) -> str:
-        return str(self.table)
+        return self.__repr__()
 
 """
 Unit Tests for HistoryTable
@@ -46,18 +70,23 @@ if __name__ == "__main__":
     print("Incrementing idx 11")
     my_BHT.increment(3)
     print(my_BHT)
-    print("Getting prediction from idx 11, should be False, got: " + str(my_BHT.get_prediction(3)) + ", Value = " + str(my_BHT.get_value(3)))
+    print("Getting prediction from idx 11, should be False, got: " + str(my_BHT.get_prediction(3)) + ", Value = " + my_BHT._format_counter(my_BHT.get_value(3)))
     print("Incrementing idx 11")
     my_BHT.increment(3)
     print(my_BHT)
-    print("Getting prediction from idx 11, should be True, got: " + str(my_BHT.get_prediction(3)) + ", Value = " + str(my_BHT.get_value(3)))
+    print("Getting prediction from idx 11, should be True, got: " + str(my_BHT.get_prediction(3)) + ", Value = " + my_BHT._format_counter(my_BHT.get_value(3)))
     print("Incrementing idx 11")
     my_BHT.increment(3)
     print(my_BHT)
-    print("Getting prediction from idx 11, should be True, got: " + str(my_BHT.get_prediction(3)) + ", Value = " + str(my_BHT.get_value(3)))
+    print("Getting prediction from idx 11, should be True, got: " + str(my_BHT.get_prediction(3)) + ", Value = " + my_BHT._format_counter(my_BHT.get_value(3)))
     print("Incrementing idx 11")
     my_BHT.increment(3)
     print(my_BHT)
-    print("Getting prediction from idx 11, should be True, got: " + str(my_BHT.get_prediction(3)) + ", Value = " + str(my_BHT.get_value(3)))
-    
-
+    print("Getting prediction from idx 11, should be True, got: " + str(my_BHT.get_prediction(3)) + ", Value = " + my_BHT._format_counter(my_BHT.get_value(3)))
+    print("Table with 20 selection bits should take 1048576 bytes, got: "
+          + str(HistoryTable("PHT", 20).table.nbytes))
+    for counter_bits in (0, 9):
+        try:
+            HistoryTable("PHT", 4, counter_bits)
+        except ValueError as error:
+            print("Should raise for " + str(counter_bits) + "-bit counters, got: " + str(error))
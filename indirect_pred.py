@@ -0,0 +1,343 @@
+'''
+ITTAGE-lite indirect jump target Predictor
+
+Predicts the targets of indirect jumps (jalr instructions that are not
+returns, see riscv_decode.is_indirect: calls through function pointers and
+jumps through jump tables). It is TAGE (see tage_pred) with targets in
+place of direction counters:
+
+    base     a direct-mapped, untagged table of the last target of the
+             indirect jumps indexed by pc (as a BTB would predict them)
+    tagged   num_tables tables indexed by hashes of the pc and of
+             increasingly long path histories; each entry holds a tag, a
+             target, a confidence counter and a useful bit
+
+The prediction is the target of the matching entry with the longest
+history, or the base table's. A wrong provider loses confidence and is
+only retargeted at zero confidence, and a misprediction allocates an
+entry in a table with a longer history.
+
+The path history is made of the targets of every jump (jal and jalr):
+each shifts path_bits low bits of its target (above the instruction
+alignment) into a GlobalBranchHistory, which keeps the folded indices and
+tags up to date. Since jump targets come from the trace, run_block folds
+the path history of a whole block up front (see fold_history_array), as
+TAGEPred.run_block does with branch outcomes. All the tables are bounded
+NumPy arrays.
+'''
+import numpy as np
+
+from global_branch_history import GlobalBranchHistory, fold_history_array
+from predictor import JUMP, PC_ALIGN_BITS, Predictor, register
+from riscv_decode import is_indirect
+from tage_pred import check_tag_bits, get_history_lengths
+
+@register("ittage")
+class ITTAGEPred(Predictor):
+
+    kind = JUMP
+    params = ("num_tables", "table_bits", "tag_bits", "base_bits",
+              "min_history", "max_history", "path_bits", "conf_bits")
+
+    def __init__(self, num_tables = 4, table_bits = 8, tag_bits = 9, base_bits = 8,
+                 min_history = 4, max_history = 48, path_bits = 2, conf_bits = 2):
+        '''
+        num_tables: number of tagged tables
+        table_bits: each tagged table has 2 ^ table_bits entries
+        tag_bits: width of the tags (2 to 16)
+        base_bits: the base table has 2 ^ base_bits targets
+        min_history, max_history: path history lengths, in bits, of the
+        first and last tagged table
+        path_bits: number of bits of each jump's target shifted into the path history
+        conf_bits: width of the confidence counters
+        '''
+        check_tag_bits(tag_bits)
+        self.num_tables = num_tables
+        self.table_bits = table_bits
+        self.tag_bits = tag_bits
+        self.base_bits = base_bits
+        self.min_history = min_history
+        self.max_history = max_history
+        self.path_bits = path_bits
+        self.conf_bits = conf_bits
+        self.history_lengths = get_history_lengths(num_tables, min_history, max_history)
+
+        # a target of 0 marks an empty base entry
+        self.base = np.zeros(2**base_bits, dtype=np.uint32)
+        self.tags = [np.zeros(2**table_bits, dtype=np.uint16) for _ in range(num_tables)]
+        self.targets = [np.zeros(2**table_bits, dtype=np.uint32) for _ in range(num_tables)]
+        self.conf = [np.zeros(2**table_bits, dtype=np.uint8) for _ in range(num_tables)]
+        self.useful = [np.zeros(2**table_bits, dtype=np.uint8) for _ in range(num_tables)]
+
+        self.path_hist = GlobalBranchHistory(max(self.history_lengths))
+        self.index_hists = [self.path_hist.add_folded(length, table_bits)
+                            for length in self.history_lengths]
+        self.tag_hists = [(self.path_hist.add_folded(length, tag_bits),
+                           self.path_hist.add_folded(length, tag_bits - 1))
+                          for length in self.history_lengths]
+        self.lookup = None
+
+    def get_base_index(self, pc):
+        return (pc >> PC_ALIGN_BITS) & (2**self.base_bits - 1)
+
+    def get_pc_parts(self, pc):
+        '''
+        return: (index part, tag part) of the pc, shared by every tagged table
+        '''
+        pc_bits = pc >> PC_ALIGN_BITS
+        return (pc_bits ^ (pc_bits >> self.table_bits)) & (2**self.table_bits - 1), \
+            pc_bits & (2**self.tag_bits - 1)
+
+    def get_indices_and_tags(self, pc):
+        index_part, tag_part = self.get_pc_parts(pc)
+        indices = [index_part ^ hist.value for hist in self.index_hists]
+        tags = [tag_part ^ hist.value ^ (hist_short.value << 1) for hist, hist_short in self.tag_hists]
+        return indices, tags
+
+    def get_path_bits(self, target):
+        '''
+        return: list of the bits of target shifted into the path history, in order
+        '''
+        return [(target >> (PC_ALIGN_BITS + bit)) & 1 for bit in range(self.path_bits)]
+
+    def _lookup(self, base_idx, indices, tags):
+        '''
+        return: (provider table or -1, prediction, alternate prediction),
+        where a prediction of 0 is no prediction
+        '''
+        provider = alt = -1
+        for table in range(self.num_tables - 1, -1, -1):
+            if self.tags[table][indices[table]] == tags[table]:
+                if provider < 0:
+                    provider = table
+                else:
+                    alt = table
+                    break
+        base_pred = int(self.base[base_idx])
+        alt_pred = base_pred if alt < 0 else int(self.targets[alt][indices[alt]])
+        if provider < 0:
+            return provider, base_pred, base_pred
+        return provider, int(self.targets[provider][indices[provider]]), alt_pred
+
+    def is_scored(self, ir):
+        return bool(is_indirect(ir))
+
+    def predict(self, pc, ir):
+        if not is_indirect(ir): return None
+        base_idx = self.get_base_index(pc)
+        indices, tags = self.get_indices_and_tags(pc)
+        provider, prediction, alt_pred = self._lookup(base_idx, indices, tags)
+        self.lookup = (pc, base_idx, indices, tags, provider, prediction, alt_pred)
+        return prediction if prediction != 0 else None
+
+    def update(self, pc, ir, actual_pc):
+        if is_indirect(ir):
+            if self.lookup is None or self.lookup[0] != pc: self.predict(pc, ir)
+            _, base_idx, indices, tags, provider, prediction, alt_pred = self.lookup
+            conf_max = 2**self.conf_bits - 1
+
+            if provider >= 0:
+                idx = indices[provider]
+                conf = self.conf[provider]
+                if prediction == actual_pc:
+                    if conf[idx] < conf_max: conf[idx] += 1
+                    if alt_pred != actual_pc: self.useful[provider][idx] = 1
+                elif conf[idx] > 0:
+                    conf[idx] -= 1
+                else:
+                    self.targets[provider][idx] = actual_pc
+                    self.useful[provider][idx] = 0
+            self.base[base_idx] = actual_pc
+
+            if prediction != actual_pc and provider < self.num_tables - 1:
+                self._allocate(provider, indices, tags, actual_pc)
+        for bit in self.get_path_bits(actual_pc):
+            self.path_hist.shift_in(bit)
+        self.lookup = None
+
+    def _allocate(self, provider, indices, tags, actual_pc):
+        '''
+        Allocates an entry for the jump in the first table with a longer
+        history than the provider's whose entry is not useful, or clears
+        the useful bits of those entries if there is none
+        '''
+        for table in range(provider + 1, self.num_tables):
+            idx = indices[table]
+            if self.useful[table][idx] == 0:
+                self.tags[table][idx] = tags[table]
+                self.targets[table][idx] = actual_pc
+                self.conf[table][idx] = 0
+                return
+        for table in range(provider + 1, self.num_tables):
+            self.useful[table][indices[table]] = 0
+
+    def reset(self):
+        self.base.fill(0)
+        for table in range(self.num_tables):
+            self.tags[table].fill(0)
+            self.targets[table].fill(0)
+            self.conf[table].fill(0)
+            self.useful[table].fill(0)
+        self.path_hist.set_outcomes(np.zeros(0, dtype=np.uint8))
+        self.lookup = None
+
+    def snapshot(self):
+        return {"base": self.base.copy(),
+                "tags": [tags.copy() for tags in self.tags],
+                "targets": [targets.copy() for targets in self.targets],
+                "conf": [conf.copy() for conf in self.conf],
+                "useful": [useful.copy() for useful in self.useful],
+                "path": self.path_hist.get_outcomes()
+        }
+
+    def restore(self, snapshot):
+        self.base[:] = snapshot["base"]
+        for table in range(self.num_tables):
+            self.tags[table][:] = snapshot["tags"][table]
+            self.targets[table][:] = snapshot["targets"][table]
+            self.conf[table][:] = snapshot["conf"][table]
+            self.useful[table][:] = snapshot["useful"][table]
+        self.path_hist.set_outcomes(snapshot["path"])
+        self.lookup = None
+
+    def storage_bits(self):
+        entry_bits = self.tag_bits + 32 + self.conf_bits + 1
+        return len(self.base) * 32 + self.num_tables * 2**self.table_bits * entry_bits \
+            + self.path_hist.width
+
+    def _get_block_indices_and_tags(self, block):
+        '''
+        return: per-jump lists of the base index, and per-table lists of
+        indices and tags of every jump of block, from the folded path
+        histories of the whole block, and the block's path bits
+        '''
+        jumps = block.events.jumps
+        static_pc = jumps.static_pc.astype(np.int64)
+        base_idx = self.get_base_index(static_pc)[jumps.jump_id]
+        index_part, tag_part = self.get_pc_parts(static_pc)
+        index_part, tag_part = index_part[jumps.jump_id], tag_part[jumps.jump_id]
+
+        targets = jumps.actual_pc.astype(np.int64)
+        # path_bits bits per jump, in the order update shifts them in
+        new_bits = ((targets[:, None] >> (PC_ALIGN_BITS + np.arange(self.path_bits))) & 1).reshape(-1)
+        path = np.concatenate((self.path_hist.get_outcomes(), new_bits.astype(np.uint8)))
+        # the path history before each jump
+        before = self.path_hist.width + self.path_bits * np.arange(len(jumps))
+        indices = []
+        tags = []
+        for length in self.history_lengths:
+            index_hist = fold_history_array(path, length, self.table_bits)[before]
+            tag_hist = fold_history_array(path, length, self.tag_bits)[before]
+            tag_hist_short = fold_history_array(path, length, self.tag_bits - 1)[before]
+            indices.append((index_part ^ index_hist).tolist())
+            tags.append((tag_part ^ tag_hist ^ (tag_hist_short << 1)).tolist())
+        return base_idx.tolist(), indices, tags, path
+
+    def run_block(self, block):
+        '''
+        Simulates the predictor over the jumps of an EventBlock with the
+        same result as calling predict and update for every jump, in one
+        fused loop
+
+        return: (predictions, counts), where predictions is an int64 array
+        with the predicted target of each jump (-1 for jumps that are not
+        indirect and for indirect jumps without a prediction), and counts
+        is a dictionary with the number of indirect jumps (num_branches),
+        correct predictions, predictions provided by a tagged table, and
+        allocations
+        '''
+        jump_ids, actual_pcs, _ = block.get_jumps()
+        predictions = [-1] * len(jump_ids)
+        if len(jump_ids) == 0:
+            return np.array(predictions, dtype=np.int64), {"num_branches": 0, "num_correct": 0,
+                                                           "num_tagged": 0, "num_allocations": 0}
+        static_indirect = [bool(is_indirect(ir)) for ir in block.static_jump_irs]
+        base_idxs, indices, tags, path = self._get_block_indices_and_tags(block)
+
+        num_tables = self.num_tables
+        tables = list(range(num_tables))
+        tables_down = tables[::-1]
+        base = memoryview(self.base)
+        tag_tables = [memoryview(tags_array) for tags_array in self.tags]
+        targets = [memoryview(targets_array) for targets_array in self.targets]
+        confs = [memoryview(conf_array) for conf_array in self.conf]
+        useful = [memoryview(useful_array) for useful_array in self.useful]
+        conf_max = 2**self.conf_bits - 1
+        num_indirect = 0
+        correct_preds = 0
+        num_tagged = 0
+        num_allocations = 0
+
+        rows = zip(jump_ids, actual_pcs, base_idxs, zip(*indices), zip(*tags))
+        for i, (jump_id, actual_pc, base_idx, idxs, jump_tags) in enumerate(rows):
+            if not static_indirect[jump_id]: continue
+            num_indirect += 1
+            provider = alt = -1
+            for table in tables_down:
+                if tag_tables[table][idxs[table]] == jump_tags[table]:
+                    if provider < 0:
+                        provider = table
+                    else:
+                        alt = table
+                        break
+            alt_pred = base[base_idx] if alt < 0 else targets[alt][idxs[alt]]
+            if provider < 0:
+                prediction = alt_pred
+            else:
+                num_tagged += 1
+                idx = idxs[provider]
+                prediction = targets[provider][idx]
+            if prediction != 0:
+                predictions[i] = prediction
+                if prediction == actual_pc: correct_preds += 1
+
+            if provider >= 0:
+                conf = confs[provider][idx]
+                if prediction == actual_pc:
+                    if conf < conf_max: confs[provider][idx] = conf + 1
+                    if alt_pred != actual_pc: useful[provider][idx] = 1
+                elif conf > 0:
+                    confs[provider][idx] = conf - 1
+                else:
+                    targets[provider][idx] = actual_pc
+                    useful[provider][idx] = 0
+            base[base_idx] = actual_pc
+
+            if prediction != actual_pc and provider < num_tables - 1:
+                for table in tables[provider + 1:]:
+                    if useful[table][idxs[table]] == 0:
+                        tag_tables[table][idxs[table]] = jump_tags[table]
+                        targets[table][idxs[table]] = actual_pc
+                        confs[table][idxs[table]] = 0
+                        num_allocations += 1
+                        break
+                else:
+                    for table in tables[provider + 1:]:
+                        useful[table][idxs[table]] = 0
+
+        self.path_hist.set_outcomes(path)
+        self.lookup = None
+        counts = {"num_branches": num_indirect,
+                  "num_correct": correct_preds,
+                  "num_tagged": num_tagged,
+                  "num_allocations": num_allocations
+        }
+        return np.array(predictions, dtype=np.int64), counts
+
+"""
+Unit Tests for ITTAGEPred
+"""
+if __name__ == "__main__":
+    JALR_A5 = 0x000780e7 # jalr ra,0(a5), a call through a function pointer
+    JAL_RA = 0x100000ef # jal ra,+0x100
+    # the function pointer call at 0x80000100 goes to a target that is
+    # set by which of two functions a direct call just went to
+    ittage = ITTAGEPred(num_tables = 2, table_bits = 6, tag_bits = 7, min_history = 2, max_history = 8)
+    correct = 0
+    for i in range(200):
+        ittage.update(0x80000000, JAL_RA, 0x80000204 if i % 3 == 0 else 0x80000208)
+        target = 0x80001000 if i % 3 == 0 else 0x80002000
+        if i >= 100: correct += ittage.predict(0x80000100, JALR_A5) == target
+        ittage.update(0x80000100, JALR_A5, target)
+    print("Should predict 100 of the last 100 targets of a path-correlated jalr, got: " + str(correct))
+    print("Should be None for a direct jal, got: " + str(ittage.predict(0x80000000, JAL_RA)))
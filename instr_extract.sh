@@ -8,6 +8,7 @@ helpFunction()
    echo "Usage: $0 -e parameterE -o parameterO"
    echo -e "\t-e File path of executable containing assembly instructions to run the onestage elf ALU on and extract from. For example: bpa-pyriscv/riscv_isa/programs/return"
    echo -e "\t-o file to output extracted instructions to. For example: output.txt"
+   echo -e "\t   Ending it in .gz, .xz or .bz2 (for example: output.txt.xz) compresses the output as it is written"
    exit 1 # Exit script after printing help
 }
 
@@ -27,4 +28,20 @@ then
    helpFunction
 fi
 
-python3 bpa_pyriscv/onestage_elf_instr_print.py $parameterE > $parameterO
+# compress the output as a stream if the output file asks for it
+case "$parameterO" in
+   *.gz ) compressCmd="gzip -c" ;;
+   *.xz ) compressCmd="xz -c" ;;
+   *.bz2 ) compressCmd="bzip2 -c" ;;
+   * ) compressCmd="cat" ;;
+esac
+
+# fail if the simulator fails, not only if the compressor does, and do not
+# leave a truncated trace behind
+set -o pipefail
+if ! python3 bpa_pyriscv/onestage_elf_instr_print.py $parameterE | $compressCmd > $parameterO
+then
+   echo "Extracting instructions from $parameterE failed; removed $parameterO" >&2
+   rm -f "$parameterO"
+   exit 1
+fi
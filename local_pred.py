@@ -0,0 +1,191 @@
+'''
+Two-level local history Predictors (Yeh and Patt)
+
+The first level is a table of branch history registers (BHRs), each
+holding the last history_bits outcomes of the branches that map to it
+(newest outcome in bit 0). The second level is a pattern history table
+(PHT) of saturating counters indexed by the selected BHR:
+
+    pag   per-address BHRs (indexed by pc bits), one global PHT indexed
+          by the history alone
+    pap   per-address BHRs, per-address PHTs: the PHT index is pht_pc_bits
+          pc bits above the history bits
+    sag   per-set BHRs: the BHR is indexed by pc bits above set_shift, so
+          the 2 ^ set_shift neighbouring branch slots of a region of code
+          share one BHR; one global PHT
+
+Both levels are plain integer arrays (the BHRs in a uint16 or uint32 array,
+the PHT in a HistoryTable), so a table of thousands of BHRs costs a few
+KiB, and the fused run_block reads and writes them through memoryviews.
+The predictors are trained on every branch.
+'''
+import numpy as np
+
+from history_table import HistoryTable
+from predictor import PC_ALIGN_BITS, Predictor, register
+
+class LocalHistoryPred(Predictor):
+    '''
+    A BHR table selected by (pc >> (2 + bhr_shift)) feeding a PHT indexed
+    by pht_pc_bits of (pc >> 2) followed by the BHR's history_bits
+    '''
+
+    def __init__(self, bhr_bits = 10, history_bits = 10, pht_pc_bits = 0, bhr_shift = 0,
+                 counter_bits = 2, update_on_mispredict = False):
+        '''
+        bhr_bits: the BHR table has 2 ^ bhr_bits registers
+        history_bits: width of each BHR
+        pht_pc_bits: number of pc bits in the PHT index; 0 for a global PHT
+        bhr_shift: number of low pc bits (above the instruction alignment)
+        skipped when selecting a BHR
+        counter_bits: width of each saturating counter
+        update_on_mispredict: only train the predictor when its prediction was wrong
+        '''
+        if history_bits > 32:
+            raise ValueError(f"a {history_bits}-bit history does not fit a 32-bit BHR")
+        self.bhr_bits = bhr_bits
+        self.history_bits = history_bits
+        self.pht_pc_bits = pht_pc_bits
+        self.bhr_shift = bhr_shift
+        self.counter_bits = counter_bits
+        self.update_on_mispredict = update_on_mispredict
+        self.history_mask = 2**history_bits - 1
+        self.BHRs = np.zeros(2**bhr_bits, dtype=np.uint16 if history_bits <= 16 else np.uint32)
+        self.PHT = HistoryTable("PHT", pht_pc_bits + history_bits, counter_bits)
+
+    def get_bhr_index(self, pc):
+        return (pc >> (PC_ALIGN_BITS + self.bhr_shift)) & (2**self.bhr_bits - 1)
+
+    def get_pht_pc_part(self, pc):
+        return ((pc >> PC_ALIGN_BITS) & (2**self.pht_pc_bits - 1)) << self.history_bits
+
+    def get_index(self, pc):
+        return self.get_pht_pc_part(pc) | int(self.BHRs[self.get_bhr_index(pc)])
+
+    def predict(self, pc):
+        return self.PHT.get_prediction(self.get_index(pc))
+
+    def update(self, pc, is_taken, actual_pc):
+        idx = self.get_index(pc)
+        if is_taken:
+            self.PHT.increment(idx)
+        else:
+            self.PHT.decrement(idx)
+        bhr_idx = self.get_bhr_index(pc)
+        self.BHRs[bhr_idx] = ((int(self.BHRs[bhr_idx]) << 1) | (1 if is_taken else 0)) & self.history_mask
+
+    def reset(self):
+        self.BHRs.fill(0)
+        self.PHT.reset()
+
+    def snapshot(self):
+        return {"BHRs": self.BHRs.copy(),
+                "PHT": self.PHT.table.copy()
+        }
+
+    def restore(self, snapshot):
+        self.BHRs[:] = snapshot["BHRs"]
+        self.PHT.table[:] = snapshot["PHT"]
+
+    def storage_bits(self):
+        return len(self.BHRs) * self.history_bits + self.PHT.height * self.counter_bits
+
+    def run_block(self, block):
+        '''
+        Simulates the predictor over an EventBlock with the same result as
+        calling predict and update for every branch (update only on a wrong
+        prediction if update_on_mispredict), in one fused loop
+
+        return: (predictions, counts), where predictions is a bool array with
+        the prediction for each branch, and counts is a dictionary with the
+        number of branches, correct predictions and predictor updates
+        '''
+        num_branches = len(block)
+        predictions = bytearray(num_branches)
+        bhr_idxs = block.get_pc_index(PC_ALIGN_BITS + self.bhr_shift, self.bhr_bits)
+        pht_pc_parts = [pc_bits << self.history_bits
+                        for pc_bits in block.get_pc_index(PC_ALIGN_BITS, self.pht_pc_bits)]
+        update_on_mispredict = self.update_on_mispredict
+        bhrs = memoryview(self.BHRs)
+        history_mask = self.history_mask
+        pht = self.PHT.counters
+        pht_max, pht_thr = self.PHT.max_value, self.PHT.threshold
+        correct_preds = 0
+        num_updates = 0
+
+        for i, (branch_id, outcome) in enumerate(zip(block.branch_ids, block.taken)):
+            bhr_idx = bhr_idxs[branch_id]
+            history = bhrs[bhr_idx]
+            idx = pht_pc_parts[branch_id] | history
+            value = pht[idx]
+            prediction = value >= pht_thr
+            predictions[i] = prediction
+            if prediction == outcome:
+                correct_preds += 1
+                if update_on_mispredict: continue
+
+            num_updates += 1
+            if outcome:
+                if value < pht_max: pht[idx] = value + 1
+                bhrs[bhr_idx] = ((history << 1) | 1) & history_mask
+            else:
+                if value > 0: pht[idx] = value - 1
+                bhrs[bhr_idx] = (history << 1) & history_mask
+
+        counts = {"num_branches": num_branches,
+                  "num_correct": correct_preds,
+                  "num_updates": num_updates
+        }
+        return np.frombuffer(predictions, dtype=bool), counts
+
+@register("pag")
+class PAgPred(LocalHistoryPred):
+
+    params = ("bhr_bits", "history_bits", "counter_bits")
+
+    def __init__(self, bhr_bits = 10, history_bits = 10, counter_bits = 2, update_on_mispredict = False):
+        super().__init__(bhr_bits, history_bits, 0, 0, counter_bits, update_on_mispredict)
+
+@register("pap")
+class PApPred(LocalHistoryPred):
+
+    params = ("bhr_bits", "history_bits", "pht_pc_bits", "counter_bits")
+
+    def __init__(self, bhr_bits = 10, history_bits = 8, pht_pc_bits = 4, counter_bits = 2,
+                 update_on_mispredict = False):
+        super().__init__(bhr_bits, history_bits, pht_pc_bits, 0, counter_bits, update_on_mispredict)
+
+@register("sag")
+class SAgPred(LocalHistoryPred):
+
+    params = ("set_bits", "set_shift", "history_bits", "counter_bits")
+
+    def __init__(self, set_bits = 6, set_shift = 2, history_bits = 10, counter_bits = 2,
+                 update_on_mispredict = False):
+        '''
+        set_bits: there are 2 ^ set_bits BHRs, one per set
+        set_shift: 2 ^ set_shift neighbouring branch slots form a set
+        '''
+        self.set_bits = set_bits
+        self.set_shift = set_shift
+        super().__init__(set_bits, history_bits, 0, set_shift, counter_bits, update_on_mispredict)
+
+"""
+Unit Tests for PAgPred, PApPred and SAgPred
+"""
+if __name__ == "__main__":
+    # a loop branch taken 3 times then not taken is perfectly predictable
+    # from its own last 3 outcomes, even when another branch interleaves
+    for predictor in (PAgPred(bhr_bits = 4, history_bits = 4), PApPred(bhr_bits = 4, history_bits = 4),
+                      SAgPred(set_bits = 2, set_shift = 2, history_bits = 4)):
+        correct = 0
+        for i in range(200):
+            outcome = i % 4 != 3
+            if i >= 100: correct += predictor.predict(0x80000010) == outcome
+            predictor.update(0x80000010, outcome, 0)
+            predictor.update(0x80000100, i % 3 == 0, 0)
+        print(predictor.name + " should predict 100 of the last 100 outcomes of a 4-trip loop, got: "
+              + str(correct))
+    print("sag BHR of pc 0x8000003c should be 0 with set_shift 4, got: "
+          + str(SAgPred(set_shift = 4).get_bhr_index(0x8000003c)))
+    print("Should be 1024 * 10 + 1024 * 2 = 12288 storage bits, got: " + str(PAgPred().storage_bits()))
@@ -0,0 +1,284 @@
+'''
+Loop Predictor
+
+Detects branches that close loops with a fixed trip count and predicts
+their exits, which a counter-based predictor mispredicts every time. It is
+the loop predictor of L-TAGE: a small direct-mapped, tagged table of
+entries, each holding
+
+    dir            the direction the branch takes while the loop continues
+    current_iter   iterations of the current pass through the loop
+    past_iter      the trip count seen on the last pass
+    conf           how many passes in a row had the same trip count
+    age            protects the entry from replacement while it is useful
+
+A confident entry (conf at its maximum) overrides the base predictor: it
+predicts the exit direction on iteration past_iter and dir before it. Any
+other branch gets the base predictor's prediction, and a misprediction on a
+branch without an entry allocates one. Each field is a small NumPy array
+(4-6 bytes per entry in all), so the table stays tiny.
+
+The loop predictor is a side predictor to any registered base predictor
+(base is a predictor spec name, e.g. "tage", or a Predictor), or a
+predictor of its own with a base of None that predicts taken. The base
+predictor is trained as if it ran alone, so run_block runs the base's own
+fused run_block over the block first and then only loops over the loop
+table.
+'''
+import numpy as np
+
+from predictor import DIRECTION, PC_ALIGN_BITS, Predictor, make_predictor, register
+
+@register("loop")
+class LoopPred(Predictor):
+
+    params = ("table_bits", "tag_bits", "count_bits", "conf_bits", "base")
+
+    AGE_MAX = 3
+
+    def __init__(self, table_bits = 6, tag_bits = 10, count_bits = 10, conf_bits = 2, base = None):
+        '''
+        table_bits: the table has 2 ^ table_bits entries
+        tag_bits: width of the tags (at most 16)
+        count_bits: width of the iteration counters (at most 16); longer loops are dropped
+        conf_bits: width of the confidence counters
+        base: direction predictor spec (e.g. "tournament") or Predictor used
+        where the loop predictor is not confident; None predicts taken
+        '''
+        for name, bits in (("tag_bits", tag_bits), ("count_bits", count_bits)):
+            if not 1 <= bits <= 16:
+                raise ValueError(f"{name} must be between 1 and 16 (stored as uint16), got {bits}")
+        self.table_bits = table_bits
+        self.tag_bits = tag_bits
+        self.count_bits = count_bits
+        self.conf_bits = conf_bits
+        if isinstance(base, Predictor):
+            self.base_pred = base
+            base = base.get_spec()
+        else:
+            self.base_pred = None if base is None else make_predictor(base)
+        if self.base_pred is not None and self.base_pred.kind != DIRECTION:
+            raise ValueError(f"loop base {self.base_pred.name!r} is a {self.base_pred.kind} predictor, "
+                             "expected a direction predictor")
+        self.base = base
+        self.count_max = 2**count_bits - 1
+        self.conf_max = 2**conf_bits - 1
+
+        size = 2**table_bits
+        self.valid = np.zeros(size, dtype=np.uint8)
+        self.dirs = np.zeros(size, dtype=np.uint8)
+        self.tags = np.zeros(size, dtype=np.uint16)
+        self.current_iter = np.zeros(size, dtype=np.uint16)
+        self.past_iter = np.zeros(size, dtype=np.uint16)
+        self.conf = np.zeros(size, dtype=np.uint8)
+        self.age = np.zeros(size, dtype=np.uint8)
+        self.lookup = None
+
+    def get_index(self, pc):
+        return (pc >> PC_ALIGN_BITS) & (2**self.table_bits - 1)
+
+    def get_tag(self, pc):
+        return (pc >> (PC_ALIGN_BITS + self.table_bits)) & (2**self.tag_bits - 1)
+
+    def get_loop_prediction(self, idx, tag):
+        '''
+        return: (whether the entry matches, its prediction or None if it is not confident)
+        '''
+        if not (self.valid[idx] and self.tags[idx] == tag): return False, None
+        if self.conf[idx] < self.conf_max: return True, None
+        loop_dir = bool(self.dirs[idx])
+        if int(self.current_iter[idx]) + 1 == self.past_iter[idx]: return True, not loop_dir
+        return True, loop_dir
+
+    def predict(self, pc):
+        base_pred = True if self.base_pred is None else bool(self.base_pred.predict(pc))
+        idx, tag = self.get_index(pc), self.get_tag(pc)
+        hit, loop_pred = self.get_loop_prediction(idx, tag)
+        self.lookup = (pc, base_pred, idx, tag, hit, loop_pred)
+        return base_pred if loop_pred is None else loop_pred
+
+    def update(self, pc, is_taken, actual_pc):
+        if self.lookup is None or self.lookup[0] != pc: self.predict(pc)
+        _, base_pred, idx, tag, hit, loop_pred = self.lookup
+        prediction = base_pred if loop_pred is None else loop_pred
+        if self.base_pred is not None and (not self.base_pred.update_on_mispredict or base_pred != is_taken):
+            self.base_pred.update(pc, is_taken, actual_pc)
+
+        if hit:
+            if loop_pred is not None and loop_pred != base_pred and loop_pred == is_taken:
+                self.age[idx] = min(int(self.age[idx]) + 1, self.AGE_MAX)
+            self._train_entry(idx, is_taken)
+        elif prediction != is_taken:
+            self._allocate(idx, tag, is_taken)
+        self.lookup = None
+
+    def _train_entry(self, idx, is_taken):
+        current_iter = int(self.current_iter[idx]) + 1
+        past_iter = int(self.past_iter[idx])
+        if is_taken != bool(self.dirs[idx]):
+            # the loop exited
+            if current_iter == past_iter:
+                self.conf[idx] = min(int(self.conf[idx]) + 1, self.conf_max)
+            else:
+                self.past_iter[idx] = current_iter
+                self.conf[idx] = 0
+            current_iter = 0
+        elif current_iter >= self.count_max:
+            self.valid[idx] = 0
+        elif past_iter and current_iter >= past_iter:
+            # the loop ran past its trip count
+            self.conf[idx] = 0
+        self.current_iter[idx] = current_iter
+
+    def _allocate(self, idx, tag, is_taken):
+        '''
+        Takes over entry idx for a mispredicted branch, assumed to have
+        just left a loop, unless the entry is still protected by its age
+        '''
+        if self.valid[idx] and self.age[idx] > 0:
+            self.age[idx] -= 1
+            return
+        self.valid[idx] = 1
+        self.tags[idx] = tag
+        self.dirs[idx] = 0 if is_taken else 1
+        self.current_iter[idx] = 0
+        self.past_iter[idx] = 0
+        self.conf[idx] = 0
+        self.age[idx] = self.AGE_MAX
+
+    def get_arrays(self):
+        return {"valid": self.valid,
+                "dirs": self.dirs,
+                "tags": self.tags,
+                "current_iter": self.current_iter,
+                "past_iter": self.past_iter,
+                "conf": self.conf,
+                "age": self.age
+        }
+
+    def reset(self):
+        for array in self.get_arrays().values():
+            array.fill(0)
+        if self.base_pred is not None: self.base_pred.reset()
+        self.lookup = None
+
+    def snapshot(self):
+        snapshot = {name: array.copy() for name, array in self.get_arrays().items()}
+        if self.base_pred is not None: snapshot["base"] = self.base_pred.snapshot()
+        return snapshot
+
+    def restore(self, snapshot):
+        for name, array in self.get_arrays().items():
+            array[:] = snapshot[name]
+        if self.base_pred is not None: self.base_pred.restore(snapshot["base"])
+        self.lookup = None
+
+    def storage_bits(self):
+        # valid, dir, tag, two iteration counters, confidence and age per entry
+        entry_bits = 2 + self.tag_bits + 2 * self.count_bits + self.conf_bits + 2
+        base_bits = 0 if self.base_pred is None else self.base_pred.storage_bits()
+        return 2**self.table_bits * entry_bits + base_bits
+
+    def run_block(self, block):
+        '''
+        Simulates the predictor over an EventBlock with the same result as
+        calling predict and update for every branch: the base predictor's
+        predictions for the whole block come from its own run_block, and
+        one fused loop runs the loop table
+
+        return: (predictions, counts), where predictions is a bool array with
+        the prediction for each branch, and counts is a dictionary with the
+        number of branches, correct predictions, predictions made by a
+        confident loop entry, and correct ones among those
+        '''
+        num_branches = len(block)
+        if self.base_pred is None:
+            base_preds = [True] * num_branches
+        else:
+            base_preds = self.base_pred.run_block(block)[0].tolist()
+        predictions = bytearray(num_branches)
+        idxs = block.get_pc_index(PC_ALIGN_BITS, self.table_bits)
+        tag_values = block.get_pc_index(PC_ALIGN_BITS + self.table_bits, self.tag_bits)
+        valid = memoryview(self.valid)
+        dirs = memoryview(self.dirs)
+        tags = memoryview(self.tags)
+        current_iters = memoryview(self.current_iter)
+        past_iters = memoryview(self.past_iter)
+        confs = memoryview(self.conf)
+        ages = memoryview(self.age)
+        count_max, conf_max, age_max = self.count_max, self.conf_max, self.AGE_MAX
+        correct_preds = 0
+        num_loop_preds = 0
+        num_loop_correct = 0
+
+        for i, (branch_id, outcome, base_pred) in enumerate(zip(block.branch_ids, block.taken, base_preds)):
+            idx = idxs[branch_id]
+            tag = tag_values[branch_id]
+            if valid[idx] and tags[idx] == tag:
+                loop_dir = dirs[idx] == 1
+                current_iter = current_iters[idx] + 1
+                past_iter = past_iters[idx]
+                if confs[idx] == conf_max:
+                    num_loop_preds += 1
+                    prediction = (not loop_dir) if current_iter == past_iter else loop_dir
+                    if prediction == outcome:
+                        num_loop_correct += 1
+                        if prediction != base_pred and ages[idx] < age_max: ages[idx] += 1
+                else:
+                    prediction = base_pred
+                predictions[i] = prediction
+                if prediction == outcome: correct_preds += 1
+
+                # train the entry
+                if outcome != loop_dir:
+                    if current_iter == past_iter:
+                        if confs[idx] < conf_max: confs[idx] += 1
+                    else:
+                        past_iters[idx] = current_iter
+                        confs[idx] = 0
+                    current_iter = 0
+                elif current_iter >= count_max:
+                    valid[idx] = 0
+                elif past_iter and current_iter >= past_iter:
+                    confs[idx] = 0
+                current_iters[idx] = current_iter
+                continue
+
+            predictions[i] = base_pred
+            if base_pred == outcome:
+                correct_preds += 1
+            elif valid[idx] and ages[idx] > 0:
+                ages[idx] -= 1
+            else:
+                valid[idx] = 1
+                tags[idx] = tag
+                dirs[idx] = 0 if outcome else 1
+                current_iters[idx] = 0
+                past_iters[idx] = 0
+                confs[idx] = 0
+                ages[idx] = age_max
+
+        self.lookup = None
+        counts = {"num_branches": num_branches,
+                  "num_correct": correct_preds,
+                  "num_loop_predictions": num_loop_preds,
+                  "num_loop_correct": num_loop_correct
+        }
+        return np.frombuffer(predictions, dtype=bool), counts
+
+"""
+Unit Tests for LoopPred
+"""
+if __name__ == "__main__":
+    # a loop of 7 iterations: taken 6 times, then not taken
+    for base in (None, "tournament"):
+        loop = LoopPred(table_bits = 4, base = base)
+        correct = 0
+        for i in range(140):
+            outcome = i % 7 != 6
+            if i >= 70: correct += loop.predict(0x80000010) == outcome
+            loop.update(0x80000010, outcome, 0)
+        print("base " + str(base) + ": should predict 70 of the last 70 outcomes of a 7-trip loop, got: "
+              + str(correct))
+    print("Should be loop:table_bits=4,tag_bits=10,count_bits=10,conf_bits=2,base=tournament, got: "
+          + loop.get_spec())
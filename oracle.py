@@ -0,0 +1,168 @@
+'''
+Profile-guided oracles and upper bounds on prediction accuracy
+
+An oracle sees the whole trace before predicting it. In a first pass it
+profiles every event under a key, and learns the direction the events of
+each key take most often; in a second pass it predicts every event with its
+key's majority direction and is scored like a predictor. The keys are
+
+    order 0   the static branch: the best any static predictor can do,
+              predicting each branch's majority direction
+    order k   the static branch and its last k outcomes (history "local"),
+              or the last k outcomes of any branch (history "global"): the
+              best a predictor can do that sees only that history, e.g. an
+              order-k Markov predictor per branch with an unbounded table
+
+so the accuracy of an oracle is an upper bound on the accuracy of every
+predictor with the same information, and the gap between it and a
+predictor's is the headroom the predictor leaves.
+
+Both passes are NumPy expressions over the whole trace: histories are
+built by shifting the taken flags, keys are counted with np.unique and
+np.bincount, and per-branch results are summed with np.bincount.
+'''
+import numpy as np
+
+HISTORIES = ("local", "global")
+
+## multiplier of the history hash used when the exact key does not fit
+HASH_MULTIPLIER = np.uint64(0x9e3779b97f4a7c15)
+
+def get_local_history(branch_events, order):
+    '''
+    return: uint64 array, for each event, of the outcomes of the order
+    previous runs of its static branch (bit 0 the most recent, 0 before the
+    branch's first run)
+    '''
+    branch_id = branch_events.branch_id
+    taken = branch_events.taken
+    # a stable sort by branch lines up the runs of each branch in trace order
+    by_branch = np.argsort(branch_id, kind="stable")
+    sorted_ids = branch_id[by_branch]
+    sorted_taken = taken[by_branch]
+    sorted_history = np.zeros(len(branch_id), dtype=np.uint64)
+    for back in range(1, order + 1):
+        same_branch = sorted_ids[back:] == sorted_ids[:-back]
+        bits = (sorted_taken[:-back] & same_branch).astype(np.uint64)
+        sorted_history[back:] |= bits << np.uint64(back - 1)
+    history = np.empty_like(sorted_history)
+    history[by_branch] = sorted_history
+    return history
+
+def get_global_history(branch_events, order):
+    '''
+    return: uint64 array, for each event, of the outcomes of the order
+    previous branches in the trace (bit 0 the most recent)
+    '''
+    taken = branch_events.taken.astype(np.uint64)
+    history = np.zeros(len(taken), dtype=np.uint64)
+    for back in range(1, order + 1):
+        history[back:] |= taken[:-back] << np.uint64(back - 1)
+    return history
+
+def get_keys(branch_events, order, history = "local"):
+    '''
+    return: int64 array of the oracle key of each event: its static branch
+    and order bits of history (see HISTORIES), exact when they fit in 63
+    bits and hashed otherwise (colliding keys then share a prediction)
+    '''
+    if history not in HISTORIES:
+        raise ValueError(f"unknown history {history!r}, expected one of: {', '.join(HISTORIES)}")
+    if not 0 <= order <= 64:
+        raise ValueError(f"history order {order} is not between 0 and 64")
+    branch_id = branch_events.branch_id.astype(np.uint64)
+    if order == 0: return branch_id.astype(np.int64)
+    if history == "local":
+        histories = get_local_history(branch_events, order)
+    else:
+        histories = get_global_history(branch_events, order)
+    if max(branch_events.num_static - 1, 1).bit_length() + order <= 63:
+        keys = (branch_id << np.uint64(order)) | histories
+    else:
+        keys = (histories * HASH_MULTIPLIER) ^ branch_id
+    return keys.view(np.int64)
+
+def profile_oracle(keys, taken):
+    '''
+    First pass: learns the majority direction of the events of each key
+
+    return: (key_ids, oracle), where key_ids numbers each event's key and
+    oracle[key_id] is the key's majority direction (taken on a tie)
+    '''
+    unique_keys, key_ids = np.unique(keys, return_inverse=True)
+    key_ids = key_ids.reshape(-1)
+    direction_counts = np.bincount(key_ids * 2 + taken, minlength=2 * len(unique_keys))
+    return key_ids, direction_counts[1::2] >= direction_counts[0::2]
+
+def score_oracle(branch_events, key_ids, oracle, taken):
+    '''
+    Second pass: predicts every event with its key's majority direction
+
+    return: int64 array of the number of correct predictions per static branch
+    '''
+    correct = oracle[key_ids] == taken
+    return np.bincount(branch_events.branch_id[correct], minlength=branch_events.num_static)
+
+def get_branch_correct(branch_events, predictions):
+    '''
+    return: int64 array of the number of correct predictions per static
+    branch of a direction predictor's predictions (see Predictor.run), to
+    compare with an oracle's
+    '''
+    correct = np.asarray(predictions, dtype=bool) == branch_events.taken
+    return np.bincount(branch_events.branch_id[correct], minlength=branch_events.num_static)
+
+def get_oracle_name(order, history = "local"):
+    if order == 0: return "majority"
+    return f"{history}_order_{order}"
+
+def get_upper_bounds(branch_events, orders = (0, 1, 2, 4, 8, 16), histories = ("local",)):
+    '''
+    Profiles and scores the oracle of every order and history
+
+    return: (trace_bounds, branch_bounds), where trace_bounds is a dictionary
+    of oracle name (see get_oracle_name) -> counts dictionary with the number
+    of branches and correct predictions, as a predictor's run returns, and
+    branch_bounds is a dictionary of "executions" and every oracle name ->
+    int64 array over the static branches of the number of runs and of the
+    oracle's correct predictions
+    '''
+    taken = branch_events.taken
+    branch_bounds = {"executions": np.bincount(branch_events.branch_id, minlength=branch_events.num_static)}
+    trace_bounds = {}
+    for history in histories:
+        for order in orders:
+            name = get_oracle_name(order, history)
+            if name in branch_bounds: continue # order 0 is the same for every history
+            key_ids, oracle = profile_oracle(get_keys(branch_events, order, history), taken)
+            branch_bounds[name] = score_oracle(branch_events, key_ids, oracle, taken)
+            trace_bounds[name] = {"num_branches": len(branch_events),
+                                  "num_correct": int(branch_bounds[name].sum())}
+    return trace_bounds, branch_bounds
+
+"""
+Unit Tests for the oracles
+"""
+if __name__ == "__main__":
+    from branch_events import BranchEvents
+    # a loop branch with a trip count of 4 (taken 3 times, then not) run
+    # 5 times, interleaved with a branch alternating taken and not taken
+    loop = [True, True, True, False] * 5
+    alternating = [i % 2 == 0 for i in range(20)]
+    events = BranchEvents.from_columns({
+        "pc": np.array([0x80000010, 0x80000020] * 20, dtype=np.uint32),
+        "target_pc": np.array([0x80000000, 0x80000040] * 20, dtype=np.uint32),
+        "ir": np.array([0xfe0098e3, 0x02000063] * 20, dtype=np.uint32),
+        "actual_pc": np.zeros(40, dtype=np.uint32),
+        "is_taken": np.array([outcome for pair in zip(loop, alternating) for outcome in pair], dtype=np.uint8),
+    })
+    trace_bounds, branch_bounds = get_upper_bounds(events, orders = (0, 1, 3))
+    print("Should be [20, 20], got: " + str(branch_bounds["executions"].tolist()))
+    print("Should be 15 + 10 = 25 majority correct, got: " + str(trace_bounds["majority"]["num_correct"]))
+    # after a taken run the loop branch is taken 2 times in 3, while the
+    # alternating branch is fully predictable from its last outcome
+    print("Should be [15, 20] order 1 correct, got: " + str(branch_bounds["local_order_1"].tolist()))
+    # three outcomes back tell the loop branch where it is in the loop
+    print("Should be [20, 20] order 3 correct, got: " + str(branch_bounds["local_order_3"].tolist()))
+    predictions = np.ones(40, dtype=bool)
+    print("Should be [15, 10] always taken correct, got: " + str(get_branch_correct(events, predictions).tolist()))
@@ -0,0 +1,143 @@
+'''
+Parallel sharded parsing of text instruction traces
+
+A single core limits how fast one regex pass can get through a multi-GB
+trace, so parse_trace can split the file into byte ranges (shards) whose
+boundaries are moved forward to the next newline, parse the shards in a
+process pool and stitch the results back together in order.
+
+The only state that crosses a shard boundary is a branch or jump at the
+end of a shard: the pc that was actually taken is the pc of the next
+instruction, which is the first instruction of a later shard. Each shard
+reports its first instruction's pc and its trailing branch or jump, which
+is completed while stitching.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from branch_events import concatenate_columns, empty_columns
+from branch_predictor_info import get_compression, iter_instr_chunks, open_instr_file
+from riscv_decode import branch_arrays_from_instrs, hex_to_uint32, is_branch, is_jump
+
+DEFAULT_SHARD_BYTES = 2**25 # 32 MiB; bounds the memory each worker needs
+
+def find_shard_bounds(instr_filepath, shard_bytes = DEFAULT_SHARD_BYTES):
+    '''
+    return: list of (start, end) byte ranges covering instr_filepath,
+    each about shard_bytes long, and each starting at the beginning
+    of a line
+    '''
+    file_size = os.path.getsize(instr_filepath)
+    bounds = []
+    start = 0
+    with open(instr_filepath, "rb") as instr_file:
+        while start < file_size:
+            end = start + shard_bytes
+            if end < file_size:
+                # move the end forward past the next newline
+                instr_file.seek(end)
+                instr_file.readline()
+                end = instr_file.tell()
+            end = min(end, file_size)
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+def parse_shard(instr_filepath, start, end):
+    '''
+    Parses the lines in the byte range [start, end) of instr_filepath
+
+    return: (first_pc, branch_arrays, trailing_branch), where first_pc is
+    the pc of the shard's first instruction (None if it has none),
+    branch_arrays holds the per-event and per-jump columns (see
+    branch_events.EVENT_COLUMNS and JUMP_COLUMNS) of every branch and jump
+    whose next instruction is in the shard, and trailing_branch is (pc, ir)
+    of a branch or jump that ends the shard, or None
+    '''
+    with open(instr_filepath, "rb") as instr_file:
+        instr_file.seek(start)
+        lines = instr_file.read(end - start).decode(errors = "replace").splitlines()
+
+    pcs = []
+    irs = []
+    for chunk_pcs, chunk_irs in iter_instr_chunks(lines):
+        pcs.extend(chunk_pcs)
+        irs.extend(chunk_irs)
+    if len(pcs) == 0:
+        return None, empty_columns(), None
+
+    pc = hex_to_uint32(pcs)
+    ir = hex_to_uint32(irs)
+    trailing_branch = None
+    if is_branch(int(ir[-1])) or is_jump(int(ir[-1])):
+        trailing_branch = (int(pc[-1]), int(ir[-1]))
+    return int(pc[0]), branch_arrays_from_instrs(pc, ir), trailing_branch
+
+def parse_chunks(instr_file):
+    '''
+    Parses a text instruction trace serially, a chunk of instructions at
+    a time, into a dictionary of branch event and jump columns. The last
+    instruction of each chunk is carried over to the front of the next
+    chunk, since the next chunk holds the pc that was actually taken.
+    '''
+    pieces = []
+    carry_pc = np.zeros(0, dtype=np.uint32)
+    carry_ir = np.zeros(0, dtype=np.uint32)
+    for pcs, irs in iter_instr_chunks(instr_file):
+        pc = np.concatenate((carry_pc, hex_to_uint32(pcs)))
+        ir = np.concatenate((carry_ir, hex_to_uint32(irs)))
+        pieces.append(branch_arrays_from_instrs(pc, ir))
+        carry_pc = pc[-1:]
+        carry_ir = ir[-1:]
+    return concatenate_columns(pieces)
+
+def _parse_shard_star(args):
+    return parse_shard(*args)
+
+def stitch_shards(shard_results):
+    '''
+    Concatenates the results of parse_shard, in file order, into one
+    dictionary of branch event and jump columns, completing each trailing
+    branch or jump with the first pc of the next shard that has an
+    instruction. A branch or jump that ends the whole trace is dropped, as
+    in iter_branch_events.
+    '''
+    pieces = []
+    pending = None
+    for first_pc, branch_arrays, trailing_branch in shard_results:
+        if pending is not None and first_pc is not None:
+            # the trailing instruction followed by the next one executed,
+            # whose IR does not matter
+            pieces.append(branch_arrays_from_instrs(np.array([pending[0], first_pc], dtype=np.uint32),
+                                                    np.array([pending[1], 0], dtype=np.uint32)))
+            pending = None
+        pieces.append(branch_arrays)
+        if trailing_branch is not None: pending = trailing_branch
+    return concatenate_columns(pieces)
+
+def parse_trace(instr_filepath, workers = 1, shard_bytes = DEFAULT_SHARD_BYTES):
+    '''
+    Parses a text instruction trace into a dictionary of per-event
+    branch columns (see branch_events.EVENT_COLUMNS), with the same branch
+    events as iter_branch_events, and per-jump columns (see
+    branch_events.JUMP_COLUMNS). Branches are found and their targets computed
+    from the instructions' IRs a whole chunk of instructions at a time
+    (see riscv_decode).
+
+    workers: number of processes to parse shards in; 1 parses serially
+    and None uses every core. Compressed traces cannot be split at byte
+    offsets and are always parsed serially.
+    '''
+    if workers is None: workers = os.cpu_count()
+    if workers <= 1 or get_compression(instr_filepath) is not None:
+        with open_instr_file(instr_filepath) as instr_file:
+            return parse_chunks(instr_file)
+
+    shards = [(instr_filepath, start, end)
+              for start, end in find_shard_bounds(instr_filepath, shard_bytes)]
+    with ProcessPoolExecutor(max_workers = min(workers, len(shards) or 1)) as executor:
+        # map returns the results in file order
+        return stitch_shards(executor.map(_parse_shard_star, shards))
@@ -0,0 +1,325 @@
+'''
+Perceptron and hashed perceptron Predictors
+
+perceptron          a table of perceptrons selected by pc; each is a row of
+                    int8 weights, one per global history bit plus a bias.
+                    The prediction is the sign of the dot product of the
+                    weights with the history (+1 taken, -1 not taken).
+hashed_perceptron   num_tables tables of int8 weights; table t is indexed
+                    by the pc hashed with the newest history_lengths[t]
+                    history bits (the first table by the pc alone), and the
+                    prediction is the sign of the sum of the selected weights.
+
+Both are trained with the threshold rule: when the prediction is wrong or
+the output's magnitude is at most theta, every weight that contributed
+moves one step towards the outcome (saturating at the int8 range, or at
+weight_bits).
+
+The global history takes every branch's outcome, so run_block builds the
+history of every branch of a block at once (a sliding window view of the
+outcomes for perceptron, folded histories for hashed_perceptron).
+'''
+import numpy as np
+
+from global_branch_history import GlobalBranchHistory, fold_history_array
+from predictor import PC_ALIGN_BITS, Predictor, register
+from tage_pred import get_history_lengths
+
+def get_theta(num_inputs):
+    '''
+    return: the training threshold for a perceptron with num_inputs inputs
+    (Jimenez and Lin's 1.93 * h + 14)
+    '''
+    return int(1.93 * num_inputs + 14)
+
+def check_weight_bits(weight_bits):
+    '''
+    Raises ValueError unless weight_bits fits the int8 weight arrays
+    '''
+    if not 1 < weight_bits <= 8:
+        raise ValueError(f"weight_bits must be between 2 and 8 (weights are int8), got {weight_bits}")
+
+@register("perceptron")
+class PerceptronPred(Predictor):
+
+    params = ("history_bits", "table_bits", "weight_bits", "theta")
+
+    def __init__(self, history_bits = 32, table_bits = 8, weight_bits = 8, theta = None):
+        '''
+        history_bits: number of global history bits each perceptron weighs
+        table_bits: there are 2 ^ table_bits perceptrons, selected by pc
+        weight_bits: width of each weight (at most 8)
+        theta: training threshold, get_theta(history_bits) by default
+        '''
+        check_weight_bits(weight_bits)
+        if theta is None: theta = get_theta(history_bits)
+        self.history_bits = history_bits
+        self.table_bits = table_bits
+        self.weight_bits = weight_bits
+        self.theta = theta
+        self.weight_max = 2**(weight_bits - 1) - 1
+        self.weight_min = -2**(weight_bits - 1)
+        # column 0 is the bias weight, columns 1.. weigh the history, oldest first
+        self.weights = np.zeros((2**table_bits, history_bits + 1), dtype=np.int8)
+        self.global_branch_hist = GlobalBranchHistory(history_bits)
+
+    def get_index(self, pc):
+        return (pc >> PC_ALIGN_BITS) & (2**self.table_bits - 1)
+
+    def get_history_signs(self):
+        '''
+        return: int32 array of +1 (taken) and -1 (not taken) for every
+        history bit, oldest first; int32 so that dot products with the int8
+        weights sum in int32 and cannot overflow for any history length
+        '''
+        return self.global_branch_hist.get_outcomes().astype(np.int32) * 2 - 1
+
+    def get_output(self, pc):
+        row = self.weights[self.get_index(pc)]
+        return int(row[0]) + int(np.dot(row[1:], self.get_history_signs()))
+
+    def predict(self, pc):
+        return self.get_output(pc) >= 0
+
+    def _train(self, idx, signs, outcome):
+        '''
+        Moves the bias and every history weight of perceptron idx one
+        step towards outcome
+        '''
+        row = self.weights[idx].astype(np.int32)
+        step = 1 if outcome else -1
+        row[0] += step
+        row[1:] += signs * step
+        np.clip(row, self.weight_min, self.weight_max, out=row)
+        self.weights[idx] = row
+
+    def update(self, pc, is_taken, actual_pc):
+        output = self.get_output(pc)
+        if (output >= 0) != is_taken or abs(output) <= self.theta:
+            self._train(self.get_index(pc), self.get_history_signs(), is_taken)
+        self.global_branch_hist.shift_in(1 if is_taken else 0)
+
+    def reset(self):
+        self.weights.fill(0)
+        self.global_branch_hist.set_outcomes(np.zeros(0, dtype=np.uint8))
+
+    def snapshot(self):
+        return {"weights": self.weights.copy(),
+                "outcomes": self.global_branch_hist.get_outcomes()
+        }
+
+    def restore(self, snapshot):
+        self.weights[:] = snapshot["weights"]
+        self.global_branch_hist.set_outcomes(snapshot["outcomes"])
+
+    def storage_bits(self):
+        return self.weights.size * self.weight_bits + self.history_bits
+
+    def run_block(self, block):
+        '''
+        Simulates the predictor over an EventBlock with the same result as
+        calling predict and update for every branch; each branch costs one
+        dot product over a window of the block's history
+
+        return: (predictions, counts), where predictions is a bool array with
+        the prediction for each branch, and counts is a dictionary with the
+        number of branches, correct predictions and trainings
+        '''
+        num_branches = len(block)
+        predictions = bytearray(num_branches)
+        outcomes = np.concatenate((self.global_branch_hist.get_outcomes(),
+                                   block.events.taken.astype(np.uint8)))
+        signs = outcomes.astype(np.int32) * 2 - 1
+        # histories[i] is the history before branch i, oldest first
+        histories = np.lib.stride_tricks.sliding_window_view(signs, self.history_bits)
+        idxs = block.get_pc_index(PC_ALIGN_BITS, self.table_bits)
+        weights = self.weights
+        theta = self.theta
+        weight_min, weight_max = self.weight_min, self.weight_max
+        dot = np.dot
+        clip = np.clip
+        correct_preds = 0
+        num_trainings = 0
+
+        for i, (branch_id, outcome) in enumerate(zip(block.branch_ids, block.taken)):
+            idx = idxs[branch_id]
+            row = weights[idx]
+            history = histories[i]
+            output = int(row[0]) + int(dot(row[1:], history))
+            prediction = output >= 0
+            predictions[i] = prediction
+            if prediction == outcome:
+                correct_preds += 1
+                if output > theta or output < -theta: continue
+            num_trainings += 1
+            new_row = row.astype(np.int32)
+            if outcome:
+                new_row[0] += 1
+                new_row[1:] += history
+            else:
+                new_row[0] -= 1
+                new_row[1:] -= history
+            weights[idx] = clip(new_row, weight_min, weight_max, out=new_row)
+
+        self.global_branch_hist.set_outcomes(outcomes)
+        counts = {"num_branches": num_branches,
+                  "num_correct": correct_preds,
+                  "num_trainings": num_trainings
+        }
+        return np.frombuffer(predictions, dtype=bool), counts
+
+@register("hashed_perceptron")
+class HashedPerceptronPred(Predictor):
+
+    params = ("num_tables", "table_bits", "min_history", "max_history", "weight_bits", "theta")
+
+    def __init__(self, num_tables = 8, table_bits = 10, min_history = 2, max_history = 64,
+                 weight_bits = 8, theta = None):
+        '''
+        num_tables: number of weight tables; the first is indexed by pc alone
+        table_bits: each table has 2 ^ table_bits weights
+        min_history, max_history: history lengths of the second and last table,
+        geometrically spaced
+        weight_bits: width of each weight (at most 8)
+        theta: training threshold, get_theta(num_tables) by default
+        '''
+        check_weight_bits(weight_bits)
+        if theta is None: theta = get_theta(num_tables)
+        self.num_tables = num_tables
+        self.table_bits = table_bits
+        self.min_history = min_history
+        self.max_history = max_history
+        self.weight_bits = weight_bits
+        self.theta = theta
+        self.weight_max = 2**(weight_bits - 1) - 1
+        self.weight_min = -2**(weight_bits - 1)
+        self.history_lengths = [0] + get_history_lengths(num_tables - 1, min_history, max_history) \
+            if num_tables > 1 else [0]
+        # every table is one row of the matrix
+        self.weights = np.zeros((num_tables, 2**table_bits), dtype=np.int8)
+        self.global_branch_hist = GlobalBranchHistory(max(max(self.history_lengths), 1))
+        self.folded_hists = [self.global_branch_hist.add_folded(length, table_bits) if length > 0 else None
+                             for length in self.history_lengths]
+
+    def get_pc_part(self, pc):
+        pc_bits = pc >> PC_ALIGN_BITS
+        return (pc_bits ^ (pc_bits >> self.table_bits)) & (2**self.table_bits - 1)
+
+    def get_indices(self, pc):
+        '''
+        return: the flat index (table * table size + entry) of the weight
+        selected in every table
+        '''
+        pc_part = self.get_pc_part(pc)
+        table_size = 2**self.table_bits
+        return [table * table_size + (pc_part ^ (folded.value if folded is not None else 0))
+                for table, folded in enumerate(self.folded_hists)]
+
+    def get_output(self, pc):
+        flat_weights = self.weights.reshape(-1)
+        return int(flat_weights[self.get_indices(pc)].sum(dtype=np.int32))
+
+    def predict(self, pc):
+        return self.get_output(pc) >= 0
+
+    def update(self, pc, is_taken, actual_pc):
+        output = self.get_output(pc)
+        if (output >= 0) != is_taken or abs(output) <= self.theta:
+            flat_weights = self.weights.reshape(-1)
+            indices = self.get_indices(pc)
+            step = 1 if is_taken else -1
+            flat_weights[indices] = np.clip(flat_weights[indices].astype(np.int16) + step,
+                                            self.weight_min, self.weight_max)
+        self.global_branch_hist.shift_in(1 if is_taken else 0)
+
+    def reset(self):
+        self.weights.fill(0)
+        self.global_branch_hist.set_outcomes(np.zeros(0, dtype=np.uint8))
+
+    def snapshot(self):
+        return {"weights": self.weights.copy(),
+                "outcomes": self.global_branch_hist.get_outcomes()
+        }
+
+    def restore(self, snapshot):
+        self.weights[:] = snapshot["weights"]
+        self.global_branch_hist.set_outcomes(snapshot["outcomes"])
+
+    def storage_bits(self):
+        return self.weights.size * self.weight_bits + self.global_branch_hist.width
+
+    def run_block(self, block):
+        '''
+        Simulates the predictor over an EventBlock with the same result as
+        calling predict and update for every branch. The selected weights
+        of every branch are found up front from the block's folded
+        histories, and the weights are read and trained through a
+        memoryview, which is cheaper than NumPy calls for a handful of
+        weights per branch.
+
+        return: (predictions, counts), where predictions is a bool array with
+        the prediction for each branch, and counts is a dictionary with the
+        number of branches, correct predictions and trainings
+        '''
+        num_branches = len(block)
+        predictions = bytearray(num_branches)
+        outcomes = np.concatenate((self.global_branch_hist.get_outcomes(),
+                                   block.events.taken.astype(np.uint8)))
+        start = self.global_branch_hist.width
+        pc_part = self.get_pc_part(block.events.static_pc.astype(np.int64))[block.events.branch_id]
+        table_size = 2**self.table_bits
+        indices = []
+        for table, length in enumerate(self.history_lengths):
+            hist = fold_history_array(outcomes, length, self.table_bits)[start:start + num_branches] \
+                if length > 0 else 0
+            indices.append((table * table_size + (pc_part ^ hist)).tolist())
+
+        weights = memoryview(self.weights.reshape(-1))
+        theta = self.theta
+        weight_min, weight_max = self.weight_min, self.weight_max
+        correct_preds = 0
+        num_trainings = 0
+
+        for i, (idxs, outcome) in enumerate(zip(zip(*indices), block.taken)):
+            output = 0
+            for idx in idxs:
+                output += weights[idx]
+            prediction = output >= 0
+            predictions[i] = prediction
+            if prediction == outcome:
+                correct_preds += 1
+                if output > theta or output < -theta: continue
+            num_trainings += 1
+            if outcome:
+                for idx in idxs:
+                    weight = weights[idx]
+                    if weight < weight_max: weights[idx] = weight + 1
+            else:
+                for idx in idxs:
+                    weight = weights[idx]
+                    if weight > weight_min: weights[idx] = weight - 1
+
+        self.global_branch_hist.set_outcomes(outcomes)
+        counts = {"num_branches": num_branches,
+                  "num_correct": correct_preds,
+                  "num_trainings": num_trainings
+        }
+        return np.frombuffer(predictions, dtype=bool), counts
+
+"""
+Unit Tests for PerceptronPred and HashedPerceptronPred
+"""
+if __name__ == "__main__":
+    # a branch that repeats the outcome of 3 branches ago is linearly
+    # separable in the history, so a perceptron learns it exactly
+    for predictor in (PerceptronPred(history_bits = 8, table_bits = 2),
+                      HashedPerceptronPred(num_tables = 4, table_bits = 6, min_history = 2, max_history = 8)):
+        outcomes = [True, True, False]
+        correct = 0
+        for i in range(600):
+            outcome = outcomes[i % 3]
+            if i >= 500: correct += predictor.predict(0x80000010) == outcome
+            predictor.update(0x80000010, outcome, 0)
+        print(predictor.name + " should predict 100 of the last 100 outcomes of a period-3 branch, got: "
+              + str(correct))
+    print("Theta for 32 history bits should be 75, got: " + str(get_theta(32)))
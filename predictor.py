@@ -0,0 +1,259 @@
+'''
+Common predictor protocol and registry
+
+Every prediction engine subclasses Predictor and implements
+
+    predict(pc)                       the prediction for the branch at pc: taken
+                                      or not (direction predictors) or the
+                                      predicted target pc or None (target predictors)
+    update(pc, is_taken, actual_pc)   trains the predictor on the branch's outcome
+    reset()                           returns the predictor to its initial state
+    snapshot() / restore(snapshot)    saves and restores the predictor's state
+    storage_bits()                    the size of the predictor's state in bits
+
+Jump predictors (kind JUMP) predict the targets of jal and jalr
+instructions (see branch_events.JumpEvents) instead of branches:
+
+    is_scored(ir)                     whether the jump ir is one the predictor predicts
+    predict(pc, ir)                   the predicted target pc of the jump, or None
+    update(pc, ir, actual_pc)         trains the predictor on every jump
+
+run and run_block simulate a whole trace or an EventBlock on top of
+predict and update; engines override run_block with a fused loop when
+per-branch method calls are too slow. Either way a predictor can be driven
+by sweep and grid_runner.
+
+Engines register themselves under a name with @register, and
+make_predictor builds one from a spec string such as
+"tournament:width=10,counter_bits=3".
+'''
+
+import importlib
+
+import numpy as np
+
+from branch_events import EventBlock
+
+DIRECTION = "direction"
+TARGET = "target"
+JUMP = "jump"
+
+## instructions are 4-byte aligned, so the low 2 bits of a pc carry no
+## information; engines index their tables with pc >> PC_ALIGN_BITS
+PC_ALIGN_BITS = 2
+
+## modules defining registered predictors, imported on first lookup
+PREDICTOR_MODULES = ("tournament_pred", "btb", "gshare_pred", "tage_pred", "perceptron_pred",
+                     "local_pred", "ras_pred", "indirect_pred",
+                     "loop_pred", "static_pred")
+
+## predictor name -> Predictor subclass
+REGISTRY = {}
+
+class Predictor:
+
+    ## registered name, set by register
+    name = None
+    ## DIRECTION, TARGET or JUMP
+    kind = DIRECTION
+    ## names of the constructor parameters that can be set in a spec or swept
+    params = ()
+    ## run only calls update when the prediction was wrong
+    update_on_mispredict = False
+
+    def predict(self, pc):
+        raise NotImplementedError
+
+    def update(self, pc, is_taken, actual_pc):
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def snapshot(self):
+        '''
+        return: a copy of the predictor's state, for restore
+        '''
+        raise NotImplementedError
+
+    def restore(self, snapshot):
+        raise NotImplementedError
+
+    def storage_bits(self):
+        raise NotImplementedError
+
+    def is_scored(self, ir):
+        '''
+        return: True if the jump predictor predicts the target of the jump ir
+        '''
+        raise NotImplementedError
+
+    def get_params(self):
+        '''
+        return: dictionary of the predictor's params and their values
+        '''
+        return {name: getattr(self, name) for name in self.params}
+
+    def get_spec(self):
+        '''
+        return: the spec string make_predictor builds this predictor from
+        '''
+        return format_spec(self.name, self.get_params())
+
+    def run(self, branch_events):
+        '''
+        Simulates the predictor over a whole trace in one call
+
+        branch_events: BranchEvents, e.g. trace.events
+        return: (predictions, counts), where predictions holds the prediction
+        for each branch (a bool array for direction predictors, an int64 array
+        of target pcs with -1 for no prediction for target predictors) or for
+        each jump (an int64 array of target pcs, -1 for no prediction, for jump
+        predictors), and counts is a dictionary of summary counts
+        '''
+        return self.run_block(EventBlock(branch_events))
+
+    def run_block(self, block):
+        '''
+        Simulates the predictor over an EventBlock, continuing from the state
+        the previous block left it in, by calling predict and update for
+        every branch
+
+        return: (predictions, counts) as in run, for the events of the block
+        '''
+        static_pcs = block.static_pcs
+        update_on_mispredict = self.update_on_mispredict
+        if self.kind == DIRECTION:
+            predictions = bytearray(len(block))
+            num_correct = 0
+            num_updates = 0
+            for i, (branch_id, is_taken, actual_pc) in enumerate(zip(block.branch_ids, block.taken,
+                                                                     block.actual_pcs)):
+                pc = static_pcs[branch_id]
+                prediction = self.predict(pc)
+                predictions[i] = prediction
+                if prediction == is_taken:
+                    num_correct += 1
+                    if update_on_mispredict: continue
+                num_updates += 1
+                self.update(pc, is_taken, actual_pc)
+            return np.frombuffer(predictions, dtype=bool), {"num_branches": len(block),
+                                                            "num_correct": num_correct,
+                                                            "num_updates": num_updates}
+
+        if self.kind == JUMP:
+            jump_ids, actual_pcs, _ = block.get_jumps()
+            static_jump_pcs, static_jump_irs = block.static_jump_pcs, block.static_jump_irs
+            predictions = [-1] * len(jump_ids)
+            num_scored = 0
+            num_correct = 0
+            for i, (jump_id, actual_pc) in enumerate(zip(jump_ids, actual_pcs)):
+                pc, ir = static_jump_pcs[jump_id], static_jump_irs[jump_id]
+                if self.is_scored(ir):
+                    num_scored += 1
+                    prediction = self.predict(pc, ir)
+                    if prediction is not None:
+                        predictions[i] = prediction
+                        num_correct += prediction == actual_pc
+                self.update(pc, ir, actual_pc)
+            # num_branches counts the scored jumps, so that num_correct /
+            # num_branches is the accuracy as for the other kinds
+            return np.array(predictions, dtype=np.int64), {"num_branches": num_scored,
+                                                           "num_correct": num_correct}
+
+        predictions = [-1] * len(block)
+        num_hits = 0
+        for i, (branch_id, is_taken, actual_pc) in enumerate(zip(block.branch_ids, block.taken,
+                                                                 block.actual_pcs)):
+            pc = static_pcs[branch_id]
+            prediction = self.predict(pc)
+            if prediction is not None:
+                predictions[i] = prediction
+                num_hits += 1
+            self.update(pc, is_taken, actual_pc)
+        return np.array(predictions, dtype=np.int64), {"num_branches": len(block),
+                                                       "num_hits": num_hits}
+
+    def __repr__(self) -> str:
+        return self.get_spec()
+
+def register(name):
+    '''
+    Class decorator registering a Predictor subclass under name
+    '''
+    def decorator(cls):
+        cls.name = name
+        REGISTRY[name] = cls
+        return cls
+    return decorator
+
+def get_registry():
+    '''
+    return: dictionary of every registered predictor name -> class
+    '''
+    for module_name in PREDICTOR_MODULES:
+        importlib.import_module(module_name)
+    return REGISTRY
+
+def parse_value(text):
+    '''
+    return: text as an int, float, bool or None if it is one, else text
+    '''
+    if text in ("True", "true"): return True
+    if text in ("False", "false"): return False
+    if text in ("None", "none"): return None
+    try:
+        return int(text, 0) # also 0x... and 0b...
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def parse_spec(spec):
+    '''
+    return: (name, params) of a spec string "name:param=value,param=value"
+    '''
+    name, _, param_text = spec.partition(":")
+    params = {}
+    for item in filter(None, param_text.split(",")):
+        param, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"predictor spec {spec!r}: expected param=value, got {item!r}")
+        params[param.strip()] = parse_value(value.strip())
+    return name.strip(), params
+
+def format_spec(name, params):
+    if len(params) == 0: return name
+    return name + ":" + ",".join(f"{param}={value}" for param, value in params.items())
+
+def make_predictor(spec, **params):
+    '''
+    Builds a registered predictor from a spec string such as
+    "tournament:width=10"; params override the spec's parameters
+    '''
+    name, spec_params = parse_spec(spec)
+    registry = get_registry()
+    if name not in registry:
+        raise ValueError(f"unknown predictor {name!r}, expected one of: {', '.join(sorted(registry))}")
+    cls = registry[name]
+    spec_params.update(params)
+    unknown = [param for param in spec_params if param not in cls.params]
+    if unknown:
+        raise ValueError(f"predictor {name!r} has no parameter {unknown[0]!r}, expected one of: {', '.join(cls.params)}")
+    return cls(**spec_params)
+
+"""
+Unit Tests for the predictor registry
+"""
+if __name__ == "__main__":
+    # engines register themselves with the imported predictor module,
+    # not with this script's __main__ module
+    from predictor import get_registry, make_predictor, parse_spec
+    print("Should be ('tournament', {'width': 10, 'counter_bits': 3}), got: "
+          + str(parse_spec("tournament:width=10,counter_bits=3")))
+    predictor = make_predictor("tournament:width=10")
+    print("Should be tournament:width=10,counter_bits=2,history_bits=10, got: " + predictor.get_spec())
+    print("Should be 3 * 1024 * 2 + 10 = 6154, got: " + str(predictor.storage_bits()))
+    print("Registered predictors: " + ", ".join(sorted(get_registry())))
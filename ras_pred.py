@@ -0,0 +1,185 @@
+'''
+Return address stack Predictor
+
+Predicts the targets of returns: every call (a jal or jalr writing a link
+register, see riscv_decode.is_call) pushes the address of the instruction
+after it, and every return (a jalr reading a link register, see
+riscv_decode.is_return) pops the predicted target. A jalr that does both
+(e.g. jalr ra, 0(t0)) pops before it pushes.
+
+The stack is a fixed ring buffer of depth entries in a NumPy array. What
+happens when it is full or empty is set by policy:
+
+    wrap   a push onto a full stack overwrites the oldest entry, and a pop
+           from an empty stack still returns whatever entry the top points
+           at (as a hardware ring buffer does)
+    drop   a push onto a full stack is dropped, and a pop from an empty
+           stack makes no prediction
+'''
+import numpy as np
+
+from branch_events import INSTR_BYTES
+from predictor import JUMP, Predictor, register
+from riscv_decode import is_call, is_return
+
+## overflow and underflow policies of ReturnAddressStack
+RAS_POLICIES = ("wrap", "drop")
+
+@register("ras")
+class ReturnAddressStack(Predictor):
+
+    kind = JUMP
+    params = ("depth", "policy")
+
+    def __init__(self, depth = 16, policy = "wrap"):
+        '''
+        depth: number of return addresses the stack holds
+        policy: overflow and underflow policy, one of RAS_POLICIES
+        '''
+        if depth < 1:
+            raise ValueError(f"return address stack depth must be at least 1, got {depth}")
+        if policy not in RAS_POLICIES:
+            raise ValueError(f"unknown return address stack policy {policy!r}, expected one of: {', '.join(RAS_POLICIES)}")
+        self.depth = depth
+        self.policy = policy
+        self.stack = np.zeros(depth, dtype=np.uint32)
+        # index of the next entry to push to, and the number of valid entries
+        self.top = 0
+        self.count = 0
+
+    def push(self, return_pc):
+        '''
+        return: True if the push overflowed the stack
+        '''
+        overflow = self.count == self.depth
+        if overflow and self.policy == "drop": return True
+        self.stack[self.top] = return_pc
+        self.top = (self.top + 1) % self.depth
+        if not overflow: self.count += 1
+        return overflow
+
+    def peek(self):
+        '''
+        return: the return address a pop would return, or None
+        '''
+        if self.count == 0 and self.policy == "drop": return None
+        return int(self.stack[(self.top - 1) % self.depth])
+
+    def pop(self):
+        return_pc = self.peek()
+        if return_pc is not None:
+            self.top = (self.top - 1) % self.depth
+            if self.count > 0: self.count -= 1
+        return return_pc
+
+    def is_scored(self, ir):
+        return bool(is_return(ir))
+
+    def predict(self, pc, ir):
+        if not is_return(ir): return None
+        return self.peek()
+
+    def update(self, pc, ir, actual_pc):
+        if is_return(ir): self.pop()
+        if is_call(ir): self.push(pc + INSTR_BYTES)
+
+    def reset(self):
+        self.stack.fill(0)
+        self.top = 0
+        self.count = 0
+
+    def snapshot(self):
+        return {"stack": self.stack.copy(),
+                "top": self.top,
+                "count": self.count
+        }
+
+    def restore(self, snapshot):
+        self.stack[:] = snapshot["stack"]
+        self.top = snapshot["top"]
+        self.count = snapshot["count"]
+
+    def storage_bits(self):
+        # a return address per entry and the top of stack pointer
+        return self.depth * 32 + max((self.depth - 1).bit_length(), 1)
+
+    def run_block(self, block):
+        '''
+        Simulates the stack over the jumps of an EventBlock with the same
+        result as calling predict and update for every jump, in one fused loop
+
+        return: (predictions, counts), where predictions is an int64 array
+        with the predicted target of each jump (-1 for jumps that are not
+        returns and for returns without a prediction), and counts is a
+        dictionary with the number of returns (num_branches), correctly
+        predicted returns, calls, and pushes onto a full stack (overflows)
+        and pops from an empty one (underflows)
+        '''
+        jump_ids, actual_pcs, _ = block.get_jumps()
+        static_jump_irs = block.static_jump_irs
+        static_returns = [bool(is_return(ir)) for ir in static_jump_irs]
+        static_calls = [bool(is_call(ir)) for ir in static_jump_irs]
+        static_return_pcs = [pc + INSTR_BYTES for pc in block.static_jump_pcs]
+        stack = memoryview(self.stack)
+        depth = self.depth
+        drop = self.policy == "drop"
+        top, count = self.top, self.count
+        predictions = [-1] * len(jump_ids)
+        num_returns = 0
+        num_correct = 0
+        num_calls = 0
+        num_overflows = 0
+        num_underflows = 0
+
+        for i, (jump_id, actual_pc) in enumerate(zip(jump_ids, actual_pcs)):
+            if static_returns[jump_id]:
+                num_returns += 1
+                if count == 0:
+                    num_underflows += 1
+                    if not drop:
+                        top = (top - 1) % depth
+                        predictions[i] = stack[top]
+                        num_correct += stack[top] == actual_pc
+                else:
+                    top = (top - 1) % depth
+                    count -= 1
+                    predictions[i] = stack[top]
+                    num_correct += stack[top] == actual_pc
+            if static_calls[jump_id]:
+                num_calls += 1
+                if count == depth:
+                    num_overflows += 1
+                    if drop: continue
+                else:
+                    count += 1
+                stack[top] = static_return_pcs[jump_id]
+                top = (top + 1) % depth
+
+        self.top, self.count = top, count
+        counts = {"num_branches": num_returns,
+                  "num_correct": num_correct,
+                  "num_calls": num_calls,
+                  "num_overflows": num_overflows,
+                  "num_underflows": num_underflows
+        }
+        return np.array(predictions, dtype=np.int64), counts
+
+"""
+Unit Tests for ReturnAddressStack
+"""
+if __name__ == "__main__":
+    JAL_RA = 0x100000ef # jal ra,+0x100
+    RET = 0x00008067 # jalr zero,0(ra)
+    ras = ReturnAddressStack(depth = 2)
+    # three nested calls overflow a 2-entry stack
+    for pc in (0x80000000, 0x80000100, 0x80000200):
+        ras.update(pc, JAL_RA, pc + 0x100)
+    print("Should be 80000204, got: " + f"{ras.predict(0x80000300, RET):08x}")
+    ras.update(0x80000300, RET, 0x80000204)
+    print("Should be 80000104, got: " + f"{ras.predict(0x80000208, RET):08x}")
+    ras.update(0x80000208, RET, 0x80000104)
+    print("wrap: the oldest return was overwritten, should be 80000204, got: "
+          + f"{ras.predict(0x80000108, RET):08x}")
+    ras = ReturnAddressStack(depth = 2, policy = "drop")
+    print("drop: an empty stack should predict None, got: " + str(ras.predict(0x80000108, RET)))
+    print("Should be 2 * 32 + 1 = 65 storage bits, got: " + str(ras.storage_bits()))
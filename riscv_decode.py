@@ -0,0 +1,148 @@
+'''
+Vectorized RISC-V instruction classification
+
+Classifies instructions from their 32-bit instruction words (IR) instead of
+their disassembly, so that finding branches and their targets costs a few
+integer operations on whole NumPy arrays and does not depend on how the
+disassembler formats instructions. Every function also accepts plain Python
+ints.
+'''
+
+import numpy as np
+
+OPCODE_MASK = 0x7f
+OPCODE_BRANCH = 0x63 # beq, bne, blt, bge, bltu, bgeu (and their pseudo-instructions)
+OPCODE_JAL = 0x6f
+OPCODE_JALR = 0x67
+## registers the RISC-V calling convention links through (ra and t0); a
+## jump that writes one is a call, a jalr that reads one is a return
+LINK_REGS = (1, 5)
+
+def hex_to_uint32(hex_strs):
+    '''
+    return: uint32 array of a list of 8-digit hex strings, decoded in one
+    pass by bytes.fromhex instead of one int(x, 16) call per string
+    '''
+    return np.frombuffer(bytes.fromhex("".join(hex_strs)), dtype=">u4").astype(np.uint32)
+
+def get_opcode(ir):
+    return ir & OPCODE_MASK
+
+def is_branch(ir):
+    '''
+    return: True where ir is a conditional branch
+    '''
+    return (ir & OPCODE_MASK) == OPCODE_BRANCH
+
+def is_jump(ir):
+    '''
+    return: True where ir is an unconditional jump (jal or jalr)
+    '''
+    opcode = ir & OPCODE_MASK
+    return (opcode == OPCODE_JAL) | (opcode == OPCODE_JALR)
+
+def is_jalr(ir):
+    return (ir & OPCODE_MASK) == OPCODE_JALR
+
+def get_rd(ir):
+    return (ir >> 7) & 0x1f
+
+def get_rs1(ir):
+    return (ir >> 15) & 0x1f
+
+def is_link_reg(reg):
+    return (reg == LINK_REGS[0]) | (reg == LINK_REGS[1])
+
+def is_call(ir):
+    '''
+    return: True where ir is a jal or jalr that writes a link register,
+    i.e. pushes its return address onto a return address stack
+    '''
+    return is_jump(ir) & is_link_reg(get_rd(ir))
+
+def is_return(ir):
+    '''
+    return: True where ir is a jalr that reads a link register other than
+    the one it writes, i.e. pops a return address stack (a jalr that both
+    reads and writes the same link register only pushes)
+    '''
+    rs1 = get_rs1(ir)
+    return is_jalr(ir) & is_link_reg(rs1) & (get_rd(ir) != rs1)
+
+def is_indirect(ir):
+    '''
+    return: True where ir is a jalr that is not a return, i.e. a jump
+    through a function pointer or a jump table whose target varies
+    '''
+    return is_jalr(ir) & np.logical_not(is_return(ir))
+
+def get_b_imm(ir):
+    '''
+    return: the sign-extended B-type immediate of ir (an int or an
+    int64 array), i.e. the byte offset of a conditional branch's
+    target from its pc:
+    imm[12|10:5] = ir[31:25], imm[4:1|11] = ir[11:7]
+    '''
+    imm = (((ir >> 31) & 0x1) << 12) \
+        | (((ir >> 7) & 0x1) << 11) \
+        | (((ir >> 25) & 0x3f) << 5) \
+        | (((ir >> 8) & 0xf) << 1)
+    return imm - ((imm & 0x1000) << 1) # sign extend from bit 12
+
+def get_branch_target(pc, ir):
+    '''
+    return: the target pc of the conditional branch ir at pc,
+    as a uint32 array if ir is an array
+    '''
+    if isinstance(ir, np.ndarray):
+        pc = np.asarray(pc, dtype=np.int64)
+        return ((pc + get_b_imm(ir.astype(np.int64))) & 0xffffffff).astype(np.uint32)
+    return (pc + get_b_imm(ir)) & 0xffffffff
+
+def branch_arrays_from_instrs(pc, ir):
+    '''
+    Finds the branch and jump events in a run of consecutively executed
+    instructions, given as uint32 arrays of their pcs and IRs.
+
+    return: dictionary of per-event branch columns (see branch_events.EVENT_COLUMNS)
+    and per-jump columns (see branch_events.JUMP_COLUMNS) for every branch
+    and jump but the last instruction, whose actual pc (the pc of the
+    instruction executed next) is not in the arrays
+    '''
+    branch_mask = is_branch(ir[:-1])
+    branch_pc = pc[:-1][branch_mask]
+    branch_ir = ir[:-1][branch_mask]
+    target_pc = get_branch_target(branch_pc, branch_ir)
+    actual_pc = pc[1:][branch_mask]
+    jump_mask = is_jump(ir[:-1])
+    # a jump is not a branch, so the inclusive count of branches up to
+    # it is the number of branches before it
+    branches_before = np.cumsum(branch_mask, dtype=np.uint64)
+    return {"pc": branch_pc,
+            "target_pc": target_pc,
+            "ir": branch_ir,
+            "actual_pc": actual_pc,
+            "is_taken": (actual_pc == target_pc).astype(np.uint8),
+            "jump_pc": pc[:-1][jump_mask],
+            "jump_ir": ir[:-1][jump_mask],
+            "jump_actual_pc": pc[1:][jump_mask],
+            "jump_branch_index": branches_before[jump_mask]
+    }
+
+"""
+Unit Tests for riscv_decode
+"""
+if __name__ == "__main__":
+    # bltz t0,0x800000a0 at 0x8000008c
+    print("Should be True, got: " + str(is_branch(0x0002ca63)))
+    print("Target should be 800000a0, got: " + f"{get_branch_target(0x8000008c, 0x0002ca63):08x}")
+    # bgeu a0,a1,0x800000c4 at 0x800000c4 (branch to itself)
+    print("Target should be 800000c4, got: " + f"{get_branch_target(0x800000c4, 0x00b57063):08x}")
+    # li ra,0x0
+    print("Should be False, got: " + str(is_branch(0x00000093)))
+    # jal ra,0x80000100 (a call) and ret (jalr zero,0(ra))
+    print("Should be True True, got: " + str(is_call(0x100000ef)) + " " + str(is_return(0x00008067)))
+    # jalr ra,0(ra) swaps coroutines: it pushes without popping
+    print("Should be True False, got: " + str(is_call(0x000080e7)) + " " + str(is_return(0x000080e7)))
+    # jalr a5 (an indirect call through a function pointer)
+    print("Should be True, got: " + str(is_indirect(0x000780e7)))
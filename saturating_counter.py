@@ -21,11 +21,7 @@ class SaturatingCounter:
         return: False if the MSB of the number is 0
         True signifies a prediction of Taken and False signifies a prediction of Not Taken
         '''
-        bin_temp = '{0:02b}'.format(self.counter) # converts counter into binary string
-        if bin_temp[0] == "1": # MSB obtained by first character in binary string
-            return True
-        else:
-            return False 
+        return self.counter >= 2**(self.width - 1) # MSB of a width-bit counter
 
     def decrement(self):
         if self.counter > 0:
@@ -0,0 +1,242 @@
+'''
+Static prediction baselines
+
+Static predictors predict each branch the same way every time it runs, from
+its instruction alone:
+
+    always_taken    every branch is taken
+    never_taken     no branch is taken
+    btfn            backward branches (target <= pc, e.g. loops) are taken
+                    and forward branches are not
+    opcode          by the comparison the branch makes (see OPCODE_TAKEN)
+    opcode_profile  by the direction each comparison (beq, bne, ...) takes
+                    most often in the trace itself, a profile-guided baseline
+
+Since a static prediction is a function of the static branch, the accuracy
+of every heuristic follows from how many times each static branch ran and
+was taken: get_static_counts counts both with one np.bincount pass over the
+trace, and everything else is a NumPy expression over the static branch
+table, so the baselines of a trace cost about as much as reading its events
+once.
+
+StaticPred runs the heuristics other than opcode_profile as a registered
+predictor, so that they can be swept and gridded next to the dynamic ones.
+'''
+import numpy as np
+
+from predictor import Predictor, register
+
+## conditional branch funct3 -> mnemonic
+FUNCT3_NAMES = {0: "beq", 1: "bne", 4: "blt", 5: "bge", 6: "bltu", 7: "bgeu"}
+
+## the opcode heuristic (after Ball and Larus): equality tests and less-than
+## tests, mostly of a value against zero or an error code, usually fail
+OPCODE_TAKEN = {"beq": False, "bne": True, "blt": False, "bge": True, "bltu": False, "bgeu": True}
+
+HEURISTICS = ("always_taken", "never_taken", "btfn", "opcode", "opcode_profile")
+
+## events counted per np.bincount call, which bounds the memory of the
+## unpacked taken flags
+COUNT_BLOCK_SIZE = 2**24
+
+def get_funct3(ir):
+    return (ir >> 12) & 0x7
+
+def is_forward(branch_events):
+    '''
+    return: bool array, for each static branch, of whether its target is
+    after it (the definition onestage_elf counts forward branches by)
+    '''
+    return branch_events.static_target_pc > branch_events.static_pc
+
+def get_static_counts(branch_events):
+    '''
+    return: (executions, taken) int64 arrays with the number of times each
+    static branch ran and was taken
+    '''
+    num_static = branch_events.num_static
+    # one bincount of 2 * branch id + taken counts both directions of every
+    # static branch at once
+    direction_counts = np.zeros(2 * num_static, dtype=np.int64)
+    for block in branch_events.iter_blocks(COUNT_BLOCK_SIZE):
+        keys = block.branch_id.astype(np.intp)
+        keys <<= 1
+        keys += np.unpackbits(block.taken_bits, count=len(block))
+        direction_counts += np.bincount(keys, minlength=2 * num_static)
+    not_taken, taken = direction_counts[0::2], direction_counts[1::2]
+    return not_taken + taken, taken.copy()
+
+def get_opcode_counts(branch_events, static_counts = None):
+    '''
+    return: dictionary of mnemonic (see FUNCT3_NAMES) -> (executions, taken)
+    of the branches making that comparison
+    '''
+    executions, taken = get_static_counts(branch_events) if static_counts is None else static_counts
+    funct3 = get_funct3(branch_events.static_ir)
+    opcode_executions = np.bincount(funct3, weights=executions, minlength=8).astype(np.int64)
+    opcode_taken = np.bincount(funct3, weights=taken, minlength=8).astype(np.int64)
+    return {name: (int(opcode_executions[code]), int(opcode_taken[code]))
+            for code, name in FUNCT3_NAMES.items()}
+
+def get_static_predictions(branch_events, heuristic, static_counts = None):
+    '''
+    return: bool array of the prediction of heuristic (one of HEURISTICS)
+    for each static branch; only opcode_profile needs static_counts, and
+    counts them if they are not given
+    '''
+    num_static = branch_events.num_static
+    if heuristic == "always_taken":
+        return np.ones(num_static, dtype=bool)
+    if heuristic == "never_taken":
+        return np.zeros(num_static, dtype=bool)
+    if heuristic == "btfn":
+        return np.logical_not(is_forward(branch_events))
+    if heuristic == "opcode":
+        opcode_taken = np.zeros(8, dtype=bool)
+        for code, name in FUNCT3_NAMES.items():
+            opcode_taken[code] = OPCODE_TAKEN[name]
+        return opcode_taken[get_funct3(branch_events.static_ir)]
+    if heuristic == "opcode_profile":
+        opcode_counts = get_opcode_counts(branch_events, static_counts)
+        opcode_taken = np.zeros(8, dtype=bool)
+        for code, name in FUNCT3_NAMES.items():
+            executions, taken = opcode_counts[name]
+            opcode_taken[code] = 2 * taken >= executions
+        return opcode_taken[get_funct3(branch_events.static_ir)]
+    raise ValueError(f"unknown static heuristic {heuristic!r}, expected one of: {', '.join(HEURISTICS)}")
+
+def get_baseline_counts(branch_events, heuristics = HEURISTICS, static_counts = None):
+    '''
+    return: dictionary of heuristic -> counts dictionary with the number of
+    branches and correct predictions, as a predictor's run returns
+    '''
+    if static_counts is None: static_counts = get_static_counts(branch_events)
+    executions, taken = static_counts
+    baselines = {}
+    for heuristic in heuristics:
+        static_taken = get_static_predictions(branch_events, heuristic, static_counts)
+        num_correct = np.where(static_taken, taken, executions - taken).sum()
+        baselines[heuristic] = {"num_branches": len(branch_events),
+                                "num_correct": int(num_correct)}
+    return baselines
+
+def get_direction_counts(branch_events, static_counts = None):
+    '''
+    return: the "branch" counters of bpa_pyriscv/counters.py (forward_taken,
+    forward_not_taken, backward_taken, backward_not_taken) of the trace
+    '''
+    executions, taken = get_static_counts(branch_events) if static_counts is None else static_counts
+    forward = is_forward(branch_events)
+    not_taken = executions - taken
+    return {"forward_taken": int(taken[forward].sum()),
+            "backward_not_taken": int(not_taken[~forward].sum()),
+            "backward_taken": int(taken[~forward].sum()),
+            "forward_not_taken": int(not_taken[forward].sum())
+    }
+
+@register("static")
+class StaticPred(Predictor):
+
+    params = ("heuristic",)
+
+    def __init__(self, heuristic = "btfn"):
+        '''
+        heuristic: one of HEURISTICS other than opcode_profile, which needs
+        the whole trace (see get_baseline_counts)
+        '''
+        if heuristic not in HEURISTICS or heuristic == "opcode_profile":
+            raise ValueError(f"unknown static heuristic {heuristic!r}, expected one of: "
+                             + ", ".join(h for h in HEURISTICS if h != "opcode_profile"))
+        self.heuristic = heuristic
+        # pc -> prediction of the static branches of the trace, since the
+        # target and instruction a heuristic looks at are not in a pc
+        # (see set_static_branches)
+        self.static_taken = {}
+        self.static_pc = None
+
+    def set_static_branches(self, branch_events):
+        '''
+        Builds the predictions predict looks up from the static branch table
+        of branch_events; run and run_block do this for the trace they run
+        '''
+        self.static_pc = branch_events.static_pc
+        static_taken = get_static_predictions(branch_events, self.heuristic)
+        self.static_taken = dict(zip(branch_events.static_pc.tolist(), static_taken.tolist()))
+
+    def predict(self, pc):
+        if self.heuristic == "always_taken": return True
+        if self.heuristic == "never_taken": return False
+        if pc not in self.static_taken:
+            raise ValueError(f"static predictor {self.get_spec()!r} has no branch at pc {pc:#x}; "
+                             "call set_static_branches with the trace's events first")
+        return self.static_taken[pc]
+
+    def update(self, pc, is_taken, actual_pc):
+        pass
+
+    def reset(self):
+        pass
+
+    def snapshot(self):
+        return {}
+
+    def restore(self, snapshot):
+        pass
+
+    def storage_bits(self):
+        return 0
+
+    def run_block(self, block):
+        '''
+        Predicts an EventBlock by indexing the static branch predictions
+        with the block's branch ids, without a per-branch loop
+
+        return: (predictions, counts), where predictions is a bool array with
+        the prediction for each branch, and counts is a dictionary with the
+        number of branches and correct predictions
+        '''
+        key = ("static", self.heuristic)
+        if key not in block.static_cache:
+            block.static_cache[key] = get_static_predictions(block.events, self.heuristic)
+        static_taken = block.static_cache[key]
+        if self.static_pc is not block.events.static_pc: self.set_static_branches(block.events)
+        predictions = static_taken[block.events.branch_id]
+        counts = {"num_branches": len(block),
+                  "num_correct": int(np.count_nonzero(predictions == block.events.taken))}
+        return predictions, counts
+
+"""
+Unit Tests for the static baselines
+"""
+if __name__ == "__main__":
+    from branch_events import BranchEvents, EventBlock
+    # a backward bne loop branch taken 3 times then not, and a forward beq taken once
+    events = BranchEvents.from_columns({
+        "pc": np.array([0x80000010] * 4 + [0x80000020], dtype=np.uint32),
+        "target_pc": np.array([0x80000000] * 4 + [0x80000040], dtype=np.uint32),
+        "ir": np.array([0xfe0098e3] * 4 + [0x02000063], dtype=np.uint32),
+        "actual_pc": np.array([0x80000000] * 3 + [0x80000014, 0x80000040], dtype=np.uint32),
+        "is_taken": np.array([1, 1, 1, 0, 1], dtype=np.uint8),
+    })
+    baselines = get_baseline_counts(events)
+    print("Should be 4 always taken correct, got: " + str(baselines["always_taken"]["num_correct"]))
+    print("Should be 1 never taken correct, got: " + str(baselines["never_taken"]["num_correct"]))
+    print("Should be 3 btfn correct, got: " + str(baselines["btfn"]["num_correct"]))
+    print("Should be 3 opcode correct, got: " + str(baselines["opcode"]["num_correct"]))
+    print("Should be 4 opcode profile correct, got: " + str(baselines["opcode_profile"]["num_correct"]))
+    print("Should be {'forward_taken': 1, 'backward_not_taken': 1, 'backward_taken': 3, 'forward_not_taken': 0}, got: "
+          + str(get_direction_counts(events)))
+    predictions, counts = StaticPred("btfn").run(events)
+    print("Should be [True, True, True, True, False], got: " + str(predictions.tolist()))
+    for heuristic in ("btfn", "opcode"):
+        fused_predictions, fused_counts = StaticPred(heuristic).run(events)
+        static = StaticPred(heuristic)
+        static.set_static_branches(events)
+        predictions, counts = Predictor.run_block(static, EventBlock(events))
+        print(heuristic + ": predict and update should match run_block, got: "
+              + str(predictions.tolist() == fused_predictions.tolist()
+                    and counts["num_correct"] == fused_counts["num_correct"]))
+    try:
+        StaticPred("btfn").predict(0x80000010)
+    except ValueError as error:
+        print("Should raise for a branch it has no static table for, got: " + str(error))
@@ -0,0 +1,85 @@
+'''
+Single-pass sweeps over many predictor configurations
+
+Running N predictor configurations one after another walks (and decodes)
+the whole trace N times. sweep instead walks the trace once, a block of
+events at a time: each block is decoded into Python lists once (see
+branch_events.EventBlock), and every predictor is advanced over that block
+before moving on to the next one, so all configurations move through the
+trace in lockstep. Per-static-branch values such as table indices are
+computed once per trace and shared by every configuration that uses them.
+
+A sweep therefore costs one scan of the trace plus each configuration's
+own table updates. Any predictor (see predictor.Predictor) can be swept.
+'''
+
+import itertools
+import sys
+
+import numpy as np
+
+from branch_events import EventBlock
+
+DEFAULT_BLOCK_SIZE = 2**16 # events decoded at a time
+
+def sweep(branch_events, predictors, block_size = DEFAULT_BLOCK_SIZE):
+    '''
+    Advances every predictor over branch_events in lockstep
+
+    branch_events: BranchEvents, e.g. trace.events
+    predictors: list of predictors, each continuing from its current state
+    return: list of (predictions, counts), one per predictor in the same
+    order, as returned by the predictor's run method for the whole trace
+    '''
+    static_cache = {} # shared by the blocks of this trace
+    predictions = [[] for _ in predictors]
+    counts = [{} for _ in predictors]
+    for events_block in branch_events.iter_blocks(block_size):
+        block = EventBlock(events_block, static_cache)
+        for i, predictor in enumerate(predictors):
+            block_predictions, block_counts = predictor.run_block(block)
+            predictions[i].append(block_predictions)
+            for name, count in block_counts.items():
+                counts[i][name] = counts[i].get(name, 0) + count
+
+    # iter_blocks yields at least one block, so every predictor has results
+    return [(np.concatenate(predictions[i]), counts[i]) for i in range(len(predictors))]
+
+def make_tournament_preds(widths, counter_bits = (2,), history_bits = (None,)):
+    '''
+    return: list of TournamentPred, one per combination of width, counter
+    width and history length, and the list of (width, counter_bits,
+    history_bits) of each
+    '''
+    from tournament_pred import TournamentPred
+    configs = list(itertools.product(widths, counter_bits, history_bits))
+    return [TournamentPred(width, bits, history) for width, bits, history in configs], configs
+
+"""
+Sweeps the user-specified predictor specs (by default, tournament predictor
+widths and counter widths) over the user-specified trace
+"""
+if __name__ == "__main__":
+    import time
+    from branch_trace import Trace
+    from predictor import make_predictor
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} <instruction file or binary trace> [max width | predictor spec ...]")
+        sys.exit(1)
+    trace = Trace.from_path(sys.argv[1])
+    if len(sys.argv) > 2 and not sys.argv[2].isdigit():
+        predictors = [make_predictor(spec) for spec in sys.argv[2:]]
+    else:
+        max_width = int(sys.argv[2]) if len(sys.argv) == 3 else 16
+        predictors, _ = make_tournament_preds(range(1, max_width + 1), counter_bits = (2, 3))
+    start = time.perf_counter()
+    results = sweep(trace.events, predictors)
+    elapsed = time.perf_counter() - start
+    print("predictor,storage_bits,pct_correct")
+    for predictor, (_, counts) in zip(predictors, results):
+        if "num_correct" in counts:
+            pct_correct = round(counts["num_correct"] / counts["num_branches"] * 100, 2)
+        else:
+            pct_correct = ""
+        print(f"\"{predictor.get_spec()}\",{predictor.storage_bits()},{pct_correct}")
+    print(f"{len(predictors)} configurations over {len(trace)} branches in {elapsed:.2f} s", file=sys.stderr)
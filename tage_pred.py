@@ -0,0 +1,401 @@
+'''
+TAGE Predictor
+
+A bimodal base predictor (a HistoryTable indexed by pc) backed by
+num_tables tagged tables indexed by hashes of the pc and of increasingly
+long global branch histories, whose lengths grow geometrically from
+min_history to max_history. Each tagged entry holds a tag, a prediction
+counter and a usefulness counter.
+
+The prediction comes from the matching entry with the longest history
+(the provider), or from the base predictor if no tagged entry matches.
+A newly allocated provider entry (weak counter, not yet useful) defers to
+the alternate prediction (the next longest match) while that has proven
+more accurate for new entries. On a misprediction a new entry is allocated
+in a table with a longer history than the provider's, and usefulness
+counters are periodically halved so that stale entries can be replaced.
+
+Indices and tags hash the pc with folded global histories (see
+FoldedHistory), so their cost does not depend on the history length.
+The global history takes every branch's outcome, so in run_block the
+folded histories of a whole block are computed up front with NumPy (see
+fold_history_array), and the per-branch loop only reads and trains tables.
+'''
+import numpy as np
+
+from global_branch_history import GlobalBranchHistory, fold_history_array
+from history_table import HistoryTable
+from predictor import PC_ALIGN_BITS, Predictor, register
+
+def check_tag_bits(tag_bits):
+    '''
+    Raises ValueError unless tag_bits fits the uint16 tag arrays and leaves
+    the second tag fold (tag_bits - 1 bits) at least one bit
+    '''
+    if not 2 <= tag_bits <= 16:
+        raise ValueError(f"tag_bits must be between 2 and 16 (tags are uint16), got {tag_bits}")
+
+def get_history_lengths(num_tables, min_history, max_history):
+    '''
+    return: list of num_tables geometrically spaced history lengths
+    from min_history to max_history
+    '''
+    if num_tables == 1: return [min_history]
+    ratio = (max_history / min_history) ** (1 / (num_tables - 1))
+    return [int(round(min_history * ratio ** i)) for i in range(num_tables)]
+
+@register("tage")
+class TAGEPred(Predictor):
+
+    params = ("num_tables", "table_bits", "tag_bits", "base_bits",
+              "min_history", "max_history", "counter_bits", "useful_bits")
+
+    USE_ALT_BITS = 4
+    RESET_PERIOD = 2**18 # branches between halvings of the usefulness counters
+
+    def __init__(self, num_tables = 4, table_bits = 10, tag_bits = 9, base_bits = 12,
+                 min_history = 4, max_history = 64, counter_bits = 3, useful_bits = 2):
+        '''
+        num_tables: number of tagged tables
+        table_bits: each tagged table has 2 ^ table_bits entries
+        tag_bits: width of the tags (2 to 16)
+        base_bits: the base predictor has 2 ^ base_bits 2-bit counters
+        min_history, max_history: history lengths of the first and last tagged table
+        counter_bits: width of the tagged prediction counters
+        useful_bits: width of the usefulness counters
+        '''
+        check_tag_bits(tag_bits)
+        self.num_tables = num_tables
+        self.table_bits = table_bits
+        self.tag_bits = tag_bits
+        self.base_bits = base_bits
+        self.min_history = min_history
+        self.max_history = max_history
+        self.counter_bits = counter_bits
+        self.useful_bits = useful_bits
+        self.history_lengths = get_history_lengths(num_tables, min_history, max_history)
+
+        self.base = HistoryTable("Base", base_bits, 2)
+        self.counters = [HistoryTable(f"T{i}", table_bits, counter_bits) for i in range(num_tables)]
+        self.tags = [np.zeros(2**table_bits, dtype=np.uint16) for _ in range(num_tables)]
+        self.useful = [np.zeros(2**table_bits, dtype=np.uint8) for _ in range(num_tables)]
+        self.use_alt_on_new = 2**(self.USE_ALT_BITS - 1)
+        self.num_updates_since_reset = 0
+
+        self.global_branch_hist = GlobalBranchHistory(max(self.history_lengths))
+        # per table: the history folded to the index width, and to the tag width
+        # and one bit less (XORed together so that tags and indices differ)
+        self.index_hists = [self.global_branch_hist.add_folded(length, table_bits)
+                            for length in self.history_lengths]
+        self.tag_hists = [(self.global_branch_hist.add_folded(length, tag_bits),
+                           self.global_branch_hist.add_folded(length, tag_bits - 1))
+                          for length in self.history_lengths]
+        self.lookup = None
+
+    def get_base_index(self, pc):
+        return (pc >> PC_ALIGN_BITS) & (2**self.base_bits - 1)
+
+    def get_pc_parts(self, pc):
+        '''
+        return: (index part, tag part) of the pc, shared by every tagged table
+        '''
+        pc_bits = pc >> PC_ALIGN_BITS
+        return (pc_bits ^ (pc_bits >> self.table_bits)) & (2**self.table_bits - 1), \
+            pc_bits & (2**self.tag_bits - 1)
+
+    def get_indices_and_tags(self, pc):
+        index_part, tag_part = self.get_pc_parts(pc)
+        indices = [index_part ^ hist.value for hist in self.index_hists]
+        tags = [tag_part ^ hist.value ^ (hist_short.value << 1) for hist, hist_short in self.tag_hists]
+        return indices, tags
+
+    def _lookup(self, base_idx, indices, tags):
+        '''
+        return: (provider table or -1, provider prediction, alternate
+        prediction, final prediction)
+        '''
+        provider = alt = -1
+        for table in range(self.num_tables - 1, -1, -1):
+            if self.tags[table][indices[table]] == tags[table]:
+                if provider < 0:
+                    provider = table
+                else:
+                    alt = table
+                    break
+        base_pred = self.base.get_prediction(base_idx)
+        if provider < 0:
+            return provider, base_pred, base_pred, base_pred
+        provider_pred = self.counters[provider].get_prediction(indices[provider])
+        alt_pred = base_pred if alt < 0 else self.counters[alt].get_prediction(indices[alt])
+        if self._is_new(provider, indices[provider]) and self.use_alt_on_new >= 2**(self.USE_ALT_BITS - 1):
+            return provider, provider_pred, alt_pred, alt_pred
+        return provider, provider_pred, alt_pred, provider_pred
+
+    def _is_new(self, table, idx):
+        '''
+        return: True if the entry looks newly allocated: a weak counter
+        that has not been useful yet
+        '''
+        value = self.counters[table].get_value(idx)
+        threshold = self.counters[table].threshold
+        return (value == threshold or value == threshold - 1) and self.useful[table][idx] == 0
+
+    def predict(self, pc):
+        base_idx = self.get_base_index(pc)
+        indices, tags = self.get_indices_and_tags(pc)
+        provider, provider_pred, alt_pred, prediction = self._lookup(base_idx, indices, tags)
+        self.lookup = (pc, base_idx, indices, tags, provider, provider_pred, alt_pred, prediction)
+        return prediction
+
+    def update(self, pc, is_taken, actual_pc):
+        if self.lookup is None or self.lookup[0] != pc: self.predict(pc)
+        _, base_idx, indices, tags, provider, provider_pred, alt_pred, prediction = self.lookup
+        useful_max = 2**self.useful_bits - 1
+
+        if provider >= 0:
+            idx = indices[provider]
+            if self._is_new(provider, idx) and provider_pred != alt_pred:
+                if alt_pred == is_taken:
+                    self.use_alt_on_new = min(self.use_alt_on_new + 1, 2**self.USE_ALT_BITS - 1)
+                else:
+                    self.use_alt_on_new = max(self.use_alt_on_new - 1, 0)
+            if is_taken:
+                self.counters[provider].increment(idx)
+            else:
+                self.counters[provider].decrement(idx)
+            if provider_pred != alt_pred:
+                if provider_pred == is_taken:
+                    self.useful[provider][idx] = min(int(self.useful[provider][idx]) + 1, useful_max)
+                else:
+                    self.useful[provider][idx] = max(int(self.useful[provider][idx]) - 1, 0)
+        elif is_taken:
+            self.base.increment(base_idx)
+        else:
+            self.base.decrement(base_idx)
+
+        if prediction != is_taken and provider < self.num_tables - 1:
+            self._allocate(provider, indices, tags, is_taken)
+
+        self.num_updates_since_reset += 1
+        if self.num_updates_since_reset == self.RESET_PERIOD:
+            self._age_useful()
+        self.global_branch_hist.shift_in(1 if is_taken else 0)
+        self.lookup = None
+
+    def _allocate(self, provider, indices, tags, is_taken):
+        '''
+        Allocates an entry for the branch in the first table with a longer
+        history than the provider's whose entry is not useful, or makes
+        those entries less useful if there is none
+        '''
+        for table in range(provider + 1, self.num_tables):
+            idx = indices[table]
+            if self.useful[table][idx] == 0:
+                self.tags[table][idx] = tags[table]
+                threshold = self.counters[table].threshold
+                self.counters[table].table[idx] = threshold if is_taken else threshold - 1
+                return
+        for table in range(provider + 1, self.num_tables):
+            idx = indices[table]
+            if self.useful[table][idx] > 0: self.useful[table][idx] -= 1
+
+    def _age_useful(self):
+        for useful in self.useful:
+            useful >>= 1
+        self.num_updates_since_reset = 0
+
+    def reset(self):
+        self.base.reset()
+        for table in range(self.num_tables):
+            self.counters[table].reset()
+            self.tags[table].fill(0)
+            self.useful[table].fill(0)
+        self.use_alt_on_new = 2**(self.USE_ALT_BITS - 1)
+        self.num_updates_since_reset = 0
+        self.global_branch_hist.set_outcomes(np.zeros(0, dtype=np.uint8))
+        self.lookup = None
+
+    def snapshot(self):
+        return {"base": self.base.table.copy(),
+                "counters": [counters.table.copy() for counters in self.counters],
+                "tags": [tags.copy() for tags in self.tags],
+                "useful": [useful.copy() for useful in self.useful],
+                "use_alt_on_new": self.use_alt_on_new,
+                "num_updates_since_reset": self.num_updates_since_reset,
+                "outcomes": self.global_branch_hist.get_outcomes()
+        }
+
+    def restore(self, snapshot):
+        self.base.table[:] = snapshot["base"]
+        for table in range(self.num_tables):
+            self.counters[table].table[:] = snapshot["counters"][table]
+            self.tags[table][:] = snapshot["tags"][table]
+            self.useful[table][:] = snapshot["useful"][table]
+        self.use_alt_on_new = snapshot["use_alt_on_new"]
+        self.num_updates_since_reset = snapshot["num_updates_since_reset"]
+        self.global_branch_hist.set_outcomes(snapshot["outcomes"])
+        self.lookup = None
+
+    def storage_bits(self):
+        entry_bits = self.tag_bits + self.counter_bits + self.useful_bits
+        return self.base.height * 2 + self.num_tables * 2**self.table_bits * entry_bits \
+            + self.global_branch_hist.width + self.USE_ALT_BITS
+
+    def _get_block_indices_and_tags(self, block):
+        '''
+        return: base indices and per-table lists of indices and tags of
+        every branch of block, from the folded histories of the whole block
+        '''
+        static_pc = block.events.static_pc.astype(np.int64)
+        branch_id = block.events.branch_id
+        base_idx = self.get_base_index(static_pc)[branch_id]
+        index_part, tag_part = self.get_pc_parts(static_pc)
+        index_part, tag_part = index_part[branch_id], tag_part[branch_id]
+
+        outcomes = np.concatenate((self.global_branch_hist.get_outcomes(),
+                                   block.events.taken.astype(np.uint8)))
+        start = self.global_branch_hist.width # value before the block's first branch
+        stop = start + len(block)
+        indices = []
+        tags = []
+        for length in self.history_lengths:
+            index_hist = fold_history_array(outcomes, length, self.table_bits)[start:stop]
+            tag_hist = fold_history_array(outcomes, length, self.tag_bits)[start:stop]
+            tag_hist_short = fold_history_array(outcomes, length, self.tag_bits - 1)[start:stop]
+            indices.append((index_part ^ index_hist).tolist())
+            tags.append((tag_part ^ tag_hist ^ (tag_hist_short << 1)).tolist())
+        return base_idx.tolist(), indices, tags, outcomes
+
+    def run_block(self, block):
+        '''
+        Simulates the predictor over an EventBlock with the same result as
+        calling predict and update for every branch, in one fused loop
+
+        return: (predictions, counts), where predictions is a bool array with
+        the prediction for each branch, and counts is a dictionary with the
+        number of branches, correct predictions, predictions provided by a
+        tagged table, and allocations
+        '''
+        num_branches = len(block)
+        predictions = bytearray(num_branches)
+        if num_branches == 0:
+            return np.frombuffer(predictions, dtype=bool), {"num_branches": 0, "num_correct": 0,
+                                                            "num_tagged": 0, "num_allocations": 0}
+        base_idxs, indices, tags, outcomes = self._get_block_indices_and_tags(block)
+
+        num_tables = self.num_tables
+        tables = list(range(num_tables))
+        tables_down = tables[::-1]
+        base = self.base.counters
+        base_max, base_thr = self.base.max_value, self.base.threshold
+        ctrs = [counters.counters for counters in self.counters]
+        ctr_max, ctr_thr = self.counters[0].max_value, self.counters[0].threshold
+        tag_tables = [memoryview(tags_array) for tags_array in self.tags]
+        useful = [memoryview(useful_array) for useful_array in self.useful]
+        useful_max = 2**self.useful_bits - 1
+        use_alt = self.use_alt_on_new
+        use_alt_max, use_alt_thr = 2**self.USE_ALT_BITS - 1, 2**(self.USE_ALT_BITS - 1)
+        since_reset = self.num_updates_since_reset
+        reset_period = self.RESET_PERIOD
+        correct_preds = 0
+        num_tagged = 0
+        num_allocations = 0
+
+        rows = zip(base_idxs, block.taken, zip(*indices), zip(*tags))
+        for i, (base_idx, outcome, idxs, branch_tags) in enumerate(rows):
+            # find the provider and alternate tables
+            provider = alt = -1
+            for table in tables_down:
+                if tag_tables[table][idxs[table]] == branch_tags[table]:
+                    if provider < 0:
+                        provider = table
+                    else:
+                        alt = table
+                        break
+            if provider < 0:
+                prediction = provider_pred = alt_pred = base[base_idx] >= base_thr
+            else:
+                num_tagged += 1
+                idx = idxs[provider]
+                value = ctrs[provider][idx]
+                provider_pred = value >= ctr_thr
+                if alt < 0:
+                    alt_pred = base[base_idx] >= base_thr
+                else:
+                    alt_pred = ctrs[alt][idxs[alt]] >= ctr_thr
+                is_new = (value == ctr_thr or value == ctr_thr - 1) and useful[provider][idx] == 0
+                prediction = alt_pred if is_new and use_alt >= use_alt_thr else provider_pred
+            predictions[i] = prediction
+            if prediction == outcome: correct_preds += 1
+
+            # train the provider, or the base predictor
+            if provider >= 0:
+                if is_new and provider_pred != alt_pred:
+                    if alt_pred == outcome:
+                        if use_alt < use_alt_max: use_alt += 1
+                    elif use_alt > 0:
+                        use_alt -= 1
+                counters = ctrs[provider]
+                if outcome:
+                    if value < ctr_max: counters[idx] = value + 1
+                else:
+                    if value > 0: counters[idx] = value - 1
+                if provider_pred != alt_pred:
+                    useful_value = useful[provider][idx]
+                    if provider_pred == outcome:
+                        if useful_value < useful_max: useful[provider][idx] = useful_value + 1
+                    elif useful_value > 0:
+                        useful[provider][idx] = useful_value - 1
+            else:
+                value = base[base_idx]
+                if outcome:
+                    if value < base_max: base[base_idx] = value + 1
+                else:
+                    if value > 0: base[base_idx] = value - 1
+
+            # allocate on a misprediction
+            if prediction != outcome and provider < num_tables - 1:
+                for table in tables[provider + 1:]:
+                    if useful[table][idxs[table]] == 0:
+                        tag_tables[table][idxs[table]] = branch_tags[table]
+                        ctrs[table][idxs[table]] = ctr_thr if outcome else ctr_thr - 1
+                        num_allocations += 1
+                        break
+                else:
+                    for table in tables[provider + 1:]:
+                        useful_value = useful[table][idxs[table]]
+                        if useful_value > 0: useful[table][idxs[table]] = useful_value - 1
+
+            since_reset += 1
+            if since_reset == reset_period:
+                for useful_array in self.useful:
+                    useful_array >>= 1
+                since_reset = 0
+
+        self.use_alt_on_new = use_alt
+        self.num_updates_since_reset = since_reset
+        self.global_branch_hist.set_outcomes(outcomes)
+        self.lookup = None
+        counts = {"num_branches": num_branches,
+                  "num_correct": correct_preds,
+                  "num_tagged": num_tagged,
+                  "num_allocations": num_allocations
+        }
+        return np.frombuffer(predictions, dtype=bool), counts
+
+"""
+Unit Tests for TAGEPred
+"""
+if __name__ == "__main__":
+    print("History lengths should be [4, 10, 25, 64], got: " + str(get_history_lengths(4, 4, 64)))
+    # a branch taken every 8th time needs 7 bits of history, more than
+    # the bimodal base can use
+    tage = TAGEPred(num_tables = 2, table_bits = 6, tag_bits = 7, min_history = 4, max_history = 16)
+    correct = 0
+    for i in range(400):
+        outcome = i % 8 == 0
+        if i >= 300: correct += tage.predict(0x80000010) == outcome
+        tage.update(0x80000010, outcome, 0)
+    print("Should predict 100 of the last 100 outcomes of a 1-in-8 loop, got: " + str(correct))
+    print("Storage should be 2^12 * 2 + 2 * 2^6 * (7 + 3 + 2) + 16 + 4 = 9748 bits, got: "
+          + str(tage.storage_bits()))
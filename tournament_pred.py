@@ -1,45 +1,68 @@
 '''
 Have to call get_prediction before update_predictor or will crash
+
+predict and update implement the common predictor protocol (see predictor),
+and run simulates a whole trace at once through a fused run_block loop
 '''
+import numpy as np
+
+from predictor import Predictor, register
 from history_table import HistoryTable
 from saturating_counter import SaturatingCounter
 from global_branch_history import GlobalBranchHistory
 from bpa_pyriscv.mux import make_mux
 
-class TournamentPred:
+@register("tournament")
+class TournamentPred(Predictor):
+
+    params = ("width", "counter_bits", "history_bits")
 
-    def __init__(self, width = 2):
+    def __init__(self, width = 2, counter_bits = 2, history_bits = None, update_on_mispredict = True):
         '''
         For this tournament predictor we need 3 History Tables: BHT, PHT, and Meta
         We also need a 2-input Mux
         BHT table is indexed by 2 bits of PC
         PHT and Meta indexed by 2 bits of Global Branch History
         width indicates how many bits of the PC and Global Branch History we are using to index BHT, PHT, Meta
+        counter_bits is the width of every saturating counter
+        history_bits, if given, is the number of Global Branch History bits indexing PHT and Meta instead of width
+        update_on_mispredict: run only updates the predictor when its prediction was wrong
+        (as the runner always has); False updates it after every branch
         '''
-        self.BHT = HistoryTable("BHT", width) # This by default has height of 4 if we're using just 2 bits of PC to index
-        self.PHT = HistoryTable("PHT", width)
-        self.meta = HistoryTable("Meta", width)
+        if history_bits is None: history_bits = width
+        if history_bits < 1:
+            raise ValueError(f"tournament needs at least 1 history bit, got {history_bits}")
+        self.BHT = HistoryTable("BHT", width, counter_bits) # This by default has height of 4 if we're using just 2 bits of PC to index
+        self.PHT = HistoryTable("PHT", history_bits, counter_bits)
+        self.meta = HistoryTable("Meta", history_bits, counter_bits)
         self.BHT_prediction = None
         self.PHT_prediction = None
         self.meta_prediction = None
-        self.global_branch_hist = GlobalBranchHistory(width)
+        self.global_branch_hist = GlobalBranchHistory(history_bits)
+        self.width = width
+        self.counter_bits = counter_bits
+        self.history_bits = history_bits
+        self.update_on_mispredict = update_on_mispredict
+        # 0 selects the BHT and 1 the PHT; built once, as the
+        # inputs read the latest predictions when the mux is called
+        self.mux = make_mux(lambda: self.BHT_prediction, lambda: self.PHT_prediction)
         
     def get_prediction(self, pc):
         '''
         Return: True if the prediction is Taken and False if the prediction is Not Taken
         Inputs: pc, make sure that it is an integer
         '''
+        gbh = self.global_branch_hist.get_gbh()
         self.BHT_prediction = self.BHT.get_prediction(pc)
-        self.PHT_prediction = self.PHT.get_prediction(self.global_branch_hist.get_gbh())
-        self.meta_prediction = self.meta.get_prediction(self.global_branch_hist.get_gbh()) # 0/False means that meta chose BHT and 1/True means that meta chose PHT
+        self.PHT_prediction = self.PHT.get_prediction(gbh)
+        self.meta_prediction = self.meta.get_prediction(gbh) # 0/False means that meta chose BHT and 1/True means that meta chose PHT
         
-        mux = make_mux(lambda: self.BHT_prediction, lambda: self.PHT_prediction)
         if self.meta_prediction == True:
             mux_sel = 1
         else:
             mux_sel = 0
         
-        return mux(mux_sel)
+        return self.mux(mux_sel)
 
 
     def update_predictor(self, outcome: bool, pc: int):
@@ -54,14 +77,15 @@ class TournamentPred:
         BHT Prediction == PHT Prediction: Meta stays unchanged since it can not favor one result over the other
         BHT Prediction != PHT Prediction: Increment/Decrement Meta based on which side it chose and whether that side turned out to predicted correctly
         '''
+        gbh = self.global_branch_hist.get_gbh()
         if outcome == True:
             # outcome was that the branch was taken: increment both BHT and PHT at appropriate idx
             self.BHT.increment(pc)
-            self.PHT.increment(self.global_branch_hist.get_gbh())
+            self.PHT.increment(gbh)
         else:
             # outcome was that the branch was not taken: decrement both BHT and PHT at appropriate idx
             self.BHT.decrement(pc)
-            self.PHT.decrement(self.global_branch_hist.get_gbh())
+            self.PHT.decrement(gbh)
 
         # After updating both the BHT and the PHT, decide if we need to update the meta predictor
 
@@ -72,19 +96,128 @@ class TournamentPred:
             # BHT and PHT predicted differently, so we have to update meta
             if self.PHT_prediction == outcome:
                 # PHT predicted correctly, we have to increment to make meta choose PHT next time
-                self.meta.increment(self.global_branch_hist.get_gbh())
+                self.meta.increment(gbh)
             else:
                 # PHT predicted incorrectly, we have to decrement to make meta choose BHT next time
-                self.meta.decrement(self.global_branch_hist.get_gbh())
+                self.meta.decrement(gbh)
         
         # Now, the final step is to update the global branch hist
-        # TODO: update the global branch history
         if outcome == True:
             self.global_branch_hist.shift_in(1)
         else:
             self.global_branch_hist.shift_in(0)
 
-            
+    def predict(self, pc):
+        return self.get_prediction(self.get_index(pc))
+
+    def update(self, pc, is_taken, actual_pc):
+        self.update_predictor(is_taken, self.get_index(pc))
+
+    def reset(self):
+        for table in (self.BHT, self.PHT, self.meta):
+            table.reset()
+        self.global_branch_hist.set_gbh("0" * self.history_bits)
+        self.BHT_prediction = self.PHT_prediction = self.meta_prediction = None
+
+    def snapshot(self):
+        return {"BHT": self.BHT.table.copy(),
+                "PHT": self.PHT.table.copy(),
+                "meta": self.meta.table.copy(),
+                "gbh": self.global_branch_hist.get_gbh()
+        }
+
+    def restore(self, snapshot):
+        self.BHT.table[:] = snapshot["BHT"]
+        self.PHT.table[:] = snapshot["PHT"]
+        self.meta.table[:] = snapshot["meta"]
+        self.global_branch_hist.set_gbh(format(snapshot["gbh"], f"0{self.history_bits}b"))
+
+    def storage_bits(self):
+        return (self.BHT.height + self.PHT.height + self.meta.height) * self.counter_bits \
+            + self.history_bits
+
+    def get_index(self, pc):
+        '''
+        return: the BHT index of the branch at pc (works on arrays of pcs too)
+        '''
+        return (pc >> self.width) & (2**self.width - 1)
+
+    def run_block(self, block):
+        '''
+        Simulates the predictor over an EventBlock, continuing from the state
+        the previous block left it in (see Predictor.run and sweep), with the
+        same result as calling get_prediction(self.get_index(pc)) for every
+        branch and update_predictor whenever the prediction is wrong
+        (or after every branch, see update_on_mispredict)
+
+        Outputs: (predictions, counts), where predictions is a bool array with the
+        prediction for each branch, and counts is a dictionary with the number of
+        branches, correct predictions and predictor updates
+
+        The loop is fused: the tables are read and written directly through
+        their counters and the global branch history is kept in a local int,
+        so there is no method call per branch. That makes it about 3x faster
+        than calling get_prediction and update_predictor per branch, not an
+        order of magnitude: what is left is the loop itself, since with
+        update_on_mispredict the history only takes mispredicted outcomes
+        and every table index depends on the previous predictions. The BHT
+        index of each static branch is already computed once per trace
+        (see EventBlock.get_pc_index); gathering it per event, or computing
+        the every-outcome history up front, measured no faster.
+        '''
+        num_branches = len(block)
+        predictions = bytearray(num_branches)
+        pc_sels = block.get_pc_index(self.width, self.width)
+        update_on_mispredict = self.update_on_mispredict
+
+        bht, pht, meta = self.BHT.counters, self.PHT.counters, self.meta.counters
+        bht_max, pht_max, meta_max = self.BHT.max_value, self.PHT.max_value, self.meta.max_value
+        bht_thr, pht_thr, meta_thr = self.BHT.threshold, self.PHT.threshold, self.meta.threshold
+        gbh = self.global_branch_hist.get_gbh()
+        gbh_top = 1 << (self.global_branch_hist.width - 1)
+        correct_preds = 0
+        num_updates = 0
+        bht_pred = pht_pred = meta_pred = None
+
+        for i, (branch_id, outcome) in enumerate(zip(block.branch_ids, block.taken)):
+            pc_sel = pc_sels[branch_id]
+            bht_pred = bht[pc_sel] >= bht_thr
+            pht_pred = pht[gbh] >= pht_thr
+            meta_pred = meta[gbh] >= meta_thr
+            prediction = pht_pred if meta_pred else bht_pred
+            predictions[i] = prediction
+            if prediction == outcome:
+                correct_preds += 1
+                if update_on_mispredict: continue
+
+            num_updates += 1
+            if outcome:
+                value = bht[pc_sel]
+                if value < bht_max: bht[pc_sel] = value + 1
+                value = pht[gbh]
+                if value < pht_max: pht[gbh] = value + 1
+            else:
+                value = bht[pc_sel]
+                if value > 0: bht[pc_sel] = value - 1
+                value = pht[gbh]
+                if value > 0: pht[gbh] = value - 1
+            if bht_pred != pht_pred:
+                value = meta[gbh]
+                if pht_pred == outcome:
+                    if value < meta_max: meta[gbh] = value + 1
+                elif value > 0:
+                    meta[gbh] = value - 1
+            gbh = (gbh >> 1) | (gbh_top if outcome else 0)
+
+        self.global_branch_hist.history = gbh
+        for folded in self.global_branch_hist.folded:
+            folded.recompute(self.global_branch_hist)
+        self.BHT_prediction, self.PHT_prediction, self.meta_prediction = bht_pred, pht_pred, meta_pred
+        counts = {"num_branches": num_branches,
+                  "num_correct": correct_preds,
+                  "num_updates": num_updates
+        }
+        return np.frombuffer(predictions, dtype=bool), counts
 
     def __repr__(self) -> str:
         return "BHT: " + str(self.BHT) + "\n" \
@@ -0,0 +1,135 @@
+'''
+On-disk cache of parsed branch traces
+
+Parsing a text instruction trace is by far the slowest part of a run, and
+the same traces are analyzed over and over. The cache stores the parsed
+branch events of each trace as a binary branch trace (see
+trace_format), keyed by the SHA-256 of the trace file's contents plus the
+parser and format versions, so a repeat run only hashes the file and
+memory-maps the cached arrays.
+
+The cache directory is bounded in size: whenever an entry is added, the
+least recently used entries are deleted until the total size is below the
+limit. An entry's modification time is its last use.
+'''
+
+import hashlib
+import os
+import struct
+import tempfile
+
+import trace_format
+from branch_events import BranchEvents
+from branch_predictor_info import PARSER_VERSION
+from parallel_parse import parse_trace
+
+## environment variables overriding the cache location and size limit;
+## setting BPA_CACHE_DIR to an empty string disables the cache
+CACHE_DIR_ENV = "BPA_CACHE_DIR"
+CACHE_MAX_BYTES_ENV = "BPA_CACHE_MAX_BYTES"
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "branch-prediction-analyzer")
+DEFAULT_CACHE_MAX_BYTES = 2**30 # 1 GiB
+
+CACHE_FILE_EXT = ".bpt"
+HASH_CHUNK_BYTES = 2**20
+
+def get_cache_dir():
+    '''
+    return: the cache directory, or None if caching is disabled
+    '''
+    cache_dir = os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+    if cache_dir == "": return None
+    return cache_dir
+
+def get_cache_max_bytes():
+    return int(os.environ.get(CACHE_MAX_BYTES_ENV, DEFAULT_CACHE_MAX_BYTES))
+
+def get_cache_key(instr_filepath):
+    '''
+    return: the cache key of instr_filepath, i.e. the hex SHA-256 of its
+    contents (as stored, so compressed traces are not decoded) followed
+    by the parser and binary format versions
+    '''
+    sha = hashlib.sha256()
+    with open(instr_filepath, "rb") as instr_file:
+        for chunk in iter(lambda: instr_file.read(HASH_CHUNK_BYTES), b""):
+            sha.update(chunk)
+    return f"{sha.hexdigest()}-p{PARSER_VERSION}-f{trace_format.VERSION}"
+
+def evict(cache_dir, max_bytes, keep=None):
+    '''
+    Deletes the least recently used entries of cache_dir until the
+    total size of its entries is at most max_bytes. The entry at the
+    path keep (the one just added) is never deleted.
+    '''
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(CACHE_FILE_EXT): continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue # deleted by a concurrent run
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes: break
+        if path == keep: continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+
+def load_cached_trace(instr_filepath, cache_dir=None, max_bytes=None, workers=1):
+    '''
+    Returns the BranchEvents of the text instruction trace at
+    instr_filepath (see trace_format.load_trace), which may be compressed
+    (see open_instr_file), parsing the trace only
+    if it is not cached yet. If caching is disabled, the trace is parsed
+    every time. workers is passed on to parallel_parse.parse_trace.
+    '''
+    if cache_dir is None: cache_dir = get_cache_dir()
+    if max_bytes is None: max_bytes = get_cache_max_bytes()
+    if cache_dir is None:
+        return BranchEvents.from_columns(parse_trace(instr_filepath, workers))
+
+    cache_path = os.path.join(cache_dir, get_cache_key(instr_filepath) + CACHE_FILE_EXT)
+    try:
+        os.utime(cache_path) # mark the entry as most recently used
+        return trace_format.load_trace(cache_path)
+    except FileNotFoundError:
+        pass
+    except (ValueError, struct.error):
+        # a truncated or corrupt entry (e.g. the disk filled up while it
+        # was copied) is deleted and the trace parsed again
+        try:
+            os.remove(cache_path)
+        except FileNotFoundError:
+            pass
+
+    branch_events = BranchEvents.from_columns(parse_trace(instr_filepath, workers))
+
+    # write to a temporary file first so that concurrent runs never
+    # see a partially written entry
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        trace_format.write_trace(tmp_path, branch_events)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    evict(cache_dir, max_bytes, keep=cache_path)
+    return trace_format.load_trace(cache_path)
+
+def clear_cache(cache_dir=None):
+    '''
+    Deletes every entry of the cache
+    '''
+    if cache_dir is None: cache_dir = get_cache_dir()
+    if cache_dir is None or not os.path.isdir(cache_dir): return
+    evict(cache_dir, 0)
@@ -0,0 +1,175 @@
+'''
+Compact binary branch trace format
+
+A binary branch trace (.bpt) file holds the same branch events as
+BranchPredictorInfo.grouped_branch_seqs, but as the packed integer arrays
+of a BranchEvents (see branch_events) instead of dictionaries of hex strings:
+
+    header               magic (8 bytes), format version (uint32), number of
+                         static branches (uint32), number of events (uint64),
+                         number of exceptions (uint64), number of static
+                         jumps (uint32), number of jumps (uint64)
+    static_pc            uint32 x number of static branches
+    static_target_pc     uint32 x number of static branches
+    static_ir            uint32 x number of static branches
+    branch_id            uint32 x number of events, static branch of each event
+    exception_actual_pc  uint32 x number of exceptions
+    exception_index      uint64 x number of exceptions
+    jump_static_pc       uint32 x number of static jumps
+    jump_static_ir       uint32 x number of static jumps
+    jump_id              uint32 x number of jumps, static jump of each jump
+    jump_actual_pc       uint32 x number of jumps
+    jump_branch_index    uint64 x number of jumps, branch events before each jump
+    taken_bits           uint8 x ceil(number of events / 8), taken flags, bit packed
+
+All values are little endian. Each array is loaded through numpy.memmap,
+so opening a trace is instant regardless of its size and only the pages
+that are actually touched are read from disk.
+'''
+
+import struct
+import sys
+
+import numpy as np
+
+from branch_events import BranchEvents, JumpEvents
+
+MAGIC = b"BPTRACE\0"
+VERSION = 3
+HEADER = struct.Struct("<8sIIQQIQ")
+
+def _get_layout(num_static, num_events, num_exceptions, num_static_jumps, num_jumps):
+    '''
+    return: (name, dtype, count) of each array, in the order they are stored in the file
+    '''
+    return (
+        ("static_pc", np.dtype("<u4"), num_static),
+        ("static_target_pc", np.dtype("<u4"), num_static),
+        ("static_ir", np.dtype("<u4"), num_static),
+        ("branch_id", np.dtype("<u4"), num_events),
+        ("exception_actual_pc", np.dtype("<u4"), num_exceptions),
+        ("exception_index", np.dtype("<u8"), num_exceptions),
+        ("jump_static_pc", np.dtype("<u4"), num_static_jumps),
+        ("jump_static_ir", np.dtype("<u4"), num_static_jumps),
+        ("jump_id", np.dtype("<u4"), num_jumps),
+        ("jump_actual_pc", np.dtype("<u4"), num_jumps),
+        ("jump_branch_index", np.dtype("<u8"), num_jumps),
+        ("taken_bits", np.dtype("u1"), (num_events + 7) // 8),
+    )
+
+def write_trace(trace_filepath, branch_events):
+    '''
+    Writes a BranchEvents to trace_filepath in the binary branch trace format
+    '''
+    arrays = branch_events.get_arrays()
+    num_exceptions = len(branch_events.exception_index)
+    jumps = branch_events.jumps
+    with open(trace_filepath, "wb") as trace_file:
+        trace_file.write(HEADER.pack(MAGIC, VERSION, branch_events.num_static,
+                                     branch_events.num_events, num_exceptions,
+                                     jumps.num_static, len(jumps)))
+        for name, dtype, count in _get_layout(branch_events.num_static, branch_events.num_events,
+                                              num_exceptions, jumps.num_static, len(jumps)):
+            array = np.ascontiguousarray(arrays[name], dtype=dtype)
+            if len(array) != count:
+                raise ValueError(f"{name} has {len(array)} entries, expected {count}")
+            trace_file.write(array.tobytes())
+
+def is_trace_file(filepath):
+    '''
+    return: True if filepath starts with the binary branch trace magic
+    '''
+    with open(filepath, "rb") as trace_file:
+        return trace_file.read(len(MAGIC)) == MAGIC
+
+def _read_header(header_bytes, source):
+    '''
+    Unpacks and checks a binary branch trace header
+    return: (number of static branches, number of events, number of
+    exceptions, number of static jumps, number of jumps)
+    '''
+    if len(header_bytes) < len(MAGIC) + 4 or header_bytes[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{source} is not a binary branch trace")
+    version = struct.unpack_from("<I", header_bytes, len(MAGIC))[0]
+    if version != VERSION:
+        raise ValueError(f"{source} has format version {version}, expected {VERSION}")
+    if len(header_bytes) < HEADER.size:
+        raise ValueError(f"{source} is not a binary branch trace")
+    return HEADER.unpack(header_bytes[:HEADER.size])[2:]
+
+def _make_branch_events(arrays, num_events):
+    return BranchEvents(arrays["static_pc"], arrays["static_target_pc"], arrays["static_ir"],
+                        arrays["branch_id"], arrays["taken_bits"], num_events,
+                        arrays["exception_index"], arrays["exception_actual_pc"],
+                        JumpEvents(arrays["jump_static_pc"], arrays["jump_static_ir"],
+                                   arrays["jump_id"], arrays["jump_actual_pc"],
+                                   arrays["jump_branch_index"]))
+
+def load_trace(trace_filepath):
+    '''
+    Memory-maps a binary branch trace
+    return: BranchEvents whose arrays are read-only memory maps of the file
+    '''
+    with open(trace_filepath, "rb") as trace_file:
+        counts = _read_header(trace_file.read(HEADER.size), trace_filepath)
+
+    arrays = {}
+    offset = HEADER.size
+    for name, dtype, count in _get_layout(*counts):
+        if count == 0:
+            # numpy.memmap cannot map an empty region
+            arrays[name] = np.zeros(0, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(trace_filepath, dtype=dtype, mode="r",
+                                     offset=offset, shape=(count,))
+        offset += count * dtype.itemsize
+    return _make_branch_events(arrays, counts[1])
+
+def load_trace_buffer(buffer):
+    '''
+    return: BranchEvents viewing a binary branch trace held in memory
+    (bytes, bytearray, memoryview, mmap, ...) without copying it
+    '''
+    counts = _read_header(bytes(memoryview(buffer)[:HEADER.size]), "buffer")
+
+    arrays = {}
+    offset = HEADER.size
+    for name, dtype, count in _get_layout(*counts):
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        offset += count * dtype.itemsize
+    return _make_branch_events(arrays, counts[1])
+
+def is_trace_buffer(buffer):
+    '''
+    return: True if buffer starts with the binary branch trace magic
+    '''
+    return bytes(memoryview(buffer)[:len(MAGIC)]) == MAGIC
+
+def get_mapped_filepath(branch_events):
+    '''
+    return: the file every non-empty array of branch_events is
+    memory-mapped from, or None
+    '''
+    filepaths = set(getattr(array, "filename", None) for array in branch_events.get_arrays().values()
+                    if len(array) > 0)
+    if len(filepaths) != 1: return None
+    return filepaths.pop()
+
+def convert_trace(instr_filepath, trace_filepath, workers = 1):
+    '''
+    Converts a text instruction trace (the output of instr_extract.sh,
+    compressed or not) into a binary branch trace, parsing it with
+    workers processes (see parallel_parse.parse_trace)
+    '''
+    from parallel_parse import parse_trace
+    write_trace(trace_filepath, BranchEvents.from_columns(parse_trace(instr_filepath, workers)))
+
+"""
+Converts the user-specified RISCV instruction file into a binary branch trace
+"""
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print(f"Usage: python3 {sys.argv[0]} <instruction file> <binary trace file> [parse workers]")
+        sys.exit(1)
+    workers = int(sys.argv[3]) if len(sys.argv) == 4 else 1
+    convert_trace(sys.argv[1], sys.argv[2], workers)